@@ -0,0 +1,291 @@
+import argparse
+import hashlib
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+'''
+batch evaluation of the cetacean classifier on a local copy of the kaggle data
+
+usage:
+
+    python dev/batch_eval.py --base ~/Documents/ceteans --out results/
+
+with the data laid out as follows (as in the kaggle competition):
+
+ceteans/
+├── images
+│   ├── 00021adfb725ed.jpg
+│   ├── 000562241d384d.jpg
+│   ├── ...
+└── train.csv
+
+the work is pipelined:
+1. a pool of worker threads reads + decodes images (cv2 releases the GIL)
+2. decoded images wait in a bounded prefetch queue
+3. the main thread classifies them in batches (cached predictions are reused)
+4. every `--checkpoint-every` rows, results are written as a parquet part file
+   in the `--out` directory. Rerunning with the same `--out` skips the images
+   that are already there, so an interrupted evaluation can be resumed. Rows
+   record the model (and export), the revision asked for and the commit it
+   was loaded from: a run of another model, or of 'main' after it moved, in
+   the same directory starts afresh, and only its own rows are summarised.
+
+with `--offline`, the model must already be in the local huggingface cache
+(or the local model store), no network access is attempted.
+
+with `--backend onnx --artifact DIR` (or torchscript), the classifier is run
+from an artifact exported by `dev/export_classifier.py`.
+'''
+
+_DONE = object() # end of stream marker on the prefetch queue
+
+
+def decode_image(img_file:Path) -> dict:
+    '''read an image once, and return the decoded array, its md5 and timing'''
+    start_time = time.time()
+    buf = img_file.read_bytes()
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), cv2.IMREAD_COLOR)
+    image_md5 = hashlib.md5(buf).hexdigest()
+    return {'img_id': img_file.name, 'image': image, 'image_md5': image_md5,
+            'load_time': time.time() - start_time}
+
+
+def produce(img_files:list, n_workers:int, out_q:queue.Queue) -> None:
+    '''decode images on a worker pool, feeding results (in order) to `out_q`
+
+    an image that cannot be read is passed on with `image` None and the
+    `error`, so that one bad file does not stop the evaluation
+    '''
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            # keep at most `maxsize` decodes in flight beyond the queue itself
+            pending = queue.Queue(maxsize=out_q.maxsize)
+            def _feed():
+                for f in img_files:
+                    pending.put((f, pool.submit(decode_image, f)))
+                pending.put(_DONE)
+            threading.Thread(target=_feed, daemon=True).start()
+            while True:
+                entry = pending.get()
+                if entry is _DONE:
+                    break
+                f, fut = entry
+                try:
+                    out_q.put(fut.result())
+                except Exception as e:
+                    print(f"cannot read {f}: {e}", file=sys.stderr)
+                    out_q.put({'img_id': f.name, 'image': None, 'error': str(e)})
+    finally:
+        # always end the stream, or the consumer waits forever
+        out_q.put(_DONE)
+
+
+def load_done(out_dir:Path) -> pd.DataFrame:
+    '''read the results checkpointed by previous runs'''
+    parts = sorted(out_dir.glob("part-*.parquet"))
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+
+
+def next_part(out_dir:Path) -> int:
+    '''the number of the next part file: after the highest one, so that none is overwritten'''
+    numbers = [int(p.stem[len("part-"):]) for p in out_dir.glob("part-*.parquet")
+               if p.stem[len("part-"):].isdigit()]
+    return max(numbers) + 1 if numbers else 0
+
+
+def this_model(df_done:pd.DataFrame, model_id:str, commit:str) -> pd.DataFrame:
+    '''the checkpointed results of this model and commit (others in the directory are set aside)'''
+    if df_done.empty:
+        return df_done
+    if 'model_id' not in df_done.columns or 'commit' not in df_done.columns:
+        # written before rows recorded their model commit: cannot tell which it was
+        print(f"ignoring {len(df_done)} checkpointed results that do not record their model commit",
+              file=sys.stderr)
+        return df_done.iloc[:0]
+    mine = (df_done['model_id'] == model_id) & (df_done['commit'] == commit)
+    if not mine.all():
+        print(f"ignoring {(~mine).sum()} checkpointed results of other models or commits", file=sys.stderr)
+    return df_done[mine]
+
+
+def summarise(df_results:pd.DataFrame) -> None:
+    '''print a few summary stats'''
+    if df_results.empty:
+        print("No images classified.")
+        return
+    # mean time to load and classify (formatted 3dp), +- std dev (formatted to 2dp),
+    print(f"Mean load time: {df_results['load_time'].mean():.3f} +- {df_results['load_time'].std():.2f} s")
+    # predictions served from the cache took no model time: leave them out of the mean
+    cached = df_results['cached'].fillna(False).astype(bool) if 'cached' in df_results.columns \
+        else pd.Series(False, index=df_results.index)
+    classified = df_results.loc[~cached, 'classify_time']
+    if len(classified):
+        print(f"Mean classify time: {classified.mean():.3f} +- {classified.std():.2f} s "
+              f"(over {len(classified)} images classified, {cached.sum()} from the prediction cache)")
+    else:
+        print(f"Mean classify time: n/a (all {cached.sum()} predictions from the prediction cache)")
+
+    # accuracy: count of ok / count of any
+    print(f"Accuracy: correct with top prediction: {df_results['ok'].sum()} | any of top 3 correct: {df_results['any'].sum():.3f} (of total {df_results.shape[0]})")
+    n = df_results.shape[0]
+    print(f"Top-1 accuracy: {df_results['ok'].mean():.3f} | top-3 accuracy: {df_results['any'].mean():.3f} (n={n})")
+
+    # diversity: is the model just predicting one class for everything it sees?
+    print("Which classes are predicted?")
+    print(df_results.pred_0.value_counts())
+
+
+def parse_args(argv:list = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Evaluate the cetacean classifier on a directory of images.")
+    p.add_argument("--base", type=Path, default=Path("~/Documents/ceteans/"),
+                   help="directory holding `images/` and `train.csv`")
+    p.add_argument("--images", type=Path, default=None, help="image directory (default: BASE/images)")
+    p.add_argument("--train-csv", type=Path, default=None, help="labels (default: BASE/train.csv)")
+    p.add_argument("--out", type=Path, default=Path("eval_results"), help="directory for parquet checkpoints")
+    p.add_argument("--limit", type=int, default=None, help="classify at most this many images")
+    p.add_argument("--revision", default="main", help="model revision")
+    p.add_argument("--batch-size", type=int, default=8)
+    p.add_argument("--workers", type=int, default=4, help="number of decode threads")
+    p.add_argument("--prefetch", type=int, default=32, help="max decoded images waiting for the model")
+    p.add_argument("--checkpoint-every", type=int, default=256, help="rows per parquet part file")
+    p.add_argument("--offline", action="store_true", help="never contact the huggingface hub")
+    p.add_argument("--backend", choices=["transformers", "onnx", "torchscript"], default=None,
+                   help="how to run the classifier (default: SW_CLASSIFIER_BACKEND, or transformers)")
+    p.add_argument("--artifact", default=None,
+                   help="the exported model directory, for the onnx and torchscript backends")
+    return p.parse_args(argv)
+
+
+def main(argv:list = None) -> pd.DataFrame:
+    args = parse_args(argv)
+    if args.offline:
+        # must be set before huggingface_hub / transformers are imported
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    # setup for the ML model on huggingface (our wrapper)
+    os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+    # or an exported version of it (see `src/model_export.py`)
+    if args.backend is not None:
+        os.environ["SW_CLASSIFIER_BACKEND"] = args.backend
+    if args.artifact is not None:
+        os.environ["SW_CLASSIFIER_ARTIFACT"] = str(Path(args.artifact).expanduser())
+
+    import inference_server as sw_infer
+    import model_registry as sw_models
+    import prediction_cache as sw_pcache
+
+    base = args.base.expanduser()
+    img_pth = (args.images or base / 'images').expanduser()
+    df = pd.read_csv((args.train_csv or base / 'train.csv').expanduser())
+    targets = dict(zip(df['image'], df['species']))
+
+    cetacean_classifier = sw_models.get_cetacean_classifier(revision=args.revision)
+    batch_fn = sw_infer.make_batch_fn(cetacean_classifier)
+    cache = sw_pcache.get_cache()
+
+    # the results of other models (or commits, or exports) in `--out` are
+    # neither resumed nor summarised: each row records what produced it.
+    # The commit, not the revision: 'main' moves (or is re-pinned in the store)
+    model_id = sw_models.prediction_model_id()
+    commit = sw_models.get_cetacean_commit(args.revision)
+    print(f"model {model_id}@{args.revision}: commit {commit}")
+    out_dir = args.out.expanduser()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    df_done = this_model(load_done(out_dir), model_id, commit)
+    done = set(df_done['img_id']) if len(df_done) else set()
+    part_no = next_part(out_dir)
+
+    img_files = sorted(img_pth.glob('*.jpg'))
+    if args.limit is not None:
+        img_files = img_files[:args.limit]
+    todo = [f for f in img_files if f.name not in done]
+    print(f"{len(img_files)} images, {len(done)} already done, {len(todo)} to classify")
+
+    prefetch_q = queue.Queue(maxsize=args.prefetch)
+    threading.Thread(target=produce, args=(todo, args.workers, prefetch_q), daemon=True).start()
+
+    rows = []
+    failures = [] # images that could not be read or decoded
+    n_classified = len(done)
+    def _checkpoint():
+        nonlocal rows, part_no
+        if rows:
+            pd.DataFrame(rows).to_parquet(out_dir / f"part-{part_no:05d}.parquet", index=False)
+            part_no += 1
+            rows = []
+
+    def _classify(batch:list) -> None:
+        nonlocal n_classified
+        # reuse cached predictions, send the rest to the model as one batch
+        outs = [cache.get(item['image_md5'], model_id, commit) for item in batch]
+        misses = [i for i, o in enumerate(outs) if o is None]
+        classify_time = 0.0
+        if misses:
+            start_time = time.time()
+            results = batch_fn([batch[i]['image'] for i in misses])
+            classify_time = (time.time() - start_time) / len(misses)
+            for i, res in zip(misses, results):
+                cache.put(batch[i]['image_md5'], model_id, commit, res)
+                outs[i] = res
+
+        for i, (item, out) in enumerate(zip(batch, outs)):
+            target = targets.get(item['img_id'])
+            preds = list(out['predictions'])
+            row = {'img_id': item['img_id'], 'model_id': model_id, 'revision': args.revision, 'commit': commit,
+                   'target': target,
+                   'ok': preds[0] == target, 'any': target in preds,
+                   'load_time': item['load_time'], 'cached': i not in misses,
+                   'classify_time': classify_time if i in misses else 0.0,
+                   'image_md5': item['image_md5']}
+            row.update({f'pred_{i}': p for i, p in enumerate(preds[:3])})
+            rows.append(row)
+        n_classified += len(batch)
+        print(f"{n_classified}/{len(img_files)} | last: {batch[-1]['img_id']} {preds[:3]}")
+
+    batch = []
+    while True:
+        item = prefetch_q.get()
+        if item is _DONE:
+            break
+        if item['image'] is None:
+            # unreadable, or not an image cv2 can decode (e.g. a truncated jpeg)
+            failures.append({'img_id': item['img_id'], 'error': item.get('error', "cannot decode")})
+            continue
+        batch.append(item)
+        if len(batch) >= args.batch_size:
+            _classify(batch)
+            batch = []
+        if len(rows) >= args.checkpoint_every:
+            _checkpoint()
+    if batch:
+        _classify(batch)
+    _checkpoint()
+
+    if failures:
+        # not checkpointed as results, so they are tried again when resuming
+        pd.DataFrame(failures).to_csv(out_dir / "failures.csv", index=False)
+        print(f"{len(failures)} images could not be decoded, see {out_dir / 'failures.csv'}")
+
+    df_results = this_model(load_done(out_dir), model_id, commit)
+    if len(df_results):
+        df_results = df_results[df_results['img_id'].isin({f.name for f in img_files})]
+    summarise(df_results)
+    print(f"Prediction cache: {cache.stats()}")
+    return df_results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+'''
+benchmarks of the app's hot paths, with fixed-seed synthetic inputs
+
+run from the repository root:
+
+    python -m dev.benchmarks run --out bench.json              # all suites
+    python -m dev.benchmarks run --suites input_handling st_logs --quick --out bench.json
+    python -m dev.benchmarks compare base.json bench.json --threshold 1.25
+
+`run` writes the results as JSON, with a description of the machine; `compare`
+matches the benchmarks of two runs, and exits with status 1 if any got slower
+by more than the threshold ratio (median time). Compare runs made on the same
+machine: the machine info of both is printed, to make a mismatch visible.
+
+the bench_* modules can also be run on their own, for their design comparisons
+(e.g. `python -m dev.benchmarks.bench_exif`). `bench_imports` reports the
+import time of the app per package (`python -m dev.benchmarks.bench_imports`).
+
+`python -m dev.benchmarks.loadtest` is a load test of the whole app: many
+simulated sessions running the observation flow at rising concurrency, see
+`dev/benchmarks/loadtest.py`.
+'''
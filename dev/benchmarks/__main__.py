@@ -0,0 +1,86 @@
+import argparse
+import sys
+
+import pandas as pd
+
+from . import common
+
+'''
+command line of the benchmark suite, see `dev/benchmarks/__init__.py`
+'''
+
+# suite name -> module (imported when run, so one suite's imports do not slow the others)
+SUITES = {
+    'input_handling': 'bench_input',
+    'obs_map': 'bench_obs_map',
+    'st_logs': 'bench_st_logs',
+    'inference': 'bench_inference',
+    'imports': 'bench_imports',
+}
+
+
+def run_suites(suites:list, quick:bool, seed:int, real_model:bool = False) -> list:
+    import importlib
+    results = []
+    for suite in suites:
+        print(f"running {suite}...", file=sys.stderr)
+        module = importlib.import_module(f".{SUITES[suite]}", __package__)
+        kwargs = {'real_model': real_model} if suite == 'inference' else {}
+        results.extend(module.run(quick=quick, seed=seed, **kwargs))
+    return results
+
+
+def compare_runs(base:dict, new:dict, threshold:float) -> pd.DataFrame:
+    '''match the results of two runs, and flag those that got slower (or faster) than the threshold'''
+    base_t = {common.key(r): r['median_s'] for r in base['results']}
+    rows = []
+    for r in new['results']:
+        k = common.key(r)
+        if k not in base_t:
+            continue
+        ratio = r['median_s'] / base_t[k] if base_t[k] > 0 else float("nan")
+        rows.append({'benchmark': k, 'base_ms': base_t[k] * 1e3, 'new_ms': r['median_s'] * 1e3,
+                     'ratio': ratio, 'regression': ratio > threshold, 'improvement': ratio < 1 / threshold})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(prog="python -m dev.benchmarks", description="Benchmark the app's hot paths.")
+    sub = p.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="run the benchmarks, write the results as JSON")
+    p_run.add_argument("--suites", nargs="+", choices=list(SUITES), default=list(SUITES))
+    p_run.add_argument("--quick", action="store_true", help="smaller inputs, for a fast check")
+    p_run.add_argument("--seed", type=int, default=common.SEED)
+    p_run.add_argument("--real-model", action="store_true",
+                       help="time the cetacean classifier itself, instead of a numpy stand-in")
+    p_run.add_argument("--out", default="bench.json")
+    p_cmp = sub.add_parser("compare", help="compare two runs, flag regressions")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=1.25,
+                       help="a ratio of median times above this is a regression")
+    args = p.parse_args()
+
+    pd.set_option("display.width", 200)
+    if args.command == "run":
+        results = run_suites(args.suites, args.quick, args.seed, args.real_model)
+        common.write_results(args.out, results, {'suites': args.suites, 'quick': args.quick,
+                                                 'seed': args.seed, 'real_model': args.real_model})
+        df = pd.DataFrame([{'benchmark': common.key(r), 'median_ms': r['median_s'] * 1e3,
+                            'iqr_ms': r['iqr_s'] * 1e3, 'items_per_s': r.get('items_per_s')} for r in results])
+        print(df.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        print(f"results written to {args.out}")
+    else:
+        base, new = common.load_results(args.base), common.load_results(args.new)
+        for name, run in (("base", base), ("new", new)):
+            m = run['machine']
+            print(f"{name}: {run['created']} {m['cpu']} x{m['cpu_count']}, python {m['python']}, "
+                  f"commit {m['git_commit']}, config {run['config']}")
+        df = compare_runs(base, new, args.threshold)
+        print(df.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        if df.empty:
+            print("no benchmarks in common")
+        elif df['regression'].any():
+            print(f"\n{int(df['regression'].sum())} regression(s) above x{args.threshold}:")
+            print("\n".join(df.loc[df['regression'], 'benchmark']))
+            sys.exit(1)
@@ -0,0 +1,112 @@
+import argparse
+import io
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from PIL import ExifTags, Image
+
+from . import common
+import exif_meta as sw_exif
+
+'''
+compare ways of reading the date-time and GPS position from image metadata:
+- 'exif_meta': our parser, which only walks the segment headers to the EXIF block
+- 'pil_getexif': PIL, opening the image (headers only) and reading the sub-IFDs
+- 'pil_getexif_walk': the previous approach, `_getexif()` with a TAGS lookup per tag
+- 'exifread': as in snippets/extract_meta.py (if exifread is installed)
+
+the inputs are synthetic JPEGs of the given sizes, with EXIF including GPS
+(and any files given with --files). Each reader gets the bytes in memory.
+
+usage:
+
+    python -m dev.benchmarks.bench_exif --megapixels 1 12 48 --repeat 50
+'''
+
+
+def synthetic_jpeg(megapixels:float, seed:int = common.SEED) -> bytes:
+    '''a noisy jpeg of about the given size, with datetime and GPS EXIF tags'''
+    rng = np.random.default_rng(seed)
+    h = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    w = int(h * 4 / 3)
+    pixels = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "bench"
+    exif[ExifTags.Base.DateTime] = "2024:01:01 00:00:00"
+    exif[ExifTags.IFD.Exif] = {ExifTags.Base.DateTimeOriginal: "2024:10:24 15:59:45"}
+    exif[ExifTags.IFD.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (46.0, 31.0, 6.97),
+                                  ExifTags.GPS.GPSLongitudeRef: "E", ExifTags.GPS.GPSLongitude: (6.0, 33.0, 43.47)}
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=90, exif=exif)
+    return buf.getvalue()
+
+
+def read_pil_getexif(data:bytes) -> tuple:
+    exif = Image.open(io.BytesIO(data)).getexif()
+    dt = exif.get_ifd(ExifTags.IFD.Exif).get(ExifTags.Base.DateTimeOriginal)
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    return dt, gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLongitude)
+
+
+def read_pil_getexif_walk(data:bytes) -> tuple:
+    exif_data = Image.open(io.BytesIO(data))._getexif() or {}
+    dt = gps = None
+    for tag, value in exif_data.items():
+        name = ExifTags.TAGS.get(tag)
+        if name == 'DateTimeOriginal':
+            dt = value
+        elif name == 'GPSInfo':
+            gps = value
+    return dt, gps
+
+
+def read_exifread(data:bytes) -> tuple:
+    import exifread
+    tags = exifread.process_file(io.BytesIO(data), details=False)
+    return tags.get('EXIF DateTimeOriginal'), tags.get('GPS GPSLatitude'), tags.get('GPS GPSLongitude')
+
+
+READERS = {
+    'exif_meta': sw_exif.read_exif,
+    'pil_getexif': read_pil_getexif,
+    'pil_getexif_walk': read_pil_getexif_walk,
+    'exifread': read_exifread,
+}
+
+
+def time_reader(fn, data:bytes, repeat:int) -> float:
+    '''median time of one call, in microseconds'''
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn(data)
+        times.append(time.perf_counter() - start_time)
+    return float(np.median(times)) * 1e6
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark EXIF date-time/GPS extraction.")
+    p.add_argument("--megapixels", type=float, nargs="+", default=[1, 12, 48])
+    p.add_argument("--files", type=Path, nargs="*", default=[], help="also time these image files")
+    p.add_argument("--repeat", type=int, default=50)
+    args = p.parse_args()
+
+    try:
+        import exifread # noqa: F401
+    except ImportError:
+        print("exifread is not installed, skipping it")
+        READERS.pop('exifread')
+
+    inputs = [(f"synthetic {mp:g}MP", synthetic_jpeg(mp)) for mp in args.megapixels]
+    inputs += [(f.name, f.read_bytes()) for f in args.files]
+
+    results = []
+    for name, data in inputs:
+        print(f"{name}: {len(data) / 2**20:.1f} MiB, exif_meta -> {sw_exif.read_exif(data)}")
+        for reader, fn in READERS.items():
+            results.append({'input': name, 'mib': round(len(data) / 2**20, 1), 'reader': reader,
+                            'median_us': round(time_reader(fn, data, args.repeat), 1)})
+    df = pd.DataFrame(results)
+    print(df.pivot(index=['input', 'mib'], columns='reader', values='median_us').to_string())
@@ -0,0 +1,140 @@
+import argparse
+import ast
+import subprocess
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from . import common
+
+'''
+the imports suite: how long the app takes to import, and which packages cost the most
+
+every measurement starts a fresh interpreter with `python -X importtime`, runs
+the import statements of the target, and parses the report (on stderr, one
+line per module: `import time: self [us] | cumulative | module`, the module
+indented by its nesting). A package is charged the cumulative time of its
+outermost import, which includes the packages it imports first.
+
+the 'app' target is the top-level imports of `src/main.py`, read from the
+file, so the benchmark follows the code: this is what every new app process
+pays before the first element is shown. The packages that the app should only
+import when a tab or an action needs them (`DEFERRED`) are flagged if they
+are imported up front.
+
+usage:
+
+    python -m dev.benchmarks.bench_imports                 # the app
+    python -m dev.benchmarks.bench_imports --target obs_map --top 20
+'''
+
+# imported on demand by the app: the model and hub libraries, the map, opencv, PIL
+DEFERRED = ("torch", "transformers", "datasets", "huggingface_hub", "folium", "branca",
+            "streamlit_folium", "cv2", "onnxruntime", "PIL")
+
+
+def app_imports() -> str:
+    '''the top-level import statements of src/main.py'''
+    path = common.SRC_DIR / "main.py"
+    source = path.read_text()
+    return "\n".join(ast.get_source_segment(source, node) for node in ast.parse(source).body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def importtime(statements:str) -> List[dict]:
+    """
+    Run import statements in a fresh interpreter, with `-X importtime`.
+
+    Args:
+        statements (str): The python code (import statements).
+
+    Returns:
+        List[dict]: One dict per imported module, in the order of the report,
+            with the keys 'module', 'depth', 'self_us' and 'cumulative_us'.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statements], cwd=common.SRC_DIR,
+                          capture_output=True, text=True, timeout=600)
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing failed: {proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append({'module': name.strip(), 'depth': depth,
+                     'self_us': int(self_us), 'cumulative_us': int(cumulative_us)})
+    return rows
+
+
+def by_package(rows:List[dict]) -> Dict[str, float]:
+    '''the cumulative import time (s) of each top-level package, from its outermost import'''
+    # a module is reported after the modules it imports, so the parent of a
+    # line is the next line (below it in the report) with a smaller depth
+    totals = {}
+    open_packages = [] # (depth, package) of the enclosing imports, from the outside in
+    for row in reversed(rows):
+        while open_packages and open_packages[-1][0] >= row['depth']:
+            open_packages.pop()
+        package = row['module'].split(".")[0]
+        if package not in (p for _, p in open_packages):
+            totals[package] = totals.get(package, 0) + row['cumulative_us'] / 1e6
+        open_packages.append((row['depth'], package))
+    return totals
+
+
+def profile(statements:str, repeat:int = 5) -> dict:
+    """
+    Measure the import time of some statements, over fresh interpreters.
+
+    Args:
+        statements (str): The import statements.
+        repeat (int): The number of interpreters. Default is 5.
+
+    Returns:
+        dict: 'total' (the times of the whole import, s), 'packages' (package
+            -> its times, s) and 'modules' (the names of all modules imported).
+    """
+    totals, packages, modules = [], {}, set()
+    for _ in range(repeat):
+        rows = importtime(statements)
+        totals.append(sum(r['cumulative_us'] for r in rows if r['depth'] == 0) / 1e6)
+        for package, seconds in by_package(rows).items():
+            packages.setdefault(package, []).append(seconds)
+        modules.update(r['module'] for r in rows)
+    return {'total': totals, 'packages': packages, 'modules': modules}
+
+
+def run(quick:bool = False, seed:int = common.SEED, min_s:float = 0.01) -> List[dict]:
+    '''the suite: the app's import time, and that of each package costing at least `min_s`'''
+    repeat = 3 if quick else 7
+    prof = profile(app_imports(), repeat)
+    results = [common.result("imports", "app", common.summarize(prof['total']))]
+    for package, times in sorted(prof['packages'].items()):
+        # a package imported in some rounds only (not expected) counts 0 in the others
+        times = times + [0.0] * (repeat - len(times))
+        if np.median(times) >= min_s:
+            results.append(common.result("imports", "package", common.summarize(times), package=package))
+    eager = sorted({m.split(".")[0] for m in prof['modules']} & set(DEFERRED))
+    if eager:
+        print(f"imports: the app imports {eager} up front", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Report the import time of the app (or of a module), per package.")
+    p.add_argument("--target", default="app", help="'app' (the imports of main.py), or a module in src/")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--top", type=int, default=15, help="the number of packages shown")
+    args = p.parse_args()
+
+    statements = app_imports() if args.target == "app" else f"import {args.target}"
+    prof = profile(statements, args.repeat)
+    df = pd.DataFrame({'median_ms': {k: np.median(v) * 1e3 for k, v in prof['packages'].items()}})
+    df['share'] = df['median_ms'] / (np.median(prof['total']) * 1e3)
+    print(f"{args.target}: {np.median(prof['total']) * 1e3:.0f} ms to import (median of {args.repeat})")
+    print(df.sort_values('median_ms', ascending=False).head(args.top).round(3).to_string())
+    eager = sorted({m.split(".")[0] for m in prof['modules']} & set(DEFERRED))
+    print(f"deferred packages imported up front: {eager or 'none'}")
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+import cv2
+import numpy as np
+
+from . import common
+import inference_server as sw_infer
+import whale_viewer as sw_wv
+
+'''
+the inference suite: classifying synthetic images, one at a time and batched
+
+by default the model is a numpy stand-in for the cetacean classifier, with
+the same interface and a fixed amount of work per image (resize to 224x224,
+normalise, one dense layer to the species logits). It is deterministic and
+needs no download or GPU, so it tracks the cost of our side of inference
+(preprocessing, batching, the batching server's queueing) across runs.
+
+with `real_model=True` (`--real-model`), the cetacean classifier itself is
+loaded through the model registry (needs torch, transformers and the hub, or
+a local cache), and timed the same way.
+'''
+
+INPUT_SIDE = 224
+
+
+class StandInClassifier:
+    """
+    A deterministic numpy stand-in for the cetacean classifier
+
+    Args:
+        seed (int): Seeds the weights.
+        top_k (int): The number of species returned per image. Default is 3.
+    """
+    def __init__(self, seed:int = common.SEED, top_k:int = 3):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.standard_normal((INPUT_SIDE * INPUT_SIDE * 3, len(sw_wv.WHALE_CLASSES)),
+                                           dtype=np.float32) * 1e-3
+        self.top_k = top_k
+        self.resolved_commit = f"standin-{seed}" # the predictions it caches are keyed on this
+
+    def _preprocess(self, image:np.ndarray) -> np.ndarray:
+        x = cv2.resize(image, (INPUT_SIDE, INPUT_SIDE), interpolation=cv2.INTER_AREA)
+        return (x.astype(np.float32) / 127.5 - 1.0).reshape(-1)
+
+    def predict_batch(self, images:List[np.ndarray]) -> List[dict]:
+        logits = np.stack([self._preprocess(img) for img in images]) @ self.weights
+        ranked = np.argsort(-logits, axis=1)[:, :self.top_k]
+        return [{'predictions': [sw_wv.WHALE_CLASSES[i] for i in row]} for row in ranked]
+
+    def __call__(self, image:np.ndarray) -> dict:
+        return self.predict_batch([image])[0]
+
+
+def synthetic_images(n:int, seed:int = common.SEED, side:int = 1024) -> List[np.ndarray]:
+    '''noisy RGB images at the app's model size (longest side 1024, 4:3)'''
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (side * 3 // 4, side, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def _load_model(real_model:bool, seed:int) -> Any:
+    if not real_model:
+        return StandInClassifier(seed)
+    import model_registry as sw_models
+    return sw_models.get_cetacean_classifier()
+
+
+def run(quick:bool = False, seed:int = common.SEED, real_model:bool = False) -> List[dict]:
+    '''the suite: per-image and batched classification, and the batching server'''
+    results = []
+    backend = "cetacean-classifier" if real_model else "numpy-standin"
+    model = _load_model(real_model, seed)
+    batch_fn = sw_infer.make_batch_fn(model)
+    images = synthetic_images(8 if quick else 32, seed)
+    repeat = 3 if real_model else 7
+
+    results.append(common.result("inference", "single", common.timeit(
+        lambda: model(images[0]), repeat=repeat), items=1, backend=backend))
+    for batch_size in (4, 8):
+        batch = images[:batch_size]
+        results.append(common.result("inference", "batch", common.timeit(
+            lambda: batch_fn(batch), repeat=repeat), items=batch_size, backend=backend, batch_size=batch_size))
+
+    # concurrent sessions, each classifying its image through the batching server
+    server = sw_infer.BatchingInferenceServer(batch_fn, max_batch_size=8, max_wait_ms=5)
+    n_clients = 8
+    with ThreadPoolExecutor(n_clients) as pool:
+        def burst():
+            return list(pool.map(server.predict, images))
+        results.append(common.result("inference", "server", common.timeit(burst, repeat=repeat),
+                                     items=len(images), backend=backend, clients=n_clients,
+                                     images=len(images)))
+    server.stop()
+    return results
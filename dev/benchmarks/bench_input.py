@@ -0,0 +1,63 @@
+import hashlib
+from typing import List
+
+import cv2
+import numpy as np
+
+from . import common
+from .bench_exif import synthetic_jpeg
+import exif_meta as sw_exif
+import input_handling as sw_inp
+
+'''
+the input_handling suite: what happens to an uploaded image, and the form checks
+
+on synthetic JPEGs (noise, with EXIF incl. GPS) of a few sizes, we time:
+- 'decode': `decode_bounded` to the model size (what the app does)
+- 'decode_full': a full-resolution `cv2.imdecode`, for reference
+- 'exif': `exif_meta.read_exif`
+- 'hash': md5 of the file bytes
+- 'ingest': `ingest_image`, all of the above plus the thumbnail
+and the email and number validation of the form, on a fixed list of inputs.
+'''
+
+
+def synthetic_form_inputs(n:int, seed:int = common.SEED) -> tuple:
+    '''email addresses and coordinates as typed in the form, some of them invalid'''
+    rng = np.random.default_rng(seed)
+    names = ["anna.b", "whale_watcher", "j.doe+sw", "x", "bad address", "no-at-sign.org"]
+    domains = ["example.com", "epfl.ch", "uni.edu", "mail", ""]
+    emails = [f"{rng.choice(names)}@{rng.choice(domains)}" for _ in range(n)]
+    numbers = [f"{v:.{int(rng.integers(0, 7))}f}" for v in rng.uniform(-180, 180, n)]
+    invalid = ["46,5", "abc", "", "-", "1e5"]
+    for i in range(0, n, 10):
+        numbers[i] = invalid[(i // 10) % len(invalid)]
+    return emails, numbers
+
+
+def run(quick:bool = False, seed:int = common.SEED) -> List[dict]:
+    '''the suite: decode, EXIF, hashing, full ingest, and form validation'''
+    results = []
+    for mp in ([1, 12] if quick else [1, 12, 48]):
+        data = synthetic_jpeg(mp, seed)
+        buf = memoryview(data)
+        repeat = 5 if mp >= 12 else 15
+        params = {'megapixels': mp}
+        results.append(common.result("input_handling", "decode", common.timeit(
+            lambda: sw_inp.decode_bounded(buf, sw_inp.MODEL_MAX_SIDE), repeat=repeat), **params))
+        results.append(common.result("input_handling", "decode_full", common.timeit(
+            lambda: cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR), repeat=repeat), **params))
+        results.append(common.result("input_handling", "exif", common.timeit(
+            lambda: sw_exif.read_exif(buf), repeat=15, number=100), **params))
+        results.append(common.result("input_handling", "hash", common.timeit(
+            lambda: hashlib.md5(buf).hexdigest(), repeat=repeat), **params))
+        results.append(common.result("input_handling", "ingest", common.timeit(
+            lambda: sw_inp.ingest_image(buf, f"synthetic_{mp}mp.jpg"), repeat=repeat), **params))
+
+    n = 1000
+    emails, numbers = synthetic_form_inputs(n, seed)
+    results.append(common.result("input_handling", "validate_email", common.timeit(
+        lambda: [sw_inp.is_valid_email(e) for e in emails], repeat=15), items=n, n=n))
+    results.append(common.result("input_handling", "validate_number", common.timeit(
+        lambda: [sw_inp.is_valid_number(x) for x in numbers], repeat=15), items=n, n=n))
+    return results
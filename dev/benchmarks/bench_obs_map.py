@@ -0,0 +1,115 @@
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from . import common
+import obs_agg as sw_agg
+import obs_map as sw_map
+import obs_store as sw_store
+import whale_viewer as sw_wv
+
+'''
+compare the two ways of drawing observations on the map:
+- 'markers': one folium.Marker per row (the original path)
+- 'geojson': all rows serialised into one GeoJSON layer
+
+for each size, we time building the map and rendering it to html (which is
+what streamlit_folium sends to the browser), and report the html size.
+
+as part of the suite (`run`), we also time building the map dataframe from a
+parquet file of observations (as the observation store does, uncached).
+
+usage:
+
+    python -m dev.benchmarks.bench_obs_map --sizes 1000 10000 100000 --max-markers 10000
+'''
+
+
+def synthetic_obs(n:int, seed:int = common.SEED) -> pd.DataFrame:
+    '''random observations, spread over the oceans-ish'''
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'lat': rng.uniform(-70, 70, n),
+        'lon': rng.uniform(-180, 180, n),
+        'species': rng.choice(sw_wv.WHALE_CLASSES, n),
+    })
+
+
+def time_render(df:pd.DataFrame, render_mode:str) -> dict:
+    start_time = time.perf_counter()
+    map_ = sw_map.create_map(None, (0, 10), zoom_start=2)
+    if render_mode == 'markers':
+        sw_map.add_obs_markers(map_, df)
+    else:
+        sw_map.add_obs_geojson(map_, df)
+    build_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    html = map_.get_root().render()
+    render_time = time.perf_counter() - start_time
+    return {'mode': render_mode, 'n': len(df), 'build_s': round(build_time, 3),
+            'render_s': round(render_time, 3), 'html_mib': round(len(html) / 2**20, 2)}
+
+
+def run(quick:bool = False, seed:int = common.SEED) -> List[dict]:
+    '''the suite: dataframe build, and map html generation per render mode'''
+    results = []
+    sizes = [1000, 10000] if quick else [1000, 10000, 100000]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n in sizes:
+            df = synthetic_obs(n, seed)
+            # the dataset's own column names, as written by the app
+            path = os.path.join(tmp_dir, f"obs_{n}.parquet")
+            df.rename(columns={v: k for k, v in sw_store.MAP_COLUMNS.items()}).to_parquet(path)
+            timing = common.timeit(lambda: sw_store.ObservationStore().query(path, None), repeat=5)
+            results.append(common.result("obs_map", "dataframe_build", timing, items=n, n=n))
+
+            for mode in sw_map.RENDER_MODES:
+                if mode == 'markers' and n > (1000 if quick else 10000):
+                    continue # one folium.Marker per row: ~10s at 10k, minutes at 100k
+                def build():
+                    map_ = sw_map.create_map(None, (0, 10), zoom_start=2)
+                    if mode == 'markers':
+                        sw_map.add_obs_markers(map_, df)
+                    elif mode == 'aggregate':
+                        # the world view: per-cell counts at zoom 2
+                        pyramid = sw_agg.build_zoom_pyramid(df)
+                        kind, sel = sw_agg.select_for_view(df, pyramid, 2, None)
+                        if kind == 'aggregate':
+                            sw_map.add_obs_aggregates(map_, sel)
+                        else:
+                            sw_map.add_obs_geojson(map_, sel)
+                    else:
+                        sw_map.add_obs_geojson(map_, df)
+                    return map_
+                map_ = build()
+                repeat = 3 if n >= 10000 else 5
+                results.append(common.result("obs_map", "map_build", common.timeit(build, repeat=repeat),
+                                             items=n, n=n, mode=mode))
+                results.append(common.result("obs_map", "map_html", common.timeit(
+                    lambda: map_.get_root().render(), repeat=repeat), items=n, n=n, mode=mode))
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark observation map rendering.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    p.add_argument("--max-markers", type=int, default=10000,
+                   help="skip the per-row marker path above this size (it is very slow)")
+    args = p.parse_args()
+
+    results = []
+    for n in args.sizes:
+        df = synthetic_obs(n)
+        for mode in ['geojson', 'markers']:
+            if mode == 'markers' and n > args.max_markers:
+                continue
+            res = time_render(df, mode)
+            print(res)
+            results.append(res)
+    print(pd.DataFrame(results).to_string(index=False))
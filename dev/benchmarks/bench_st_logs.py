@@ -0,0 +1,149 @@
+import argparse
+import logging
+import time
+from collections import deque
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from . import common
+import st_logs as sw_logs
+
+'''
+compare the log buffer designs for the Log tab:
+- 'deque': the previous design; each record is formatted to a line and kept
+  in a deque, and the Log tab parses the lines back with a regex
+- 'ring': records are kept as fields in a preallocated ring buffer, and the
+  Log tab queries them (here: newest 500, and warnings only)
+- 'queued': as 'ring', behind the QueueLogHandler; the emit time is what the
+  logging call costs the caller, the records are stored by the writer thread
+
+for each buffer size, we time emitting records through a logger (per record),
+and building the Log tab table (parse or query, to a dataframe). for the
+queued design, the handler's own overhead report and drop count are added.
+
+usage:
+
+    python -m dev.benchmarks.bench_st_logs --sizes 15 1000 20000
+'''
+
+FORMAT = '%(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s'
+
+
+class _NullContainer:
+    '''stands in for the streamlit container (only used in debug mode)'''
+    def empty(self):
+        return self
+
+
+class DequeLogHandler(logging.Handler):
+    '''the previous StreamlitLogHandler.emit: format, then keep the line'''
+    def __init__(self, maxlen:int):
+        super().__init__()
+        self.buffer = deque(maxlen=maxlen)
+        self._n = 0
+
+    def emit(self, record):
+        self._n += 1
+        self.buffer.append(f"[{self._n}]" + self.format(record))
+
+
+def make_logger(handler:logging.Handler) -> logging.Logger:
+    handler.setFormatter(logging.Formatter(FORMAT))
+    logger = logging.getLogger(f"bench.{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    return logger
+
+
+def time_emit(logger:logging.Logger, n:int, seed:int = common.SEED) -> float:
+    '''mean time to log one record, in microseconds'''
+    rng = np.random.default_rng(seed)
+    levels = rng.choice([logging.DEBUG, logging.INFO, logging.WARNING], n, p=[0.3, 0.6, 0.1])
+    start_time = time.perf_counter()
+    for i, level in enumerate(levels):
+        logger.log(int(level), "observation %d processed in %.3f s", i, 0.123)
+    return (time.perf_counter() - start_time) / n * 1e6
+
+
+def time_table(fn, repeat:int = 5) -> float:
+    '''median time to build the Log tab table, in milliseconds'''
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return float(np.median(times)) * 1e3
+
+
+def run(quick:bool = False, seed:int = common.SEED) -> List[dict]:
+    '''the suite: emit throughput per handler, and building the Log tab table'''
+    results = []
+    n = 5000 if quick else 20000
+    rng = np.random.default_rng(seed)
+    levels = [int(lv) for lv in rng.choice([logging.DEBUG, logging.INFO, logging.WARNING], n, p=[0.3, 0.6, 0.1])]
+
+    def emit_all(logger):
+        for i, level in enumerate(levels):
+            logger.log(level, "observation %d processed in %.3f s", i, 0.123)
+
+    legacy = DequeLogHandler(maxlen=n)
+    direct = sw_logs.StreamlitLogHandler(_NullContainer(), maxlen=n)
+    queued_target = sw_logs.StreamlitLogHandler(_NullContainer(), maxlen=n)
+    queued_target.setFormatter(logging.Formatter(FORMAT))
+    queued = sw_logs.QueueLogHandler(queued_target, capacity=n * 10) # no drops: we time the caller's side
+    for design, handler in [('deque', legacy), ('ring', direct), ('queued', queued)]:
+        logger = make_logger(handler)
+        results.append(common.result("st_logs", "emit", common.timeit(lambda: emit_all(logger), repeat=5),
+                                     items=n, n=n, handler=design))
+    queued.flush(timeout=60)
+    queued.close()
+
+    results.append(common.result("st_logs", "parse_log_buffer", common.timeit(
+        lambda: sw_logs.parse_log_buffer(legacy.buffer), repeat=5), items=n, n=n, buffer='deque'))
+    results.append(common.result("st_logs", "parse_log_buffer", common.timeit(
+        lambda: sw_logs.parse_log_buffer(direct.buffer), repeat=5), items=n, n=n, buffer='ring'))
+    results.append(common.result("st_logs", "query", common.timeit(
+        lambda: direct.buffer.query(limit=500), repeat=7), n=n, limit=500))
+    results.append(common.result("st_logs", "query", common.timeit(
+        lambda: direct.buffer.query(min_level=logging.WARNING, limit=500), repeat=7), n=n, limit=500,
+        min_level='WARNING'))
+    return results
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark the Log tab buffer.")
+    p.add_argument("--sizes", type=int, nargs="+", default=[15, 1000, 20000])
+    args = p.parse_args()
+
+    results = []
+    for size in args.sizes:
+        legacy = DequeLogHandler(maxlen=size)
+        emit_us = time_emit(make_logger(legacy), size)
+        table_ms = time_table(lambda: pd.DataFrame(sw_logs.parse_log_buffer(legacy.buffer)[::-1]))
+        results.append({'design': 'deque', 'size': size, 'emit_us': round(emit_us, 2),
+                        'table_all_ms': round(table_ms, 2), 'table_500_ms': None, 'warnings_ms': None})
+
+        ring = sw_logs.StreamlitLogHandler(_NullContainer(), maxlen=size)
+        emit_us = time_emit(make_logger(ring), size)
+        results.append({'design': 'ring', 'size': size, 'emit_us': round(emit_us, 2),
+                        'table_all_ms': round(time_table(lambda: ring.buffer.query()), 2),
+                        'table_500_ms': round(time_table(lambda: ring.buffer.query(limit=500)), 2),
+                        'warnings_ms': round(time_table(lambda: ring.buffer.query(min_level=logging.WARNING,
+                                                                                   limit=500)), 2)})
+
+        queued = sw_logs.StreamlitLogHandler(_NullContainer(), maxlen=size)
+        queued.setFormatter(logging.Formatter(FORMAT))
+        queue = sw_logs.QueueLogHandler(queued, capacity=size)
+        emit_us = time_emit(make_logger(queue), size)
+        queue.flush(timeout=30)
+        queue_stats = queue.stats()
+        queue.close()
+        results.append({'design': 'queued', 'size': size, 'emit_us': round(emit_us, 2),
+                        'table_all_ms': round(time_table(lambda: queued.buffer.query()), 2),
+                        'table_500_ms': round(time_table(lambda: queued.buffer.query(limit=500)), 2),
+                        'warnings_ms': None, 'handler_emit_us': queue_stats['emit_mean_us'],
+                        'dropped': queue_stats['dropped']})
+    print(pd.DataFrame(results).to_string(index=False))
@@ -0,0 +1,169 @@
+from typing import Callable, Dict, List
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# the app modules are imported from src/
+SRC_DIR = Path(__file__).resolve().parents[2] / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+'''
+shared pieces of the benchmark suites: timing, result records and machine info
+
+every suite module has a `run(quick:bool, seed:int) -> List[dict]`, returning
+records made with `result()`. All synthetic inputs are generated from `seed`,
+so two runs on the same machine time the same work.
+'''
+
+SEED = 42
+
+
+def timeit(fn:Callable[[], object], repeat:int = 7, number:int = 1, warmup:int = 1) -> Dict[str, float]:
+    """
+    Time a function, after warming it up.
+
+    Args:
+        fn (Callable): The function (no arguments).
+        repeat (int): The number of timed rounds. Default is 7.
+        number (int): The number of calls per round. Default is 1.
+        warmup (int): The number of untimed calls first. Default is 1.
+
+    Returns:
+        Dict[str, float]: The 'median_s', 'min_s', 'mean_s' and 'iqr_s' of one call,
+            over the rounds, and the number of 'rounds'.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start_time) / number)
+    return summarize(times)
+
+
+def summarize(times:List[float]) -> Dict[str, float]:
+    '''the timing of `timeit`, for times measured otherwise (e.g. in a subprocess)'''
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median_s': float(median), 'min_s': float(min(times)), 'mean_s': float(np.mean(times)),
+            'iqr_s': float(q3 - q1), 'rounds': len(times)}
+
+
+def rss_bytes() -> int:
+    '''the resident memory of this process (from /proc, so Linux only; None elsewhere)'''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def result(suite:str, name:str, timing:Dict[str, float], items:int = None, **params) -> dict:
+    """
+    Make a benchmark result record.
+
+    Args:
+        suite (str): The suite, e.g. 'input_handling'.
+        name (str): The benchmark, e.g. 'decode'.
+        timing (Dict[str, float]): As returned by `timeit`.
+        items (int, optional): The number of items one call processes, to report a throughput.
+        **params: What the benchmark was run with (e.g. n=1000); part of its identity
+            when comparing runs.
+
+    Returns:
+        dict: The record.
+    """
+    rec = {'suite': suite, 'name': name, 'params': params, **timing}
+    if items:
+        rec['items_per_s'] = items / timing['median_s'] if timing['median_s'] > 0 else None
+    return rec
+
+
+def key(rec:dict) -> str:
+    '''the identity of a benchmark result, for matching across runs'''
+    params = ",".join(f"{k}={v}" for k, v in sorted(rec['params'].items()))
+    return f"{rec['suite']}/{rec['name']}" + (f"[{params}]" if params else "")
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or None
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def machine_info() -> dict:
+    """
+    Describe the machine and software the benchmarks ran on.
+
+    Returns:
+        dict: The platform, python version, cpu model and count, memory,
+            the versions of the main libraries, and the git commit.
+    """
+    versions = {}
+    for mod in ["numpy", "pandas", "pyarrow", "cv2", "PIL", "folium", "streamlit", "torch", "transformers"]:
+        try:
+            versions[mod] = getattr(importlib.import_module(mod), "__version__", None)
+        except ImportError:
+            versions[mod] = None
+    try:
+        mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        mem_bytes = None
+    return {'platform': platform.platform(), 'python': platform.python_version(),
+            'cpu': _cpu_model(), 'cpu_count': os.cpu_count(), 'mem_gib': round(mem_bytes / 2**30, 1) if mem_bytes else None,
+            'versions': versions, 'git_commit': _git_commit()}
+
+
+def write_results(path:str, results:List[dict], config:dict) -> None:
+    """
+    Write a run's results to a JSON file, with the machine info.
+
+    Args:
+        path (str): The output file.
+        results (List[dict]): The result records.
+        config (dict): How the run was made (suites, quick, seed).
+    """
+    run = {'created': datetime.datetime.now().isoformat(timespec="seconds"), 'machine': machine_info(),
+           'config': config, 'results': results}
+    with open(path, "w") as f:
+        json.dump(run, f, indent=1)
+
+
+def load_results(path:str) -> dict:
+    """
+    Read a run written by `write_results`.
+
+    Args:
+        path (str): The file.
+
+    Returns:
+        dict: The run, with the keys 'created', 'machine', 'config' and 'results'.
+    """
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,325 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from unittest.mock import MagicMock
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import common
+
+'''
+a load test of the app: many simulated sessions, each scripting the
+observation flow (upload -> validate -> classify -> push), in one process
+
+every session is a `streamlit.testing.v1.AppTest` of `src/main.py`, and all of
+them run in threads of this process, as the sessions of one streamlit server
+do: they share the module-level state (the model registry, the batching
+inference server, the prediction cache, the upload queue, ...). The load test
+runs at rising concurrency levels (the number of sessions in flight), and
+reports, per level, the flows completed per second, the latency percentiles
+of each step, and the resident memory (RSS) of the process.
+
+nothing leaves the machine:
+- the hub is the local stand-in `upload_queue.LocalHubApi` (`SW_HUB_LOCAL_DIR`),
+- the observations for the map are a synthetic local parquet file,
+- the cetacean classifier is the deterministic numpy stand-in of the
+  inference benchmark (with `--real-model`, the real one, loaded through the
+  model registry; needs torch and transformers, and the hub or a local cache).
+
+run from the repository root:
+
+    python -m dev.benchmarks.loadtest --concurrency 1 2 4 8 --sessions 16 --out load.json
+
+AppTest cannot drive `st.file_uploader`, so the upload step hands each session
+an `UploadedFile` (a synthetic jpeg, with GPS and datetime EXIF tags) through
+its session state, returned by the patched `file_uploader`. The script runs
+just as with a browser upload from there on. There are `--images` distinct
+photos, used in turn: to time the uncached path at every step, run as many
+sessions as there are photos.
+'''
+
+# the session state key through which a session's upload is handed to `file_uploader`
+UPLOAD_KEY = "_loadtest_upload"
+STEPS = ["upload", "validate", "classify", "push"]
+
+
+class RssSampler:
+    """
+    Samples the RSS of the process in a background thread, while in a `with` block
+
+    Attributes:
+        interval_s (float): The time between samples.
+        samples (List[int]): The samples, in bytes.
+    """
+    def __init__(self, interval_s:float = 0.1):
+        self.interval_s = interval_s
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            rss = common.rss_bytes()
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name="sw-rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        rss = common.rss_bytes()
+        if rss is not None:
+            self.samples.append(rss)
+
+
+@contextlib.contextmanager
+def in_process_sessions():
+    """
+    Patch streamlit so that AppTest sessions can run concurrently, in threads.
+
+    - each `AppTest.run` installs its own mock runtime as the process-wide one,
+      and removes it when done, which would break the runs still in flight:
+      instead, all sessions get one shared mock runtime (with one media file
+      manager and one cache storage, as the sessions of a server share).
+    - each session gets its own session id (AppTest gives them all the same),
+      and they share one script cache, as in a server: the script is compiled
+      once (compiling it in many threads at once can fail in CPython 3.11,
+      with "AST constructor recursion depth mismatch").
+    - `file_uploader` returns the upload stored under `UPLOAD_KEY` in the
+      session state, if there is one (after rendering the widget as usual).
+
+    The warnings about a missing script run context (from the session state
+    being set up outside of a script run) are silenced.
+    """
+    from streamlit.delta_generator import DeltaGenerator
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+    import streamlit as st
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    orig_instance, orig_exists = Runtime.__dict__['instance'], Runtime.__dict__['exists']
+    orig_file_uploader = DeltaGenerator.file_uploader
+    orig_runner_init = LocalScriptRunner.__init__
+    script_cache = ScriptCache()
+
+    def runner_init(self, script_path, session_state, *args, **kwargs):
+        orig_runner_init(self, script_path, session_state, *args, **kwargs)
+        self._session_id = f"load-{id(session_state._state):x}"
+        self._script_cache = script_cache
+    ctx_logger = logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context")
+    no_ctx_filter = lambda record: "missing ScriptRunContext" not in record.getMessage()
+
+    def file_uploader(self, *args, **kwargs):
+        uploaded = orig_file_uploader(self, *args, **kwargs)
+        return st.session_state.get(UPLOAD_KEY, uploaded)
+
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    DeltaGenerator.file_uploader = file_uploader
+    LocalScriptRunner.__init__ = runner_init
+    ctx_logger.addFilter(no_ctx_filter)
+    try:
+        yield runtime
+    finally:
+        Runtime.instance, Runtime.exists = orig_instance, orig_exists
+        DeltaGenerator.file_uploader = orig_file_uploader
+        LocalScriptRunner.__init__ = orig_runner_init
+        ctx_logger.removeFilter(no_ctx_filter)
+
+
+def make_upload(data:bytes, name:str, file_id:str):
+    '''an `UploadedFile`, as `st.file_uploader` returns for a browser upload'''
+    from streamlit.proto.Common_pb2 import FileURLs
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+    return UploadedFile(UploadedFileRec(file_id, name, "image/jpeg", data), FileURLs())
+
+
+def _widget(widgets, label:str):
+    '''the widget with the given label, from an AppTest element list'''
+    for w in widgets:
+        if w.label == label:
+            return w
+    raise LookupError(f"no widget labelled {label!r}")
+
+
+def run_session(script:str, upload, email:str, timeout_s:float = 120) -> Dict[str, object]:
+    """
+    Run the observation flow in a new session.
+
+    Args:
+        script (str): The app script (`src/main.py`).
+        upload (UploadedFile): The image the session uploads.
+        email (str): The author email entered.
+        timeout_s (float): The timeout of each script run. Default is 120.
+
+    Returns:
+        Dict[str, object]: The duration (s) of each of `STEPS` that ran, and
+            'error' (None, or a description of the first failure).
+    """
+    from streamlit.testing.v1 import AppTest
+
+    timings = {'error': None}
+    at = AppTest.from_file(script, default_timeout=timeout_s)
+    at.session_state[UPLOAD_KEY] = upload
+
+    def step(name, act):
+        start_time = time.perf_counter()
+        act()
+        at.run()
+        timings[name] = time.perf_counter() - start_time
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].message}")
+
+    try:
+        step("upload", lambda: None)
+        step("validate", lambda: (_widget(at.sidebar.text_input, "Author Email").input(email),
+                                  _widget(at.sidebar.button, "Validate").click()))
+        step("classify", lambda: _widget(at.button, "Identify with cetacean classifier").click())
+        step("push", lambda: _widget(at.button, "Upload observation to THE INTERNET!").click())
+    except Exception as e:
+        timings['error'] = f"{type(e).__name__}: {e}"
+    return timings
+
+
+def run_level(script:str, uploads:list, concurrency:int, n_sessions:int, timeout_s:float) -> dict:
+    """
+    Run `n_sessions` sessions, `concurrency` at a time.
+
+    Args:
+        script (str): The app script.
+        uploads (list): The uploads, used in turn by the sessions.
+        concurrency (int): The number of sessions in flight.
+        n_sessions (int): The number of sessions run.
+        timeout_s (float): The timeout of each script run.
+
+    Returns:
+        dict: The level's 'concurrency', 'sessions', 'errors', 'wall_s',
+            'flows_per_s', the p50/p95/p99 latency (ms) of each step and of the
+            whole flow, and the process RSS (MiB) before, at peak and after.
+    """
+    rss_before = common.rss_bytes()
+    with RssSampler() as sampler, ThreadPoolExecutor(concurrency, thread_name_prefix="sw-load") as pool:
+        start_time = time.perf_counter()
+        futures = [pool.submit(run_session, script, uploads[i % len(uploads)], f"load{i}@example.org", timeout_s)
+                   for i in range(n_sessions)]
+        sessions = [f.result() for f in futures]
+        wall_s = time.perf_counter() - start_time
+
+    ok = [s for s in sessions if s['error'] is None]
+    row = {'concurrency': concurrency, 'sessions': n_sessions, 'errors': n_sessions - len(ok),
+           'wall_s': round(wall_s, 3), 'flows_per_s': round(len(ok) / wall_s, 3)}
+    for name in STEPS + ["flow"]:
+        values = [sum(s[k] for k in STEPS) if name == "flow" else s[name] for s in ok]
+        for q in (50, 95, 99):
+            row[f"{name}_p{q}_ms"] = round(float(np.percentile(values, q)) * 1e3, 1) if values else None
+    mib = lambda n: round(n / 2**20, 1) if n is not None else None
+    row.update({'rss_before_mib': mib(rss_before),
+                'rss_peak_mib': mib(max(sampler.samples)) if sampler.samples else None,
+                'rss_after_mib': mib(common.rss_bytes())})
+    first_error = next((s['error'] for s in sessions if s['error'] is not None), None)
+    if first_error:
+        print(f"concurrency {concurrency}: {row['errors']} failed sessions, e.g. {first_error}", file=sys.stderr)
+    return row
+
+
+def setup_environment(work_dir:str, seed:int, n_obs:int, real_model:bool) -> None:
+    '''point the app at local stand-ins (set before the app modules read their settings)'''
+    from .bench_obs_map import synthetic_obs
+    import obs_store as sw_store
+
+    obs_path = os.path.join(work_dir, "obs.parquet")
+    synthetic_obs(n_obs, seed).rename(columns={v: k for k, v in sw_store.MAP_COLUMNS.items()}).to_parquet(obs_path)
+    os.environ.update({
+        'SW_OBS_DATASET': obs_path,
+        'SW_HUB_LOCAL_DIR': os.path.join(work_dir, "hub"),
+        'SW_UPLOAD_SPOOL_DIR': os.path.join(work_dir, "spool"),
+    })
+    if not real_model:
+        from .bench_inference import StandInClassifier
+        import model_registry as sw_models
+        sw_models.registry.register_loader("cetacean", lambda model_id, revision: StandInClassifier(seed))
+
+
+def make_uploads(n:int, seed:int, megapixels:float) -> list:
+    '''distinct synthetic photos; the sessions use them in turn, so with more sessions than
+    photos, the later uploads are served from the ingestion and prediction caches'''
+    from .bench_exif import synthetic_jpeg
+    return [make_upload(synthetic_jpeg(megapixels, seed + i), f"load_{i}.jpg", f"load-{seed}-{i}")
+            for i in range(n)]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="load test of the observation flow, in simulated sessions")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="the numbers of sessions in flight, one level each")
+    parser.add_argument("--sessions", type=int, default=None,
+                        help="the sessions run per level (default: 2x the concurrency, at least 4)")
+    parser.add_argument("--images", type=int, default=8, help="the number of distinct photos uploaded")
+    parser.add_argument("--megapixels", type=float, default=2.0, help="the size of the photos")
+    parser.add_argument("--obs", type=int, default=100, help="the number of observations on the map")
+    parser.add_argument("--seed", type=int, default=common.SEED)
+    parser.add_argument("--timeout", type=float, default=120, help="the timeout of one script run (s)")
+    parser.add_argument("--real-model", action="store_true", help="use the real cetacean classifier")
+    parser.add_argument("--out", help="write the results and machine info to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show what the app prints (hidden by default)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="sw-load-") as work_dir:
+        setup_environment(work_dir, args.seed, args.obs, args.real_model)
+        import upload_queue as sw_upload
+        uploads = make_uploads(args.images, args.seed, args.megapixels)
+        script = str(common.SRC_DIR / "main.py")
+
+        rows = []
+        app_output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with in_process_sessions(), app_output:
+            # one untimed session first, to load the model and warm the caches shared by all sessions
+            warmup = run_session(script, uploads[0], "warmup@example.org", args.timeout)
+            if warmup['error']:
+                print(f"warmup session failed: {warmup['error']}", file=sys.stderr)
+                return 1
+            for concurrency in args.concurrency:
+                n_sessions = args.sessions or max(4, 2 * concurrency)
+                print(f"concurrency {concurrency}: {n_sessions} sessions...", file=sys.stderr)
+                rows.append(run_level(script, uploads, concurrency, n_sessions, args.timeout))
+
+        # commit what the sessions pushed, and check that it all reached the (local) hub
+        queue = sw_upload.get_queue()
+        queue.flush()
+        deadline = time.time() + args.timeout
+        while queue.status()['pending'] and time.time() < deadline:
+            time.sleep(0.1)
+        upload_status = queue.status()
+        queue.stop()
+
+    df = pd.DataFrame(rows).set_index('concurrency')
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(df[['sessions', 'errors', 'flows_per_s', 'flow_p50_ms', 'flow_p95_ms', 'flow_p99_ms',
+                  'classify_p95_ms', 'push_p95_ms', 'rss_peak_mib']].to_string())
+    print(f"upload queue: {upload_status}")
+    if args.out:
+        common.write_results(args.out, rows, {'kind': 'loadtest', **vars(args), 'upload_queue': upload_status})
+    return 1 if df['errors'].sum() else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
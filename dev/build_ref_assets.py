@@ -0,0 +1,41 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+'''
+make the thumbnails of the whale reference images at build time (see `src/ref_assets.py`)
+
+usage:
+
+    python dev/build_ref_assets.py                 # into src/static/ref
+    python dev/build_ref_assets.py --static-dir /srv/app/static
+
+run it when building the image (or before starting the app): the gallery and
+the species viewer then read the thumbnails from `static/ref` instead of
+making them on first use. Rerunning it only rewrites the thumbnails whose
+source image changed; the app makes any that are missing or stale itself.
+'''
+
+
+def main(argv:list = None) -> int:
+    import ref_assets as sw_assets
+
+    p = argparse.ArgumentParser(description="Make the thumbnails of the whale reference images.")
+    p.add_argument("--static-dir", type=Path, default=sw_assets.STATIC_DIR,
+                   help="the directory streamlit serves (default: src/static)")
+    args = p.parse_args(argv)
+
+    start_time = time.perf_counter()
+    cache = sw_assets.RefAssetCache(static_dir=args.static_dir)
+    n = cache.export_static()
+    stats = cache.stats()
+    print(f"{n} thumbnails in {args.static_dir / 'ref'} ({stats['bytes'] / 2**10:.0f} KiB), "
+          f"{stats['prebuilt']} already up to date, {time.perf_counter() - start_time:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from batch_eval import decode_image
+from benchmarks.common import rss_bytes
+
+'''
+export the cetacean classifier to ONNX or TorchScript, and check the export
+
+usage:
+
+    # export a pinned revision (a commit hash; a branch is resolved and recorded)
+    python dev/export_classifier.py export --revision <commit> --format onnx --quantize --out models/cetacean-onnx-int8
+
+    # compare it with the original on (part of) the evaluation set
+    python dev/export_classifier.py check --artifact models/cetacean-onnx-int8 --base ~/Documents/ceteans --limit 500
+
+`check` classifies the same images with the original classifier (transformers,
+at the revision the artifact was exported from, called once per image through
+its own `__call__`, so that the export is compared with what the app gets from
+the model itself) and with the exported one, and
+reports for each: the load time and memory (RSS growth of the process), the
+latency per batch and per image, and the top-1 / top-3 accuracy against the
+labels in train.csv; and how often the two agree (same top-1 species, same
+top-3 set). It exits with status 1 if the top-1 agreement is below
+`--min-agreement`.
+
+to serve the export, set `SW_CLASSIFIER_BACKEND` (onnx or torchscript) and
+`SW_CLASSIFIER_ARTIFACT` (the directory) for the app, or pass `--backend` and
+`--artifact` to `batch_eval.py`. The export needs torch and transformers (and
+onnx and onnxruntime for ONNX); serving an ONNX export needs only onnxruntime.
+'''
+
+
+def load_eval_images(args:argparse.Namespace) -> tuple:
+    '''decode the first `--limit` evaluation images, and read their labels'''
+    base = args.base.expanduser()
+    img_pth = (args.images or base / 'images').expanduser()
+    df = pd.read_csv((args.train_csv or base / 'train.csv').expanduser())
+    targets = dict(zip(df['image'], df['species']))
+    img_files = sorted(img_pth.glob('*.jpg'))[:args.limit]
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        items = list(pool.map(decode_image, img_files))
+    return items, [targets.get(item['img_id']) for item in items]
+
+
+def run_backend(name:str, load_fn, images:list, targets:list, batch_size:int, batched:bool = True) -> tuple:
+    '''load a classifier, and time it on the images in batches (after one warmup batch)
+
+    with `batched` False, each image of a batch goes through the model's own `__call__`
+    '''
+    import inference_server as sw_infer
+
+    rss_before = rss_bytes()
+    start_time = time.perf_counter()
+    model = load_fn()
+    load_s = time.perf_counter() - start_time
+    rss_after = rss_bytes()
+    batch_fn = sw_infer.make_batch_fn(model) if batched else (lambda images: [model(img) for img in images])
+    batch_fn(images[:batch_size])
+
+    preds, batch_times = [], []
+    for i in range(0, len(images), batch_size):
+        batch = images[i:i + batch_size]
+        start_time = time.perf_counter()
+        outs = batch_fn(batch)
+        batch_times.append(time.perf_counter() - start_time)
+        preds.extend(list(out['predictions'][:3]) for out in outs)
+
+    stats = {
+        'backend': name,
+        'load_s': round(load_s, 3),
+        'rss_mib': round((rss_after - rss_before) / 2**20, 1) if rss_before is not None else None,
+        'batch_p50_ms': round(float(np.percentile(batch_times, 50)) * 1e3, 1),
+        'batch_p95_ms': round(float(np.percentile(batch_times, 95)) * 1e3, 1),
+        'per_image_ms': round(sum(batch_times) / len(images) * 1e3, 2),
+        'top1_acc': round(float(np.mean([p[0] == t for p, t in zip(preds, targets)])), 4),
+        'top3_acc': round(float(np.mean([t in p for p, t in zip(preds, targets)])), 4),
+    }
+    return model, preds, stats
+
+
+def check(args:argparse.Namespace) -> int:
+    import model_export as sw_export
+    import model_registry as sw_models
+
+    manifest = sw_export.read_manifest(args.artifact)
+    items, targets = load_eval_images(args)
+    images = [item['image'] for item in items]
+    print(f"{len(images)} images, artifact {args.artifact}: {manifest['format']}"
+          f"{' int8' if manifest['quantized'] else ''} of {manifest['model_id']}@{manifest['revision']}")
+
+    # the export first, so that its memory does not include what torch and transformers take
+    _, exported_preds, exported_stats = run_backend(
+        f"{manifest['format']}{'-int8' if manifest['quantized'] else ''}",
+        lambda: sw_export.ExportedClassifier(args.artifact, n_threads=args.threads),
+        images, targets, args.batch_size)
+    revision = manifest.get('commit') or manifest['revision']
+    # the reference is the wrapper's own per-image call, not our batched rebuild of it
+    _, ref_preds, ref_stats = run_backend(
+        "transformers", lambda: sw_models.load_transformers_classifier(manifest['model_id'], revision),
+        images, targets, args.batch_size, batched=False)
+
+    agree_top1 = float(np.mean([a[0] == b[0] for a, b in zip(ref_preds, exported_preds)]))
+    agree_top3 = float(np.mean([set(a) == set(b) for a, b in zip(ref_preds, exported_preds)]))
+    df = pd.DataFrame([ref_stats, exported_stats]).set_index('backend')
+    print(df.to_string())
+    print(f"agreement with transformers: top-1 {agree_top1:.4f}, same top-3 {agree_top3:.4f}")
+    print(f"exported file: {manifest['bytes'] / 2**20:.1f} MiB, "
+          f"max logit diff at export {manifest.get('export_max_abs_diff')}, "
+          f"agreement at export {manifest.get('wrapper_agreement')}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({'manifest': {k: v for k, v in manifest.items() if k != 'species'}, 'n_images': len(images),
+                       'backends': [ref_stats, exported_stats],
+                       'agreement': {'top1': agree_top1, 'top3': agree_top3}}, f, indent=1)
+    if agree_top1 < args.min_agreement:
+        print(f"top-1 agreement {agree_top1:.4f} is below {args.min_agreement}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def export(args:argparse.Namespace) -> int:
+    import model_export as sw_export
+    import model_registry as sw_models
+
+    probe_images = None
+    if args.probe_images is not None:
+        # real images make a better check against the classifier than the default noise
+        img_files = sorted(args.probe_images.expanduser().glob('*.jpg'))[:args.probe_limit]
+        probe_images = [decode_image(f)['image'] for f in img_files]
+    manifest = sw_export.export_classifier(str(args.out.expanduser()), args.model_id or sw_models.CETACEAN_MODEL_ID,
+                                           args.revision, fmt=args.format, quantize=args.quantize,
+                                           opset=args.opset, probe_images=probe_images)
+    print(json.dumps({k: v for k, v in manifest.items() if k != 'species'}, indent=1))
+    return 0
+
+
+def parse_args(argv:list = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Export the cetacean classifier, and check an export.")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="export the classifier to ONNX or TorchScript")
+    p_export.add_argument("--revision", required=True, help="the model revision, preferably a commit hash")
+    p_export.add_argument("--model-id", default=None, help="the model on the hub (default: the cetacean classifier)")
+    p_export.add_argument("--format", choices=["onnx", "torchscript"], default="onnx")
+    p_export.add_argument("--quantize", action="store_true", help="dynamic int8 quantization of the weights")
+    p_export.add_argument("--opset", type=int, default=17, help="the ONNX opset")
+    p_export.add_argument("--out", type=Path, required=True, help="the artifact directory")
+    p_export.add_argument("--probe-images", type=Path, default=None,
+                          help="a directory of images on which the export is compared with the classifier")
+    p_export.add_argument("--probe-limit", type=int, default=32, help="the number of probe images used")
+
+    p_check = sub.add_parser("check", help="compare an export with the original on the evaluation set")
+    p_check.add_argument("--artifact", required=True, help="the artifact directory")
+    p_check.add_argument("--base", type=Path, default=Path("~/Documents/ceteans/"),
+                         help="directory holding `images/` and `train.csv`")
+    p_check.add_argument("--images", type=Path, default=None, help="image directory (default: BASE/images)")
+    p_check.add_argument("--train-csv", type=Path, default=None, help="labels (default: BASE/train.csv)")
+    p_check.add_argument("--limit", type=int, default=200, help="the number of images compared")
+    p_check.add_argument("--batch-size", type=int, default=8)
+    p_check.add_argument("--workers", type=int, default=4, help="number of decode threads")
+    p_check.add_argument("--threads", type=int, default=None, help="threads per call of the exported model")
+    p_check.add_argument("--min-agreement", type=float, default=0.98,
+                         help="the lowest top-1 agreement with the original accepted")
+    p_check.add_argument("--out", default=None, help="write the comparison to this JSON file")
+    return p.parse_args(argv)
+
+
+def main(argv:list = None) -> int:
+    args = parse_args(argv)
+    # setup for the ML model on huggingface (our wrapper)
+    os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+    return export(args) if args.command == "export" else check(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+'''
+fill and check the local model store (see `src/model_store.py`)
+
+usage:
+
+    # fetch the app's models (both at 'main', pinned to today's commits), or the given ones
+    python dev/prefetch_models.py fetch --store models/
+    python dev/prefetch_models.py fetch --store models/ --model Saving-Willy/cetacean-classifier@<commit>
+
+    python dev/prefetch_models.py list --store models/
+    python dev/prefetch_models.py verify --store models/     # exits with status 1 if a file is damaged
+    python dev/prefetch_models.py gc --store models/         # delete the blobs no snapshot uses
+
+    # load the app's models from the store, as the app does, and report the time of each phase
+    python dev/prefetch_models.py time --store models/
+
+then run the app with `SW_MODEL_STORE=models/`. The store directory defaults
+to `SW_MODEL_STORE`.
+'''
+
+
+def parse_model(spec:str) -> tuple:
+    '''"org/name@revision" -> (model id, revision), the revision defaulting to main'''
+    model_id, _, revision = spec.partition("@")
+    return model_id, revision or "main"
+
+
+def app_models() -> list:
+    import model_registry as sw_models
+    return [f"{sw_models.CETACEAN_MODEL_ID}@main", f"{sw_models.HOTDOG_MODEL_ID}@main"]
+
+
+def main(argv:list = None) -> int:
+    p = argparse.ArgumentParser(description="Fill and check the local model store.")
+    p.add_argument("command", choices=["fetch", "list", "verify", "gc", "time"])
+    p.add_argument("--store", default=os.environ.get("SW_MODEL_STORE", None),
+                   help="the store directory (default: SW_MODEL_STORE)")
+    p.add_argument("--model", action="append", default=None,
+                   help="a model as ID@REVISION (repeatable; default: the app's models)")
+    p.add_argument("--allow", action="append", default=None,
+                   help="fetch only the files matching this glob pattern (repeatable)")
+    p.add_argument("--verify", choices=["full", "size", "off"], default="full",
+                   help="how files are checked when loaded (for `time`)")
+    args = p.parse_args(argv)
+    if not args.store:
+        p.error("no store directory: pass --store or set SW_MODEL_STORE")
+
+    # setup for the ML model on huggingface (our wrapper)
+    os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
+    os.environ["SW_MODEL_STORE"] = args.store
+    os.environ["SW_MODEL_STORE_VERIFY"] = args.verify
+    import model_store as sw_mstore
+    store = sw_mstore.get_store()
+    models = [parse_model(spec) for spec in (args.model or app_models())]
+
+    if args.command == "fetch":
+        for model_id, revision in models:
+            manifest = store.fetch(model_id, revision, allow_patterns=args.allow)
+            print(f"{model_id}@{revision} -> {manifest['commit']} ({len(manifest['files'])} files)")
+    elif args.command == "list":
+        print(pd.DataFrame(store.snapshots()).to_string(index=False))
+    elif args.command == "verify":
+        n_damaged = 0
+        for row in store.snapshots():
+            problems = store.verify(row['model_id'], row['commit'])
+            n_damaged += bool(problems)
+            print(f"{row['model_id']}@{row['commit']}: {'; '.join(problems) if problems else 'ok'}")
+        return 1 if n_damaged else 0
+    elif args.command == "gc":
+        print(f"freed {store.gc() / 2**20:.1f} MiB")
+    elif args.command == "time":
+        import model_registry as sw_models
+        kinds = {sw_models.CETACEAN_MODEL_ID: "cetacean"}
+        for model_id, revision in models:
+            sw_models.registry.get(kinds.get(model_id, "image-classification"), model_id, revision)
+        print(pd.DataFrame(store.load_reports()).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
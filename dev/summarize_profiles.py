@@ -0,0 +1,40 @@
+import argparse
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+import rerun_profiler as sw_prof
+
+'''
+summarize the per-rerun reports written with SW_PROFILE_DIR set, and
+optionally compare them with a baseline (e.g. reports from the main branch).
+
+usage:
+
+    SW_PROFILE_DIR=/tmp/prof_new streamlit run src/main.py    # click around, then stop
+    python dev/summarize_profiles.py /tmp/prof_new
+    python dev/summarize_profiles.py /tmp/prof_new --baseline /tmp/prof_main --threshold 1.2
+
+with --baseline, the exit status is 1 if any section regressed (its median
+wall time or mean peak allocation grew by more than the threshold ratio).
+'''
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Summarize rerun profiles.")
+    p.add_argument("report_dir")
+    p.add_argument("--baseline", default=None, help="directory of baseline reports to compare with")
+    p.add_argument("--threshold", type=float, default=1.2)
+    args = p.parse_args()
+
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_columns", 20)
+    print(sw_prof.summarize(args.report_dir).to_string())
+    if args.baseline:
+        df = sw_prof.compare(args.baseline, args.report_dir, threshold=args.threshold)
+        print()
+        print(df.to_string() if len(df) else "nothing to compare (no reports in one of the directories)")
+        if df['regression'].any():
+            print(f"\nregressions: {', '.join(df.index[df['regression']])}")
+            sys.exit(1)
@@ -1,7 +1,5 @@
 import pandas as pd
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
 
 _map_data = {
     'name': {
@@ -69,6 +67,7 @@ tile_sets = [
 ]
 
 def create_map(tile_name, location, zoom_start: int = 7):
+    import folium # slow to import, only when a map is drawn
     # https://xyzservices.readthedocs.io/en/stable/gallery.html 
     # get teh attribtuions from here once we pick the 2-3-4 options 
     # make esri ocean the default
@@ -119,6 +118,9 @@ def present_alps_map():
   
   '''
 
+  import folium
+  from streamlit_folium import st_folium
+
   st.markdown("# :whale: :whale: Cetaceans :red[& friends] :balloon:")
   show_points = st.toggle("Show Points", False)
   basic_map = st.toggle("Use Basic Map", False)
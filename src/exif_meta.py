@@ -0,0 +1,263 @@
+from typing import Dict, Tuple
+import datetime
+import logging
+import struct
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+'''
+A minimal EXIF reader, for the date-time and GPS position of an image
+(and the pixel size of a JPEG, from its frame header)
+
+It locates the EXIF block (JPEG APP1 segment, PNG eXIf chunk or WebP EXIF
+chunk) by walking the container headers, and reads just the few tags we need
+from the TIFF structure inside it. No pixel data is decoded, and only the
+segment headers before the EXIF block are touched, so the cost does not grow
+with the size of the image.
+'''
+
+# TIFF field types we read: code -> (struct format, size in bytes)
+_TYPES = {2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 10: ('ii', 8)}
+
+# tags in IFD0, the Exif sub-IFD and the GPS sub-IFD
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_GPS_LATITUDE_REF, TAG_GPS_LATITUDE = 1, 2
+TAG_GPS_LONGITUDE_REF, TAG_GPS_LONGITUDE = 3, 4
+
+_EXIF_HEADER = b"Exif\x00\x00"
+# EXIF date-times, e.g. '2024:06:01 14:30:00'
+DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+def _jpeg_exif(buf:memoryview) -> memoryview:
+    '''the TIFF block of the APP1/Exif segment, walking the segment headers up to the scan'''
+    pos, n = 2, len(buf)
+    while pos + 4 <= n:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF: # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7: # no length field
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9): # start of scan / end of image: no EXIF before the pixels
+            return None
+        seg_len = (buf[pos + 2] << 8) | buf[pos + 3]
+        if marker == 0xE1 and buf[pos + 4:pos + 10] == _EXIF_HEADER:
+            return buf[pos + 10:pos + 2 + seg_len]
+        pos += 2 + seg_len
+    return None
+
+
+def jpeg_size(buf:memoryview) -> Tuple[int, int]:
+    """
+    Read the pixel size of a JPEG image from its frame header, without decoding it.
+
+    Args:
+        buf (memoryview): The encoded image file (any bytes-like object).
+
+    Returns:
+        Tuple[int, int]: The (width, height), or None if `buf` is not a JPEG
+            (or has no frame header before the scan).
+    """
+    buf = memoryview(buf)
+    if buf[:2] != b"\xff\xd8":
+        return None
+    pos, n = 2, len(buf)
+    while pos + 9 <= n:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF: # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            return None
+        # start-of-frame markers (C4, C8 and CC are tables, not frames)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", buf, pos + 5)
+            return width, height
+        pos += 2 + ((buf[pos + 2] << 8) | buf[pos + 3])
+    return None
+
+
+def _png_exif(buf:memoryview) -> memoryview:
+    '''the data of the eXIf chunk (chunk headers only are read)'''
+    pos, n = 8, len(buf)
+    while pos + 8 <= n:
+        length = struct.unpack_from(">I", buf, pos)[0]
+        ctype = bytes(buf[pos + 4:pos + 8])
+        if ctype == b"eXIf":
+            return buf[pos + 8:pos + 8 + length]
+        if ctype == b"IEND":
+            return None
+        pos += 12 + length # length, type, data, crc
+    return None
+
+
+def _webp_exif(buf:memoryview) -> memoryview:
+    '''the data of the EXIF chunk of a (extended format) WebP file'''
+    pos, n = 12, min(len(buf), 8 + struct.unpack_from("<I", buf, 4)[0])
+    while pos + 8 <= n:
+        fourcc = bytes(buf[pos:pos + 4])
+        size = struct.unpack_from("<I", buf, pos + 4)[0]
+        if fourcc == b"EXIF":
+            data = buf[pos + 8:pos + 8 + size]
+            # some writers keep the jpeg-style header in the chunk
+            return data[6:] if data[:6] == _EXIF_HEADER else data
+        pos += 8 + size + (size & 1) # chunks are padded to even sizes
+    return None
+
+
+def find_exif(buf:memoryview) -> memoryview:
+    """
+    Locate the EXIF (TIFF) block in an encoded JPEG, PNG or WebP image.
+
+    Args:
+        buf (memoryview): The encoded image file (any bytes-like object).
+
+    Returns:
+        memoryview: A view of the TIFF-structured EXIF data, or None if the
+            image has none (or is not one of the supported formats).
+    """
+    buf = memoryview(buf)
+    if buf[:2] == b"\xff\xd8":
+        return _jpeg_exif(buf)
+    if buf[:8] == b"\x89PNG\r\n\x1a\n":
+        return _png_exif(buf)
+    if buf[:4] == b"RIFF" and buf[8:12] == b"WEBP":
+        return _webp_exif(buf)
+    return None
+
+
+class _Tiff:
+    '''reads IFD entries from a TIFF block, resolving values stored at an offset'''
+    def __init__(self, tiff:memoryview):
+        if tiff[:2] == b"II":
+            self.bo = "<"
+        elif tiff[:2] == b"MM":
+            self.bo = ">"
+        else:
+            raise ValueError("not a TIFF header")
+        self.tiff = tiff
+        if self._unpack("H", 2)[0] != 42:
+            raise ValueError("bad TIFF magic number")
+        self.ifd0 = self._unpack("I", 4)[0]
+
+    def _unpack(self, fmt:str, offset:int) -> tuple:
+        return struct.unpack_from(self.bo + fmt, self.tiff, offset)
+
+    def read_ifd(self, offset:int, tags:set) -> Dict[int, object]:
+        '''the values of the requested tags in the IFD at `offset` (others are skipped)'''
+        values = {}
+        n_entries = self._unpack("H", offset)[0]
+        for i in range(n_entries):
+            entry = offset + 2 + 12 * i
+            tag, ftype, count = self._unpack("HHI", entry)
+            if tag not in tags or ftype not in _TYPES:
+                continue
+            fmt, size = _TYPES[ftype]
+            pos = entry + 8 if size * count <= 4 else self._unpack("I", entry + 8)[0]
+            if pos + size * count > len(self.tiff):
+                raise ValueError(f"tag {tag:#x} points outside the EXIF block")
+            if ftype == 2: # ascii, nul-terminated
+                values[tag] = bytes(self.tiff[pos:pos + count]).split(b"\x00", 1)[0].decode("ascii", "replace")
+            else:
+                flat = self._unpack(fmt * count, pos)
+                if len(fmt) == 2: # rationals: (numerator, denominator) pairs
+                    flat = tuple(num / den if den else float("nan") for num, den in zip(flat[::2], flat[1::2]))
+                values[tag] = flat
+        return values
+
+
+def _to_decimal(dms:tuple, ref:str) -> float:
+    '''(degrees, minutes, seconds) and N/S/E/W ref to signed decimal degrees'''
+    value = dms[0] + (dms[1] / 60.0 if len(dms) > 1 else 0.0) + (dms[2] / 3600.0 if len(dms) > 2 else 0.0)
+    if value != value: # nan, from a zero denominator
+        raise ValueError("invalid GPS coordinate")
+    return -value if ref.strip().upper() in ("S", "W") else value
+
+
+def _valid_datetime(value:object) -> str:
+    '''the EXIF date-time if it is a real one, else None (e.g. an unset camera clock, all zeros)'''
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    try:
+        datetime.datetime.strptime(value, DATETIME_FORMAT)
+    except ValueError:
+        return None
+    return value
+
+
+def _gps_coordinate(gps:dict, tag:int, ref_tag:int, refs:Tuple[str, str], limit:float) -> float:
+    '''a GPS coordinate in decimal degrees, or None if missing or not as the EXIF spec says'''
+    dms, ref = gps.get(tag), gps.get(ref_tag, refs[0])
+    if not isinstance(dms, tuple) or not dms or not all(isinstance(v, float) for v in dms):
+        return None # not rationals
+    if not isinstance(ref, str) or ref.strip().upper() not in refs:
+        return None # a sign we cannot trust
+    try:
+        value = _to_decimal(dms, ref)
+    except ValueError:
+        return None
+    return value if abs(value) <= limit else None
+
+
+def _is_offset(value:object) -> bool:
+    '''whether a sub-IFD pointer tag has the expected type (one integer)'''
+    return isinstance(value, tuple) and len(value) == 1 and isinstance(value[0], int)
+
+
+def read_exif(buf:memoryview) -> Tuple[str, float, float]:
+    """
+    Extract the original date-time and GPS position from an image's EXIF metadata.
+
+    Args:
+        buf (memoryview): The encoded image file (any bytes-like object).
+
+    Returns:
+        Tuple[str, float, float]: The date-time ('YYYY:MM:DD HH:MM:SS'), latitude
+            and longitude in decimal degrees; each is None if not in the metadata,
+            or not a valid value (e.g. a date of all zeros, a GPS tag of the
+            wrong type).
+
+    Raises:
+        ValueError: If the EXIF block is malformed.
+    """
+    tiff_buf = find_exif(buf)
+    if tiff_buf is None:
+        return None, None, None
+    try:
+        tiff = _Tiff(tiff_buf)
+        ifd0 = tiff.read_ifd(tiff.ifd0, {TAG_DATETIME, TAG_EXIF_IFD, TAG_GPS_IFD})
+
+        image_datetime = None
+        if _is_offset(ifd0.get(TAG_EXIF_IFD)):
+            image_datetime = _valid_datetime(
+                tiff.read_ifd(ifd0[TAG_EXIF_IFD][0], {TAG_DATETIME_ORIGINAL}).get(TAG_DATETIME_ORIGINAL))
+        # fall back to the (modification) date-time in IFD0
+        image_datetime = image_datetime or _valid_datetime(ifd0.get(TAG_DATETIME))
+
+        latitude = longitude = None
+        if _is_offset(ifd0.get(TAG_GPS_IFD)):
+            gps = tiff.read_ifd(ifd0[TAG_GPS_IFD][0], {TAG_GPS_LATITUDE_REF, TAG_GPS_LATITUDE,
+                                                       TAG_GPS_LONGITUDE_REF, TAG_GPS_LONGITUDE})
+            latitude = _gps_coordinate(gps, TAG_GPS_LATITUDE, TAG_GPS_LATITUDE_REF, ("N", "S"), 90.0)
+            longitude = _gps_coordinate(gps, TAG_GPS_LONGITUDE, TAG_GPS_LONGITUDE_REF, ("E", "W"), 180.0)
+            if latitude is None or longitude is None: # half a position is no position
+                latitude = longitude = None
+    except struct.error as e:
+        raise ValueError(f"truncated EXIF block: {e}") from e
+    return image_datetime, latitude, longitude
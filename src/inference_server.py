@@ -0,0 +1,304 @@
+from typing import Any, Callable, Dict, List
+from collections import Counter, deque
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# how long `predict` waits for a result by default, so a stuck model cannot hang a session
+PREDICT_TIMEOUT_S = 120.0
+
+
+def make_batch_fn(model:Any, top_k:int = 3) -> Callable[[List[Any]], List[dict]]:
+    """
+    Build a function that classifies a list of images in one model call
+
+    The cetacean classifier's own `__call__` takes a single image and returns
+    `{'predictions': [...]}`. To batch, we use the pieces the model wrapper
+    exposes, in order of preference:
+
+    1. a `predict_batch(images)` method (e.g. an exported backend);
+    2. `preprocess_image(image)` plus the underlying torch module in
+       `.model`: the per-image tensors are concatenated along the batch
+       dimension and run through the module in one forward pass, then the
+       species logits are ranked and mapped to names via `config.id2species`;
+    3. otherwise, fall back to calling the model once per image.
+
+    The second way rebuilds what the wrapper's `__call__` does from its
+    parts, so it is checked against it (see `check_against_model`): if the
+    two disagree on the first batch, the model is called once per image.
+
+    Args:
+        model (Any): The loaded cetacean classifier.
+        top_k (int): The number of species to return per image. Default is 3.
+
+    Returns:
+        Callable: A function mapping a list of images to a list of
+            `{'predictions': [...]}` dictionaries, one per image.
+    """
+    if hasattr(model, "predict_batch"):
+        return model.predict_batch
+
+    module = getattr(model, "model", None)
+    id2species = getattr(getattr(model, "config", None), "id2species", None)
+    if hasattr(model, "preprocess_image") and callable(module) and id2species:
+        import torch
+
+        def _species(ix:int) -> str:
+            # configs loaded from json have string keys
+            return id2species[ix] if ix in id2species else id2species[str(ix)]
+
+        def _batched(images:List[Any]) -> List[dict]:
+            batch = torch.cat([model.preprocess_image(img) for img in images], dim=0)
+            with torch.no_grad():
+                out = module(batch)
+            # the module returns (individual id logits, species logits)
+            logits = out[-1] if isinstance(out, (tuple, list)) else out
+            ranked = np.argsort(-logits.detach().cpu().numpy(), axis=1)[:, :top_k]
+            return [{'predictions': [_species(int(ix)) for ix in row]} for row in ranked]
+        return check_against_model(_batched, model, top_k)
+
+    m_logger.warning("model exposes no batched interface, classifying one image at a time")
+    return lambda images: [model(img) for img in images]
+
+
+def check_against_model(batch_fn:Callable[[List[Any]], List[dict]], model:Any,
+                        top_k:int = 3) -> Callable[[List[Any]], List[dict]]:
+    """
+    Wrap a batched classifier so that its first batch is checked against the model's own `__call__`
+
+    On the first call, the images are also classified one at a time with
+    `model(image)`. If the top `top_k` species of any image differ, the
+    batched function is not used again (it is logged), and every later call
+    classifies the images one at a time.
+
+    Args:
+        batch_fn (Callable): The batched classifier.
+        model (Any): The model, whose `__call__` returns `{'predictions': [...]}` for one image.
+        top_k (int): The number of species compared per image. Default is 3.
+
+    Returns:
+        Callable: A function with the interface of `batch_fn`.
+    """
+    chosen = [] # the function used once the first batch is checked
+    lock = threading.Lock()
+
+    def _per_image(images:List[Any]) -> List[dict]:
+        return [model(img) for img in images]
+
+    def _checked(images:List[Any]) -> List[dict]:
+        if not chosen:
+            with lock:
+                if not chosen:
+                    results = list(batch_fn(images))
+                    expected = _per_image(images)
+                    mismatch = [i for i, (res, exp) in enumerate(zip(results, expected))
+                                if list(res['predictions'])[:top_k] != list(exp['predictions'])[:top_k]]
+                    if len(results) != len(expected) or mismatch:
+                        i = mismatch[0] if mismatch else 0
+                        m_logger.warning(f"the batched classifier does not match the model "
+                                         f"(image {i}: {results[i]['predictions'] if i < len(results) else None} "
+                                         f"vs {expected[i]['predictions']}), classifying one image at a time")
+                        chosen.append(_per_image)
+                    else:
+                        chosen.append(batch_fn)
+                    return expected
+        return chosen[0](images)
+    return _checked
+
+
+class _Request:
+    '''an image waiting for classification, and where to put the result'''
+    def __init__(self, image:Any):
+        self.image = image
+        self.future = Future()
+        self.t_submit = time.perf_counter()
+
+
+class BatchingInferenceServer:
+    """
+    An in-process queue that micro-batches classification requests
+
+    Requests from concurrent streamlit sessions are put on a queue. A worker
+    thread takes the first waiting request, then keeps collecting more for up
+    to `max_wait_ms` (or until `max_batch_size` is reached), and classifies
+    them all with one call to `batch_fn`. Each caller gets its own result via
+    a future.
+
+    Attributes:
+        batch_fn (Callable): Function mapping a list of images to a list of results.
+        max_batch_size (int): The largest batch sent to the model.
+        max_wait_ms (float): How long to wait for more requests once one has arrived.
+
+    Methods:
+        submit(image):
+            Queue an image and return a future for its result.
+        predict(image, timeout=None):
+            Queue an image and wait for its result.
+        stats():
+            Returns queue depth, batch-size histogram and latency percentiles.
+        stop():
+            Stops the worker thread.
+    """
+    def __init__(self, batch_fn:Callable[[List[Any]], List[Any]],
+                 max_batch_size:int = 8, max_wait_ms:float = 10.0,
+                 n_latencies:int = 2048):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._batch_sizes = Counter()
+        self._latencies = deque(maxlen=n_latencies) # seconds, submit -> result
+        self._n_done = 0
+        self._n_failed = 0
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="sw-inference", daemon=True)
+        self._worker.start()
+
+    def submit(self, image:Any) -> Future:
+        """
+        Queue an image for classification.
+
+        Args:
+            image (Any): The image, as accepted by the model.
+
+        Returns:
+            Future: Resolves to the result for this image.
+        """
+        req = _Request(image)
+        self._queue.put(req)
+        return req.future
+
+    def predict(self, image:Any, timeout:float = PREDICT_TIMEOUT_S) -> Any:
+        """
+        Classify one image, sharing the model call with concurrent requests.
+
+        Args:
+            image (Any): The image, as accepted by the model.
+            timeout (float, optional): Seconds to wait for the result (None: no
+                limit). Default is `PREDICT_TIMEOUT_S`.
+
+        Returns:
+            Any: The result for this image, e.g. `{'predictions': [...]}`.
+
+        Raises:
+            concurrent.futures.TimeoutError: If there is no result in time.
+        """
+        return self.submit(image).result(timeout=timeout)
+
+    def _collect(self) -> List[_Request]:
+        '''block for the first request, then gather more until full or timed out'''
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                results = list(self.batch_fn([req.image for req in batch]))
+                if len(results) != len(batch):
+                    # which result goes with which request is unknown: fail them all
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} images")
+            except Exception as e:
+                m_logger.error(f"batched inference failed for {len(batch)} images: {e}")
+                for req in batch:
+                    req.future.set_exception(e)
+                with self._stats_lock:
+                    self._n_failed += len(batch)
+                continue
+
+            t_done = time.perf_counter()
+            for req, res in zip(batch, results):
+                req.future.set_result(res)
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._n_done += len(batch)
+                self._latencies.extend(t_done - req.t_submit for req in batch)
+
+    def stats(self) -> dict:
+        """
+        Report the state of the server.
+
+        Returns:
+            dict: With the keys 'queue_depth', 'n_done', 'n_failed',
+                'batch_sizes' (batch size -> number of batches), and
+                'p50_ms', 'p95_ms', 'p99_ms' over the recent requests.
+        """
+        with self._stats_lock:
+            latencies = np.array(self._latencies)
+            stats = {
+                'queue_depth': self._queue.qsize(),
+                'n_done': self._n_done,
+                'n_failed': self._n_failed,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+            }
+        for p in (50, 95, 99):
+            stats[f'p{p}_ms'] = round(float(np.percentile(latencies, p)) * 1000, 1) if len(latencies) else None
+        return stats
+
+    def stop(self) -> None:
+        """Stop the worker thread (requests still queued are not processed)."""
+        self._stop.set()
+        self._worker.join()
+
+
+_servers: Dict[tuple, BatchingInferenceServer] = {}
+_servers_lock = threading.Lock()
+
+def get_server(key:tuple, model:Any, max_batch_size:int = 8,
+               max_wait_ms:float = 10.0) -> BatchingInferenceServer:
+    """
+    Return the process-wide batching server for a model, creating it on first use.
+
+    Args:
+        key (tuple): Identifies the model, e.g. (model_id, revision).
+        model (Any): The loaded model, used if the server has to be created.
+        max_batch_size (int): The largest batch sent to the model. Default is 8.
+        max_wait_ms (float): How long to wait for more requests, in ms. Default is 10.
+
+    Returns:
+        BatchingInferenceServer: The server shared by all sessions.
+    """
+    with _servers_lock:
+        if key not in _servers:
+            m_logger.info(f"starting batching server for {key} "
+                          f"(max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+            _servers[key] = BatchingInferenceServer(
+                make_batch_fn(model), max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        return _servers[key]
+
+
+def all_stats() -> List[dict]:
+    """
+    Report the stats of every batching server in this process.
+
+    Returns:
+        list: A list of dictionaries, as from `BatchingInferenceServer.stats`, plus a 'model' key.
+    """
+    with _servers_lock:
+        items = list(_servers.items())
+    return [{'model': "@".join(map(str, key)), **srv.stats()} for key, srv in items]
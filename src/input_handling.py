@@ -1,17 +1,19 @@
-from PIL import Image
-from PIL import ExifTags
+from typing import Tuple
 import re
 import datetime
 import hashlib
 import logging
+import os
 
 import streamlit as st
 from streamlit.runtime.uploaded_file_manager import UploadedFile # for type hinting
 from streamlit.delta_generator import DeltaGenerator
 
-import cv2
 import numpy as np
 
+import exif_meta as sw_exif
+import tracing as sw_trace
+
 m_logger = logging.getLogger(__name__)
 # we can set the log level locally for funcs in this module
 #g_m_logger.setLevel(logging.DEBUG)
@@ -25,6 +27,11 @@ both the UI elements (setup_input_UI) and the validation functions.
 #allowed_image_types = ['webp']
 allowed_image_types = ['jpg', 'jpeg', 'png', 'webp']
 
+# uploads are kept at bounded resolution: the models resize their input to
+# well below this anyway, and the browser only needs a preview
+MODEL_MAX_SIDE = int(os.environ.get("SW_MODEL_MAX_SIDE", 1024))
+DISPLAY_MAX_SIDE = int(os.environ.get("SW_DISPLAY_MAX_SIDE", 640))
+
 import random
 import string
 def generate_random_md5():
@@ -58,6 +65,8 @@ class InputObservation:
             Additional time option for the observation.
         uploaded_filename (Any): 
             The uploaded filename associated with the observation.
+        image_md5 (str):
+            The md5 hex digest of the image bytes (computed at upload).
 
     Methods:
         __str__():
@@ -77,7 +86,7 @@ class InputObservation:
         from_input(input):
             Creates an observation from another input observation.
     """
-    def __init__(self, image=None, latitude=None, longitude=None, author_email=None, date=None, time=None, date_option=None, time_option=None, uploaded_filename=None):
+    def __init__(self, image=None, latitude=None, longitude=None, author_email=None, date=None, time=None, date_option=None, time_option=None, uploaded_filename=None, image_md5=None):
         self.image = image
         self.latitude = latitude
         self.longitude = longitude
@@ -87,6 +96,7 @@ class InputObservation:
         self.date_option = date_option
         self.time_option = time_option
         self.uploaded_filename = uploaded_filename
+        self.image_md5 = image_md5
 
     def __str__(self):
         return f"Observation: {self.image}, {self.latitude}, {self.longitude}, {self.author_email}, {self.date}, {self.time}, {self.date_option}, {self.time_option}, {self.uploaded_filename}"
@@ -109,7 +119,7 @@ class InputObservation:
         return {
             #"image": self.image,
             "image_filename": self.uploaded_filename.name if self.uploaded_filename else None,
-            "image_md5": hashlib.md5(self.uploaded_filename.read()).hexdigest() if self.uploaded_filename else generate_random_md5(),
+            "image_md5": self._image_md5(),
             "latitude": self.latitude,
             "longitude": self.longitude,
             "author_email": self.author_email,
@@ -119,9 +129,18 @@ class InputObservation:
             # "time_option": self.time_option,
             "date_option": str(self.date_option),
             "time_option": str(self.time_option),
-            "uploaded_filename": self.uploaded_filename
+            "uploaded_filename": self.uploaded_filename.name if self.uploaded_filename else None,
         }
 
+    def _image_md5(self) -> str:
+        # the hash from ingestion if we have it; otherwise hash the whole file
+        # (getvalue, unlike read, does not depend on the stream position)
+        if self.image_md5 is not None:
+            return self.image_md5
+        if self.uploaded_filename:
+            return hashlib.md5(self.uploaded_filename.getvalue()).hexdigest()
+        return generate_random_md5()
+
     @classmethod
     def from_dict(cls, data):
         return cls(data["image"], data["latitude"], data["longitude"], data["author_email"], data["date"], data["time"], data["date_option"], data["time_option"], data["uploaded_filename"])
@@ -167,6 +186,174 @@ def is_valid_email(email:str) -> bool:
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+
+def _fit(image:np.ndarray, max_side:int) -> np.ndarray:
+    '''downscale `image` so its longest side is at most `max_side` (never upscales)'''
+    h, w = image.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1.0:
+        return image
+    import cv2
+    return cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def decode_bounded(buf:memoryview, max_side:int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Decode an image at the lowest resolution that keeps its longest side >= `max_side`.
+
+    For JPEGs the decoder itself scales down (by 1/2, 1/4 or 1/8), which
+    skips most of the work of decoding a large photo; other formats are
+    decoded in full. The result is then resized to fit `max_side`.
+
+    Args:
+        buf (memoryview): The encoded image file (any bytes-like object).
+        max_side (int): The longest side of the result, in pixels.
+
+    Returns:
+        Tuple[np.ndarray, Tuple[int, int]]: The decoded image (BGR) and the
+            (height, width) of the image at full resolution; (None, None) if
+            it cannot be decoded.
+    """
+    import cv2 # imported on the first upload, not with the app
+
+    flag = cv2.IMREAD_COLOR
+    full_shape = None
+    size = sw_exif.jpeg_size(buf)
+    if size is not None:
+        full_shape = (size[1], size[0])
+        for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) // factor >= max_side:
+                flag = reduced
+                break
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), flag)
+    if image is None:
+        return None, None
+    if full_shape is None:
+        full_shape = image.shape[:2]
+    return _fit(image, max_side), full_shape
+
+
+class IngestedImage:
+    """
+    An uploaded image, decoded and hashed, with the metadata from its EXIF
+
+    Only bounded-size versions of the image are kept: one for the models and
+    a smaller one for display.
+
+    Attributes:
+        image (np.ndarray): The image for the models (BGR), at most MODEL_MAX_SIDE pixels.
+        thumbnail (np.ndarray): The image for display (BGR), at most DISPLAY_MAX_SIDE pixels.
+        image_md5 (str): The md5 hex digest of the file bytes.
+        image_datetime (str): The original date-time from EXIF, or None.
+        latitude (float): The GPS latitude from EXIF, or None.
+        longitude (float): The GPS longitude from EXIF, or None.
+        n_bytes (int): The size of the encoded file.
+        full_shape (tuple): The (height, width) of the image at full resolution.
+    """
+    def __init__(self, image:np.ndarray, image_md5:str, image_datetime:str = None,
+                 latitude:float = None, longitude:float = None, n_bytes:int = 0,
+                 thumbnail:np.ndarray = None, full_shape:tuple = None):
+        self.image = image
+        self.thumbnail = thumbnail if thumbnail is not None else image
+        self.image_md5 = image_md5
+        self.image_datetime = image_datetime
+        self.latitude = latitude
+        self.longitude = longitude
+        self.n_bytes = n_bytes
+        self.full_shape = full_shape if full_shape is not None else \
+            (None if image is None else image.shape[:2])
+
+    def memory_report(self) -> dict:
+        """
+        Compare the memory held for this image with a full-resolution decode.
+
+        Returns:
+            dict: With the keys 'full_shape', 'model_shape', 'thumb_shape',
+                'full_bytes', 'kept_bytes' and 'saved_bytes'.
+        """
+        if self.image is None:
+            return {'full_shape': None, 'model_shape': None, 'thumb_shape': None,
+                    'full_bytes': 0, 'kept_bytes': 0, 'saved_bytes': 0}
+        full_bytes = self.full_shape[0] * self.full_shape[1] * 3
+        kept_bytes = self.image.nbytes + (self.thumbnail.nbytes if self.thumbnail is not self.image else 0)
+        return {'full_shape': str(self.full_shape), 'model_shape': str(self.image.shape[:2]),
+                'thumb_shape': str(self.thumbnail.shape[:2]),
+                'full_bytes': full_bytes, 'kept_bytes': kept_bytes, 'saved_bytes': full_bytes - kept_bytes}
+
+    def __repr__(self):
+        return (f"IngestedImage: {self.image_md5}, {None if self.image is None else self.image.shape}, "
+                f"{self.image_datetime}, {self.latitude}, {self.longitude}, {self.n_bytes}")
+
+
+def ingest_image(buf:memoryview, name:str = None,
+                 model_max_side:int = None, display_max_side:int = None) -> IngestedImage:
+    """
+    Decode, hash and read the EXIF of an encoded image, from one buffer.
+
+    The buffer is read in place: the decoder, the hash and the EXIF parser
+    all work on views of it, so the file bytes are not copied. The image is
+    decoded at reduced resolution (see `decode_bounded`), and only a
+    model-sized image and a display thumbnail are kept.
+
+    Args:
+        buf (memoryview): The encoded image file (any bytes-like object).
+        name (str, optional): The file name, for log messages.
+        model_max_side (int, optional): Longest side of the model image. Default is MODEL_MAX_SIDE.
+        display_max_side (int, optional): Longest side of the thumbnail. Default is DISPLAY_MAX_SIDE.
+
+    Returns:
+        IngestedImage: The decoded image and its metadata.
+    """
+    model_max_side = model_max_side or MODEL_MAX_SIDE
+    display_max_side = display_max_side or DISPLAY_MAX_SIDE
+    buf = memoryview(buf)
+
+    with sw_trace.span("image_decode"):
+        image, full_shape = decode_bounded(buf, model_max_side)
+        thumbnail = _fit(image, display_max_side) if image is not None else None
+
+    with sw_trace.span("image_hash"):
+        image_md5 = hashlib.md5(buf).hexdigest()
+    with sw_trace.span("exif_parse"):
+        try:
+            image_datetime, latitude, longitude = sw_exif.read_exif(buf)
+        except Exception as e:
+            m_logger.warning(f"could not read metadata from image {name}: {e}")
+            image_datetime = latitude = longitude = None
+    return IngestedImage(image, image_md5, image_datetime, latitude, longitude, n_bytes=buf.nbytes,
+                         thumbnail=thumbnail, full_shape=full_shape)
+
+
+def get_ingested_image(uploaded_file:UploadedFile) -> IngestedImage:
+    """
+    Ingest an uploaded file, once per upload.
+
+    The result is kept in the session state, keyed on the upload's file id,
+    so reruns of the script reuse it instead of decoding the image again.
+
+    Args:
+        uploaded_file (UploadedFile): The file from `st.file_uploader`.
+
+    Returns:
+        IngestedImage: The decoded image and its metadata.
+    """
+    key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    cached = st.session_state.get("ingested_image", None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    # getbuffer is a view of the uploaded bytes (no copy, no stream position)
+    ingested = ingest_image(uploaded_file.getbuffer(), uploaded_file.name)
+    report = ingested.memory_report()
+    m_logger.info(f"ingested {uploaded_file.name}: {report['full_shape']} -> {report['model_shape']} "
+                  f"(model) + {report['thumb_shape']} (display), {report['saved_bytes'] / 2**20:.1f} MiB saved")
+    # only the current upload is kept
+    st.session_state.ingested_image = (key, ingested)
+    return ingested
+
+
 # Function to extract date and time from image metadata
 def get_image_datetime(image_file: UploadedFile) -> str | None: 
     """
@@ -182,15 +369,11 @@ def get_image_datetime(image_file: UploadedFile) -> str | None:
         Warning: If the date and time could not be extracted from the image metadata.
     """
     try:
-        image = Image.open(image_file)
-        exif_data = image._getexif()
-        if exif_data is not None:
-            for tag, value in exif_data.items():
-                if ExifTags.TAGS.get(tag) == 'DateTimeOriginal':
-                    return value
-    except Exception as e: # FIXME: what types of exception?
-         st.warning(f"Could not extract date from image metadata. (file: {image_file.name})")
-         # TODO: add to logger
+        # only the EXIF block is parsed, from a view of the uploaded bytes
+        return sw_exif.read_exif(image_file.getbuffer())[0]
+    except Exception as e:
+        st.warning(f"Could not extract date from image metadata. (file: {image_file.name})")
+        m_logger.warning(f"could not read EXIF of {image_file.name}: {e}")
     return None
 
 
@@ -235,33 +418,40 @@ def setup_input(
     # 1. Image Selector
     uploaded_filename = viewcontainer.file_uploader("Upload an image", type=allowed_image_types)
     image_datetime = None  # For storing date-time from image
+    ingested = None
 
     if uploaded_filename is not None:
-        # Display the uploaded image
-        #image = Image.open(uploaded_filename)
-        # load image using cv2 format, so it is compatible with the ML models
-        file_bytes = np.asarray(bytearray(uploaded_filename.read()), dtype=np.uint8)
-        image = cv2.imdecode(file_bytes, 1)
-
-
-        viewcontainer.image(image, caption='Uploaded Image.', use_column_width=True)
-        # store the image in the session state
+        # read the upload once: decode, hash and extract the metadata from
+        # the same buffer (cached per upload, so reruns do not repeat it)
+        ingested = get_ingested_image(uploaded_filename)
+        image = ingested.image
+
+        # the browser gets the thumbnail, not the full-resolution photo
+        viewcontainer.image(ingested.thumbnail, caption='Uploaded Image.', use_column_width=True)
+        # store the (model-sized) image in the session state, with the hash of
+        # its bytes (used to look up cached predictions), and the thumbnail
         st.session_state.image = image
-        
+        st.session_state.image_thumb = ingested.thumbnail
+        st.session_state.image_md5 = ingested.image_md5
+        st.session_state.image_memory = ingested.memory_report()
 
-        # Extract and display image date-time
-        image_datetime = get_image_datetime(uploaded_filename)
-        print(f"[D] image date extracted as {image_datetime}")
+        image_datetime = ingested.image_datetime
         m_logger.debug(f"image date extracted as {image_datetime} (from {uploaded_filename})")
         
 
+    # the position from the image metadata, if it has one
+    default_lat, default_lon = spoof_metadata.get('latitude', ""), spoof_metadata.get('longitude', "")
+    if ingested is not None and ingested.latitude is not None:
+        default_lat, default_lon = f"{ingested.latitude:.6f}", f"{ingested.longitude:.6f}"
+        m_logger.debug(f"image position extracted as {default_lat}, {default_lon}")
+
     # 2. Latitude Entry Box
-    latitude = viewcontainer.text_input("Latitude", spoof_metadata.get('latitude', ""))
+    latitude = viewcontainer.text_input("Latitude", default_lat)
     if latitude and not is_valid_number(latitude):
         viewcontainer.error("Please enter a valid latitude (numerical only).")
         m_logger.error(f"Invalid latitude entered: {latitude}.")
     # 3. Longitude Entry Box
-    longitude = viewcontainer.text_input("Longitude", spoof_metadata.get('longitude', ""))
+    longitude = viewcontainer.text_input("Longitude", default_lon)
     if longitude and not is_valid_number(longitude):
         viewcontainer.error("Please enter a valid longitude (numerical only).")
         m_logger.error(f"Invalid latitude entered: {latitude}.")
@@ -274,9 +464,13 @@ def setup_input(
 
     # 5. date/time
     ## first from image metadata
-    if image_datetime is not None:
-        time_value = datetime.datetime.strptime(image_datetime, '%Y:%m:%d %H:%M:%S').time()
-        date_value = datetime.datetime.strptime(image_datetime, '%Y:%m:%d %H:%M:%S').date()
+    try:
+        parsed_datetime = datetime.datetime.strptime(image_datetime, sw_exif.DATETIME_FORMAT)
+    except (TypeError, ValueError): # none, or not a date-time we can read
+        parsed_datetime = None
+    if parsed_datetime is not None:
+        time_value = parsed_datetime.time()
+        date_value = parsed_datetime.date()
     else:
         time_value = datetime.datetime.now().time()  # Default to current time
         date_value = datetime.datetime.now().date()
@@ -287,6 +481,8 @@ def setup_input(
 
     observation = InputObservation(image=uploaded_filename, latitude=latitude, longitude=longitude, 
                                    author_email=author_email, date=image_datetime, time=None, 
-                                   date_option=date_option, time_option=time_option)
+                                   date_option=date_option, time_option=time_option,
+                                   uploaded_filename=uploaded_filename,
+                                   image_md5=st.session_state.image_md5 if uploaded_filename is not None else None)
     return observation
 
@@ -1,27 +1,31 @@
-#import datetime
-from PIL import Image
+import datetime
 
 import json
 import logging
 import os
-import tempfile
 
 import pandas as pd
 import streamlit as st
 from streamlit.delta_generator import DeltaGenerator # for type hinting
-import folium
-from streamlit_folium import st_folium
-from huggingface_hub import HfApi
-from transformers import pipeline
-from transformers import AutoModelForImageClassification
-
-from datasets import disable_caching
-disable_caching()
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+# folium, streamlit_folium, PIL, cv2 and the ML libraries are imported where
+# used (by the tab or action that needs them), to start the app sooner; see
+# `python -m dev.benchmarks.bench_imports`
 
 import alps_map as sw_am
+import inference_server as sw_infer
 import input_handling as sw_inp
+import model_registry as sw_models
+import model_store as sw_mstore
+import prediction_cache as sw_pcache
+import rerun_profiler as sw_prof
+import ref_assets as sw_assets
+import session_memory as sw_mem
 import obs_map as sw_map
+import obs_store as sw_obs
 import st_logs as sw_logs
+import tracing as sw_trace
+import upload_queue as sw_upload
 import whale_gallery as sw_wg
 import whale_viewer as sw_wv
 
@@ -32,9 +36,20 @@ import whale_viewer as sw_wv
 os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
 #classifier_revision = '0f9c15e2db4d64e7f622ade518854b488d8d35e6'
 classifier_revision = 'main' # default/latest version
-# and the dataset of observations (hf dataset in our space)
-dataset_id = "Saving-Willy/temp_dataset"
-data_files = "data/train-00000-of-00001.parquet"
+# and the dataset of observations (hf dataset in our space). For local
+# development, SW_OBS_DATASET can point to a parquet file or directory.
+dataset_id = os.environ.get("SW_OBS_DATASET", "Saving-Willy/temp_dataset")
+data_files = os.environ.get("SW_OBS_DATA_FILES", "data/train-00000-of-00001.parquet")
+
+# requests from concurrent sessions are batched for the cetacean classifier
+INFERENCE_MAX_BATCH = int(os.environ.get("SW_INFERENCE_MAX_BATCH", 8))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("SW_INFERENCE_MAX_WAIT_MS", 10))
+# the most log records shown in the Log tab (the newest that match the filters)
+LOG_MAX_ROWS = 500
+# the records per page of the on-disk log history
+LOG_HISTORY_PAGE = 100
+# if set, the span histograms are written there after each rerun (Prometheus text format)
+METRICS_FILE = os.environ.get("SW_METRICS_FILE", None)
 
 USE_BASIC_MAP = False
 DEV_SIDEBAR_LIB = True
@@ -49,6 +64,11 @@ st.set_page_config(layout="wide")
 
 
 
+# load the models once per process, up front (if SW_WARMUP_MODELS=1)
+sw_models.warmup_from_env(classifier_revision)
+# the reference images for the gallery and viewer are resized once per
+# process, when first shown (see ref_assets)
+
 # initialise various session state variables
 if "handler" not in st.session_state:
     st.session_state['handler'] = sw_logs.setup_logging()
@@ -65,8 +85,19 @@ if "whale_prediction1" not in st.session_state:
 if "image" not in st.session_state:
     st.session_state.image = None
 
+if "image_md5" not in st.session_state:
+    st.session_state.image_md5 = None
+if "image_thumb" not in st.session_state:
+    st.session_state.image_thumb = None
+if "image_memory" not in st.session_state:
+    st.session_state.image_memory = None
+
 if "tab_log" not in st.session_state:
     st.session_state.tab_log = None
+
+# this session's observations in the upload queue: (item id, path in repo)
+if "upload_items" not in st.session_state:
+    st.session_state.upload_items = []
     
 
 def metadata2md() -> str:
@@ -101,30 +132,35 @@ def push_observation(tab_log:DeltaGenerator=None):
     if tab_log is not None:
         tab_log.info(f"Uploading observation: {metadata_str}")
         
-    # get huggingface api
-    import os 
-    token = os.environ.get("HF_TOKEN", None)
-    api = HfApi(token=token)
-
-    f = tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False)
-    f.write(metadata_str)
-    f.close()
-    st.info(f"temp file: {f.name} with metadata written...")
-
+    # spool the observation for upload; the upload queue pushes it to the
+    # dataset in a batched commit in the background, so we do not wait here
     path_in_repo= f"metadata/{st.session_state.full_data['author_email']}/{st.session_state.full_data['image_md5']}.json"
-    msg = f"fname: {f.name} | path: {path_in_repo}"
-    print(msg)
-    st.warning(msg)
-    rv = api.upload_file(
-        path_or_fileobj=f.name,
-        path_in_repo=path_in_repo,
-        repo_id="Saving-Willy/temp_dataset",
-        repo_type="dataset",
-    )
-    print(rv)
-    msg = f"data attempted tx to repo happy walrus: {rv}"
+    with sw_trace.span("observation_push"):
+        item_id = sw_upload.get_queue().enqueue(path_in_repo, metadata_str)
+    st.session_state.upload_items.append((item_id, path_in_repo))
+    msg = f"observation queued for upload: {path_in_repo} (id {item_id})"
     g_logger.info(msg)
     st.info(msg)
+
+
+def show_upload_status(container:DeltaGenerator) -> None:
+    """
+    Show the upload state of the observations this session submitted.
+
+    Args:
+        container (DeltaGenerator): Where to show them.
+    """
+    if not st.session_state.upload_items:
+        return
+    queue = sw_upload.get_queue()
+    rows = [{'observation': path, 'status': queue.item_status(item_id)}
+            for item_id, path in st.session_state.upload_items]
+    container.dataframe(rows, use_container_width=True, hide_index=True)
+    # failed items are requeued periodically anyway; this is for the impatient
+    if any(row['status'] == 'failed' for row in rows):
+        if container.button("Retry failed uploads", key="retry_failed_uploads"):
+            n = queue.retry_failed()
+            container.info(f"{n} observations queued for upload again")
     
 
 
@@ -162,7 +198,9 @@ def main() -> None:
 
 
     # create a sidebar, and parse all the input (returned as `observation` object)
-    observation = sw_inp.setup_input(viewcontainer=st.sidebar)
+    sw_prof.mark("sidebar_input")
+    with sw_trace.span("input_setup"):
+        observation = sw_inp.setup_input(viewcontainer=st.sidebar)
 
         
     if 0:## WIP
@@ -177,42 +215,124 @@ def main() -> None:
             st.session_state.full_data['class_overriden'] = None
 
 
+    sw_prof.mark("tab_map")
     with tab_map:
         # visual structure: a couple of toggles at the top, then the map inlcuding a
         # dropdown for tileset selection.
-        tab_map_ui_cols = st.columns(2)
+        tab_map_ui_cols = st.columns(3)
         with tab_map_ui_cols[0]:
             show_db_points = st.toggle("Show Points from DB", True)
         with tab_map_ui_cols[1]:
             dbg_show_extra = st.toggle("Show Extra points (test)", False)
+        with tab_map_ui_cols[2]:
+            render_mode = st.selectbox("Render mode", sw_map.RENDER_MODES)
             
         if show_db_points:
             # show a nicer map, observations marked, tileset selectable.
             st_data = sw_map.present_obs_map(
                 dataset_id=dataset_id, data_files=data_files,
-                dbg_show_extra=dbg_show_extra)
+                dbg_show_extra=dbg_show_extra, render_mode=render_mode)
             
         else:
             # development map.
             st_data = sw_am.present_alps_map()
             
 
+    sw_prof.mark("tab_log")
     with tab_log:
         handler = st.session_state['handler']
         if handler is not None:
-            records = sw_logs.parse_log_buffer(handler.buffer)
-            st.dataframe(records[::-1], use_container_width=True,)
-            st.info(f"Length of records: {len(records)}")
+            # filter the structured log records (no text is parsed)
+            log_cols = st.columns(3)
+            log_levels = log_cols[0].multiselect("Levels", ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                                                 placeholder="All levels")
+            log_modules = log_cols[1].multiselect("Modules", handler.buffer.modules(), placeholder="All modules")
+            log_windows = {"all": None, "last 5 min": datetime.timedelta(minutes=5),
+                           "last hour": datetime.timedelta(hours=1), "last day": datetime.timedelta(days=1)}
+            log_window = log_windows[log_cols[2].selectbox("Time range", list(log_windows))]
+            log_since = datetime.datetime.now() - log_window if log_window is not None else None
+            records = handler.buffer.query(levels=log_levels or None, modules=log_modules or None,
+                                           since=log_since, limit=LOG_MAX_ROWS)
+            st.dataframe(records, use_container_width=True,)
+            st.info(f"Showing {len(records)} of {len(handler.buffer)} records ({handler.n_elems(verb=True)})")
+            if handler.queue is not None:
+                st.markdown("#### Log queue")
+                st.dataframe([handler.queue.stats()], use_container_width=True)
+            if handler.sink is not None:
+                # the on-disk history, of all replicas, read a page at a time
+                st.markdown("#### Log history")
+                archive = sw_logs.LogArchive(handler.sink.log_dir)
+                hist_cols = st.columns(3)
+                hist_text = hist_cols[0].text_input("Search messages", key="log_hist_text")
+                hist_replicas = hist_cols[1].multiselect("Replicas", archive.replicas(), placeholder="All replicas")
+                hist_page = hist_cols[2].number_input("Page", min_value=1, value=1, step=1, key="log_hist_page")
+                history = archive.search(text=hist_text or None, levels=log_levels or None,
+                                         modules=log_modules or None, since=log_since,
+                                         replicas=hist_replicas or None, limit=LOG_HISTORY_PAGE,
+                                         offset=(hist_page - 1) * LOG_HISTORY_PAGE)
+                st.dataframe(history, use_container_width=True)
+                hist_stats = archive.stats()
+                st.info(f"Page {hist_page}: {len(history)} records. On disk: {hist_stats['segments']} segments "
+                        f"({hist_stats['bytes'] / 2**20:.1f} MiB) from {hist_stats['replicas']} replicas, "
+                        f"since {hist_stats['oldest']:%Y-%m-%d %H:%M}" if hist_stats['segments'] else
+                        f"Page {hist_page}: {len(history)} records. No history on disk yet.")
         else:
             st.error("⚠️ No log handler found!")
 
+        st.markdown("#### Latency")
+        st.dataframe(sw_trace.tracer.stats(), use_container_width=True)
+        with st.expander("Recent traces"):
+            st.dataframe(sw_trace.tracer.recent_traces(), use_container_width=True)
+        st.download_button("Export metrics (Prometheus)", sw_trace.tracer.export_prometheus(),
+                           file_name="saving_willy_metrics.prom", mime="text/plain")
+        profiler = sw_prof.get_profiler()
+        if profiler is not None:
+            ctx = get_script_run_ctx()
+            last_profile = profiler.last_report(ctx.session_id) if ctx is not None else None
+            if last_profile is not None:
+                st.markdown(f"#### Rerun profile (rerun {last_profile['rerun']}, "
+                            f"{last_profile['total_s'] * 1e3:.0f} ms)")
+                st.dataframe(last_profile['sections'], use_container_width=True)
+        st.markdown("#### Loaded models")
+        st.dataframe(sw_models.registry.stats(), use_container_width=True)
+        model_store = sw_mstore.get_store()
+        if model_store is not None:
+            st.markdown(f"#### Model store ({model_store.root})")
+            st.dataframe(model_store.load_reports(), use_container_width=True)
+        st.markdown("#### Batched inference")
+        infer_stats = [{**s, 'batch_sizes': str(s['batch_sizes'])} for s in sw_infer.all_stats()]
+        st.dataframe(infer_stats, use_container_width=True)
+        st.markdown("#### Prediction cache")
+        st.dataframe([sw_pcache.get_cache().stats()], use_container_width=True)
+        st.markdown("#### Observation dataset")
+        st.dataframe([sw_obs.store.stats()], use_container_width=True)
+        if st.session_state.image_memory is not None:
+            st.markdown("#### Image memory (this session)")
+            st.dataframe([st.session_state.image_memory], use_container_width=True)
+        st.markdown("#### Session memory")
+        mem_stats = sw_mem.get_governor().stats()
+        st.progress(min(1.0, mem_stats['total_bytes'] / mem_stats['max_total_bytes']),
+                    text=f"{mem_stats['total_bytes'] / 2**20:.1f} of {mem_stats['max_total_bytes'] / 2**20:.0f} MiB "
+                         f"held by {mem_stats['sessions']} sessions ({mem_stats['spilled_sessions']} spilled to disk): "
+                         f"images {mem_stats['images_bytes'] / 2**20:.1f} MiB, form data {mem_stats['full_data_bytes'] / 2**10:.1f} KiB, "
+                         f"predictions {mem_stats['predictions_bytes'] / 2**10:.1f} KiB")
+        st.dataframe([mem_stats], use_container_width=True)
+        st.dataframe(sw_mem.get_governor().session_stats(), use_container_width=True)
+        st.markdown("#### Reference images")
+        st.dataframe([sw_assets.assets.stats()], use_container_width=True)
+        st.markdown("#### Observation uploads")
+        st.dataframe([sw_upload.get_queue().status()], use_container_width=True)
+
         
         
+    sw_prof.mark("tab_data")
     with tab_data:
         # the goal of this tab is to allow selection of the new obsvation's location by map click/adjust.
         st.markdown("Coming later hope! :construction:")
 
         st.write("Click on the map to capture a location.")
+        import folium
+        from streamlit_folium import st_folium
         #m = folium.Map(location=visp_loc, zoom_start=7)
         mm = folium.Map(location=[39.949610, -75.150282], zoom_start=16)
         folium.Marker( [39.949610, -75.150282], popup="Liberty Bell", tooltip="Liberty Bell"
@@ -225,15 +345,17 @@ def main() -> None:
             st.info(st_data2['last_clicked'])
 
 
+    sw_prof.mark("tab_gallery")
     with tab_gallery:
         # here we make a container to allow filtering css properties 
         # specific to the gallery (otherwise we get side effects)
         tg_cont = st.container(key="swgallery")
         with tg_cont:
-            sw_wg.render_whale_gallery(n_cols=4)
+            sw_wg.render_whale_gallery_paged(n_cols=4, page_size=12)
         
 
     # Display submitted data
+    sw_prof.mark("validate")
     if st.sidebar.button("Validate"):
         # create a dictionary with the submitted data
         submitted_data = observation.to_dict()
@@ -261,18 +383,29 @@ def main() -> None:
     # - the user can override the species prediction using the dropdown 
     # - an observation is uploaded if the user chooses.
         
+    sw_prof.mark("tab_inference")
     if tab_inference.button("Identify with cetacean classifier"):
-        #pipe = pipeline("image-classification", model="Saving-Willy/cetacean-classifier", trust_remote_code=True)
-        cetacean_classifier = AutoModelForImageClassification.from_pretrained("Saving-Willy/cetacean-classifier", 
-                                                                            revision=classifier_revision,
-                                                                            trust_remote_code=True)
+        # the model is loaded once per process and shared across sessions
+        cetacean_classifier = sw_models.get_cetacean_classifier(revision=classifier_revision)
         
         if st.session_state.image is None:
             # TODO: cleaner design to disable the button until data input done?
             st.info("Please upload an image first.")
         else:
-            # run classifier model on `image`, and persistently store the output
-            out = cetacean_classifier(st.session_state.image) # get top 3 matches
+            # run classifier model on `image`, and persistently store the output.
+            # the request shares a model call with those of concurrent sessions.
+            # identical images (by md5) are served from the prediction cache.
+            # (an exported backend, set by SW_CLASSIFIER_BACKEND, has its own server and cache entries)
+            model_id = sw_models.prediction_model_id()
+            # keyed on the commit: 'main' moves when the model is updated
+            classifier_commit = sw_models.get_cetacean_commit(classifier_revision)
+            server = sw_infer.get_server(
+                (model_id, classifier_revision), cetacean_classifier,
+                max_batch_size=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS)
+            with sw_trace.span("classify", model="cetacean", backend=sw_models.classifier_backend()):
+                out = sw_pcache.get_cache().get_or_compute(
+                    st.session_state.image_md5, model_id, classifier_commit,
+                    lambda: server.predict(st.session_state.image)) # get top 3 matches
             st.session_state.whale_prediction1 = out['predictions'][0]
             st.session_state.classify_whale_done = True
             msg = f"[D]2 classify_whale_done: {st.session_state.classify_whale_done}, whale_prediction1: {st.session_state.whale_prediction1}"
@@ -295,6 +428,7 @@ def main() -> None:
                 st.session_state.full_data['class_overriden'] = selected_class
                 
             btn = st.button("Upload observation to THE INTERNET!", on_click=push_observation)
+            show_upload_status(tab_inference)
             # TODO: the metadata only fills properly if `validate` was clicked.
             tab_inference.markdown(metadata2md())
 
@@ -318,9 +452,10 @@ def main() -> None:
     # - this model predicts if the image is a hotdog or not, and returns probabilities
     # - the input image is the same as for the ceteacean classifier - defined in the sidebar
 
+    sw_prof.mark("tab_hotdogs")
     if tab_hotdogs.button("Get Hotdog Prediction"):   
         
-        pipeline_hot_dog = pipeline(task="image-classification", model="julien-c/hotdog-not-hotdog")
+        pipeline_hot_dog = sw_models.get_hotdog_classifier()
         tab_hotdogs.title("Hot Dog? Or Not?")
 
         if st.session_state.image is None:
@@ -331,10 +466,14 @@ def main() -> None:
             col1, col2 = tab_hotdogs.columns(2)
 
             # display the image (use cached version, no need to reread)
-            col1.image(st.session_state.image, use_column_width=True)
+            col1.image(st.session_state.image_thumb, use_column_width=True)
             # and then run inference on the image
+            from PIL import Image
             hotdog_image = Image.fromarray(st.session_state.image)
-            predictions = pipeline_hot_dog(hotdog_image)
+            with sw_trace.span("classify", model="hotdog"):
+                predictions = sw_pcache.get_cache().get_or_compute(
+                    st.session_state.image_md5, sw_models.HOTDOG_MODEL_ID, sw_models.get_hotdog_commit(),
+                    lambda: pipeline_hot_dog(hotdog_image))
 
             col2.header("Probabilities")
             first = True
@@ -350,4 +489,15 @@ def main() -> None:
             
 
 if __name__ == "__main__":
-    main()
+    # track the memory this session holds (and restore its images if they
+    # were spilled to disk while it was idle)
+    sw_mem.touch_current_session()
+    try:
+        # each rerun is one trace; the spans inside are its children
+        # (and, with SW_PROFILE_DIR set, is profiled section by section)
+        with sw_trace.span("rerun"), sw_prof.rerun():
+            main()
+    finally:
+        sw_mem.release_current_session()
+        if METRICS_FILE:
+            sw_trace.tracer.write_prometheus(METRICS_FILE)
@@ -0,0 +1,75 @@
+from jinja2 import Template
+from branca.element import Element, MacroElement
+
+'''
+custom leaflet layers for the folium maps of observations (see `obs_map.py`)
+
+kept apart from obs_map so that branca and jinja2 (with folium) are only
+imported when a map is drawn.
+'''
+
+
+class ObsGeoJsonLayer(MacroElement):
+    """
+    A leaflet GeoJSON layer drawing each point feature as a coloured circle
+
+    The features are expected to carry `species` and `color` properties.
+    Features that also carry `count` and `n_species` (aggregated cells) are
+    drawn with a radius growing with the count. Circles are drawn on a
+    canvas renderer, which stays responsive with many thousands of points
+    (svg markers do not).
+
+    The GeoJSON is written into the page's script as a javascript literal,
+    with `</` escaped so that a string such as `</script>` in a property
+    cannot close the script element.
+
+    Args:
+        geojson (str): A GeoJSON FeatureCollection, already serialised.
+        radius (int): Radius of the circles, in pixels. Default is 4.
+    """
+    # the script itself, not a macro: it is rendered by `render` below
+    _template = Template("""
+        var {{ this.get_name() }}_renderer = L.canvas();
+        var {{ this.get_name() }} = L.geoJSON({{ this.geojson }}, {
+            pointToLayer: function (feature, latlng) {
+                var p = feature.properties;
+                var radius = {{ this.radius }};
+                var label = p.species;
+                if (p.count !== undefined) {
+                    radius = Math.min(radius + 3 * Math.log10(p.count + 1) * 2, 24);
+                    label = p.count + " sightings, " + p.n_species + " species (mostly " + p.species + ")";
+                }
+                return L.circleMarker(latlng, {
+                    renderer: {{ this.get_name() }}_renderer,
+                    radius: radius,
+                    color: p.color,
+                    fillColor: p.color,
+                    fillOpacity: 0.8,
+                    weight: 1
+                }).bindTooltip(label);
+            }
+        }).addTo({{ this._parent.get_name() }});
+    """)
+
+    def __init__(self, geojson:str, radius:int = 4):
+        super().__init__()
+        self._name = "ObsGeoJsonLayer"
+        # `<\/` is the same string in json, but does not end the html script element
+        self.geojson = geojson.replace("</", "<\\/")
+        self.radius = radius
+
+    def render(self, **kwargs) -> None:
+        # MacroElement.render wraps the rendered script in an Element, which
+        # compiles it as a jinja template -- very slow for megabytes of data.
+        # Insert it verbatim instead.
+        script = self._template.render(this=self, kwargs=kwargs)
+        self.get_root().script.add_child(_VerbatimScript(script), name=self.get_name())
+
+
+class _VerbatimScript(Element):
+    '''a script element whose source is inserted as-is, not parsed as a template'''
+    _template = Template("{{ this.source }}")
+
+    def __init__(self, source:str):
+        super().__init__()
+        self.source = source
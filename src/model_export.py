@@ -0,0 +1,399 @@
+from typing import Any, Callable, List, Tuple
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+'''
+Exported (ONNX / TorchScript) versions of the cetacean classifier
+
+The classifier on the hub is a `transformers` remote-code wrapper around a
+torch module: every call goes through the wrapper's python preprocessing and
+the eager-mode module. `export_classifier` converts the module, at a pinned
+revision, into a single CPU artifact:
+
+- ONNX (run with onnxruntime, so torch is not needed at serving time), or
+- TorchScript (traced and frozen),
+
+optionally with dynamic int8 quantization of the weights. The artifact
+directory holds the model file and a `manifest.json` (the model id and
+revision, the species names, the preprocessing, the checksum of the model
+file, how far the exported logits are from those of the torch module, and
+how often the export agrees with the wrapper's own `__call__`).
+
+The preprocessing (resize, channel order, scaling) is reimplemented in
+numpy, with the parameters fitted on probe images by calling the wrapper's
+own `preprocess_image`; the export fails if the fit does not reproduce it.
+
+`ExportedClassifier` loads an artifact and has the interface of the
+classifier (`__call__` for one image, `predict_batch` for a list), so the
+model registry, the batching server and the batch evaluation use it as is.
+'''
+
+MANIFEST_FILE = "manifest.json"
+FORMATS = {'onnx': "model.onnx", 'torchscript': "model.pt"}
+
+# cv2 interpolations tried when fitting the resize of the wrapper's preprocessing
+_INTERPOLATIONS = {'linear': cv2.INTER_LINEAR, 'area': cv2.INTER_AREA,
+                   'cubic': cv2.INTER_CUBIC, 'nearest': cv2.INTER_NEAREST}
+
+
+def _sha256(path:str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_manifest(artifact_dir:str) -> dict:
+    """
+    Read the manifest of an exported artifact.
+
+    Args:
+        artifact_dir (str): The artifact directory.
+
+    Returns:
+        dict: The manifest (see `export_classifier`).
+    """
+    with open(os.path.join(artifact_dir, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def preprocess(image:np.ndarray, pre:dict) -> np.ndarray:
+    """
+    Preprocess an image as the classifier wrapper does, with fitted parameters.
+
+    Args:
+        image (np.ndarray): The image (H x W x 3, uint8), as given to the classifier.
+        pre (dict): The preprocessing in the manifest: 'size' ([H, W]),
+            'interpolation', 'channels' (the input channel of each output
+            channel), 'scale' and 'offset' (per output channel).
+
+    Returns:
+        np.ndarray: The model input for the image (3 x H x W, float32).
+    """
+    h, w = pre['size']
+    x = cv2.resize(image, (w, h), interpolation=_INTERPOLATIONS[pre['interpolation']])
+    x = x[..., pre['channels']].astype(np.float32)
+    x = x * np.asarray(pre['scale'], dtype=np.float32) + np.asarray(pre['offset'], dtype=np.float32)
+    return np.ascontiguousarray(x.transpose(2, 0, 1))
+
+
+def fit_preprocessing(wrapper_preprocess:Callable[[np.ndarray], Any], probe_shape:Tuple[int, int] = (480, 640),
+                      tolerance:float = 0.05, seed:int = 0) -> dict:
+    """
+    Find the resize, channel order and scaling that the classifier wrapper applies.
+
+    The wrapper is called on probe images: black and white ones give the
+    scaling of each channel (assumed affine), single-channel ones the channel
+    order, and a smooth random one picks the interpolation that reproduces
+    the resize best.
+
+    Args:
+        wrapper_preprocess (Callable): The wrapper's `preprocess_image`,
+            returning a (1 x 3 x H x W) tensor.
+        probe_shape (Tuple[int, int]): The (height, width) of the probe images. Default is (480, 640).
+        tolerance (float): The largest mean absolute error accepted (in model
+            input units, after scaling). Default is 0.05.
+        seed (int): Seeds the random probe. Default is 0.
+
+    Returns:
+        dict: The preprocessing parameters (see `preprocess`), with the 'fit_error'.
+
+    Raises:
+        ValueError: If the fitted preprocessing does not reproduce the wrapper's.
+    """
+    h, w = probe_shape
+
+    def run(image):
+        out = wrapper_preprocess(image)
+        out = out.detach().cpu().numpy() if hasattr(out, "detach") else np.asarray(out)
+        return out.reshape(out.shape[-3:]).astype(np.float32)
+
+    black = run(np.zeros((h, w, 3), dtype=np.uint8))
+    offset = black.mean(axis=(1, 2))
+    channels = [None] * black.shape[0]
+    scale = [0.0] * black.shape[0]
+    for c in range(3):
+        probe = np.zeros((h, w, 3), dtype=np.uint8)
+        probe[..., c] = 255
+        delta = run(probe).mean(axis=(1, 2)) - offset
+        out_c = int(np.argmax(np.abs(delta)))
+        channels[out_c] = c
+        scale[out_c] = float(delta[out_c] / 255)
+    if None in channels:
+        raise ValueError(f"could not find the channel order of the preprocessing (found {channels})")
+
+    rng = np.random.default_rng(seed)
+    smooth = cv2.GaussianBlur(rng.integers(0, 255, (h, w, 3), dtype=np.uint8), (0, 0), 3)
+    expected = run(smooth)
+    pre = {'size': list(expected.shape[1:]), 'channels': channels,
+           'scale': scale, 'offset': [float(v) for v in offset]}
+    errors = {}
+    for name in _INTERPOLATIONS:
+        errors[name] = float(np.abs(preprocess(smooth, {**pre, 'interpolation': name}) - expected).mean())
+    best = min(errors, key=errors.get)
+    if errors[best] > tolerance:
+        raise ValueError(f"the classifier's preprocessing is not a plain resize and affine scaling "
+                         f"(smallest error {errors[best]:.4f} with {best} interpolation, errors {errors})")
+    return {**pre, 'interpolation': best, 'fit_error': round(errors[best], 6)}
+
+
+def _species_list(config:Any) -> List[str]:
+    '''the species names, in the order of the logits'''
+    id2species = config.id2species
+    return [id2species[i] if i in id2species else id2species[str(i)] for i in range(len(id2species))]
+
+
+def _resolve_revision(model_id:str, revision:str) -> str:
+    '''the commit a revision (e.g. a branch) points to on the hub, or None if it cannot be found out'''
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().model_info(model_id, revision=revision).sha
+    except Exception as e:
+        m_logger.warning(f"could not resolve {model_id}@{revision} to a commit: {e}")
+        return None
+
+
+def _probe_images(n:int = 8, shape:Tuple[int, int] = (480, 640)) -> List[np.ndarray]:
+    '''smooth random images, with a different seed (and so different predictions, often) each'''
+    return [cv2.GaussianBlur(np.random.default_rng(seed).integers(0, 255, (*shape, 3), dtype=np.uint8),
+                             (0, 0), 3) for seed in range(n)]
+
+
+def wrapper_agreement(wrapper:Any, exported:"ExportedClassifier", images:List[np.ndarray]) -> dict:
+    """
+    Compare the predictions of an export with those of the classifier wrapper's own `__call__`.
+
+    Args:
+        wrapper (Any): The original classifier, called once per image.
+        exported (ExportedClassifier): The export.
+        images (List[np.ndarray]): The images compared.
+
+    Returns:
+        dict: 'top1' (the fraction of images with the same top species),
+            'top3' (with the same set of top-3 species) and 'n_images'.
+    """
+    expected = [list(wrapper(img)['predictions'])[:3] for img in images]
+    got = [out['predictions'] for out in exported.predict_batch(images)]
+    return {'top1': float(np.mean([a[0] == b[0] for a, b in zip(expected, got)])),
+            'top3': float(np.mean([set(a) == set(b) for a, b in zip(expected, got)])),
+            'n_images': len(images)}
+
+
+def export_classifier(out_dir:str, model_id:str, revision:str, fmt:str = "onnx", quantize:bool = False,
+                      opset:int = 17, probe_images:List[np.ndarray] = None) -> dict:
+    """
+    Export the cetacean classifier to an ONNX or TorchScript artifact.
+
+    Args:
+        out_dir (str): The artifact directory (created if needed).
+        model_id (str): The model on the hub, e.g. 'Saving-Willy/cetacean-classifier'.
+        revision (str): The revision to export. Pin a commit for a reproducible
+            artifact; a branch is resolved, and its commit recorded.
+        fmt (str): 'onnx' or 'torchscript'. Default is 'onnx'.
+        quantize (bool): Quantize the weights to int8 (dynamic quantization). Default is False.
+        opset (int): The ONNX opset. Default is 17.
+        probe_images (List[np.ndarray], optional): The images on which the export
+            is compared with the wrapper (default: 8 smooth random images).
+
+    Returns:
+        dict: The manifest, as written to `out_dir/manifest.json`, with the keys
+            'model_id', 'revision', 'commit', 'format', 'quantized', 'file',
+            'sha256', 'bytes', 'species', 'preprocessing', 'export_max_abs_diff'
+            (between the logits of the exported and of the torch module, on a
+            probe image), 'wrapper_agreement' (with the predictions of the
+            wrapper's own `__call__` on the probe images, see `wrapper_agreement`),
+            'export_s' and 'created'.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt}, use one of {list(FORMATS)}")
+    import torch
+    import model_registry as sw_models
+
+    start_time = time.perf_counter()
+    wrapper = sw_models.load_transformers_classifier(model_id, revision)
+    pre = fit_preprocessing(wrapper.preprocess_image)
+    m_logger.info(f"fitted preprocessing: {pre}")
+
+    class _SpeciesLogits(torch.nn.Module):
+        '''the module, returning just the species logits'''
+        def __init__(self, module):
+            super().__init__()
+            self.module = module
+
+        def forward(self, pixel_values):
+            out = self.module(pixel_values)
+            return out[-1] if isinstance(out, (tuple, list)) else out
+
+    module = _SpeciesLogits(wrapper.model).eval()
+    rng = np.random.default_rng(0)
+    probe = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (0, 0), 3)
+    example = wrapper.preprocess_image(probe)
+    with torch.no_grad():
+        reference = module(example).numpy()
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, FORMATS[fmt])
+    if fmt == "onnx":
+        tmp_path = path + ".fp32" if quantize else path
+        torch.onnx.export(module, example, tmp_path, input_names=["pixel_values"], output_names=["logits"],
+                          dynamic_axes={'pixel_values': {0: "batch"}, 'logits': {0: "batch"}},
+                          opset_version=opset)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(tmp_path, path, weight_type=QuantType.QInt8)
+            os.remove(tmp_path)
+    else:
+        if quantize:
+            module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            traced = torch.jit.trace(module, example)
+        try:
+            traced = torch.jit.optimize_for_inference(traced)
+        except RuntimeError as e:
+            m_logger.warning(f"could not freeze/optimize the traced module, saving it as traced: {e}")
+        traced.save(path)
+
+    manifest = {
+        'model_id': model_id, 'revision': revision, 'commit': _resolve_revision(model_id, revision),
+        'format': fmt, 'quantized': quantize, 'file': FORMATS[fmt],
+        'sha256': _sha256(path), 'bytes': os.path.getsize(path),
+        'species': _species_list(wrapper.config), 'preprocessing': pre,
+    }
+    exported = ExportedClassifier(out_dir, manifest=manifest, verify=False)
+    manifest['export_max_abs_diff'] = float(np.abs(exported.logits_batch([probe]) - reference).max())
+    # the logits above come from our reading of the module's outputs; the
+    # predictions of the wrapper itself are the reference for what it returns
+    agreement = wrapper_agreement(wrapper, exported, probe_images or _probe_images())
+    manifest['wrapper_agreement'] = agreement
+    if agreement['top1'] < 1.0:
+        m_logger.warning(f"the export disagrees with the classifier on some probe images: {agreement}")
+    manifest['export_s'] = round(time.perf_counter() - start_time, 3)
+    manifest['created'] = datetime.datetime.now().isoformat(timespec="seconds")
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=1)
+    m_logger.info(f"exported {model_id}@{revision} as {fmt}{' (int8)' if quantize else ''} to {path} "
+                  f"({manifest['bytes'] / 2**20:.1f} MiB, max logit diff {manifest['export_max_abs_diff']:.2e}, "
+                  f"top-1 agreement with the classifier {agreement['top1']:.3f})")
+    return manifest
+
+
+class ExportedClassifier:
+    """
+    The cetacean classifier, run from an exported artifact
+
+    Args:
+        artifact_dir (str): The directory written by `export_classifier`.
+        n_threads (int, optional): The number of threads per model call (default: the runtime's own choice).
+        verify (bool): Check the model file against the manifest's checksum. Default is True.
+        manifest (dict, optional): The manifest, if already read.
+
+    Attributes:
+        manifest (dict): The manifest of the artifact.
+        species (List[str]): The species names, in the order of the logits.
+        model_bytes (int): The size of the model file (reported by the model registry).
+        resolved_commit (str): The commit the artifact was exported from (its revision, if unknown).
+
+    Methods:
+        logits_batch(images):
+            Returns the species logits of a list of images.
+        predict_batch(images, top_k):
+            Returns the top species of each image, as `{'predictions': [...]}`.
+    """
+    def __init__(self, artifact_dir:str, n_threads:int = None, verify:bool = True, manifest:dict = None):
+        self.manifest = manifest if manifest is not None else read_manifest(artifact_dir)
+        self.species = self.manifest['species']
+        self.resolved_commit = self.manifest.get('commit') or self.manifest['revision']
+        self._pre = self.manifest['preprocessing']
+        path = os.path.join(artifact_dir, self.manifest['file'])
+        if verify and _sha256(path) != self.manifest['sha256']:
+            raise ValueError(f"the checksum of {path} does not match its manifest")
+        self.model_bytes = os.path.getsize(path)
+        if self.manifest['format'] == "onnx":
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if n_threads:
+                options.intra_op_num_threads = n_threads
+            session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self._run = lambda batch: session.run(None, {'pixel_values': batch})[0]
+        else:
+            import torch
+            if n_threads:
+                torch.set_num_threads(n_threads)
+            module = torch.jit.load(path, map_location="cpu").eval()
+            def _run(batch):
+                with torch.inference_mode():
+                    return module(torch.from_numpy(batch)).numpy()
+            self._run = _run
+
+    def logits_batch(self, images:List[np.ndarray]) -> np.ndarray:
+        """
+        Compute the species logits of a list of images, in one model call.
+
+        Args:
+            images (List[np.ndarray]): The images (H x W x 3, uint8).
+
+        Returns:
+            np.ndarray: The logits (n_images x n_species).
+        """
+        batch = np.stack([preprocess(img, self._pre) for img in images])
+        return np.asarray(self._run(batch))
+
+    def predict_batch(self, images:List[np.ndarray], top_k:int = 3) -> List[dict]:
+        """
+        Classify a list of images, in one model call.
+
+        Args:
+            images (List[np.ndarray]): The images.
+            top_k (int): The number of species returned per image. Default is 3.
+
+        Returns:
+            List[dict]: One `{'predictions': [...]}` per image, the most likely species first.
+        """
+        ranked = np.argsort(-self.logits_batch(images), axis=1)[:, :top_k]
+        return [{'predictions': [self.species[i] for i in row]} for row in ranked]
+
+    def __call__(self, image:np.ndarray) -> dict:
+        return self.predict_batch([image])[0]
+
+
+def load_exported(artifact_dir:str, model_id:str, revision:str, fmt:str) -> ExportedClassifier:
+    """
+    Load an exported classifier, checking that it is the one asked for.
+
+    Args:
+        artifact_dir (str): The artifact directory.
+        model_id (str): The model id expected.
+        revision (str): The revision expected. A mismatch (e.g. 'main' was
+            exported at an older commit) is logged, not an error.
+        fmt (str): The format expected ('onnx' or 'torchscript').
+
+    Returns:
+        ExportedClassifier: The classifier.
+
+    Raises:
+        ValueError: If the artifact is for another model, or in another format.
+    """
+    if not artifact_dir:
+        raise ValueError(f"the {fmt} backend needs an exported artifact (set SW_CLASSIFIER_ARTIFACT)")
+    manifest = read_manifest(artifact_dir)
+    if manifest['model_id'] != model_id or manifest['format'] != fmt:
+        raise ValueError(f"{artifact_dir} holds {manifest['model_id']} as {manifest['format']}, "
+                         f"not {model_id} as {fmt}")
+    if revision not in (manifest['revision'], manifest.get('commit')):
+        m_logger.warning(f"{artifact_dir} was exported from {model_id}@{manifest['revision']} "
+                         f"(commit {manifest.get('commit')}), not @{revision}")
+    return ExportedClassifier(artifact_dir, manifest=manifest)
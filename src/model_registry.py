@@ -0,0 +1,415 @@
+from typing import Any, Callable, Dict, List, Tuple
+import logging
+import os
+import re
+import threading
+import time
+
+import model_store as sw_mstore
+import tracing as sw_trace
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# the two models used by the app. The cetacean classifier is our own wrapper
+# on the huggingface hub, the hotdog one is just for demo purposes.
+CETACEAN_MODEL_ID = "Saving-Willy/cetacean-classifier"
+HOTDOG_MODEL_ID = "julien-c/hotdog-not-hotdog"
+
+
+def classifier_backend() -> str:
+    """
+    Return how the cetacean classifier is run, from `SW_CLASSIFIER_BACKEND`.
+
+    Returns:
+        str: 'transformers' (the default: the remote-code wrapper from the hub),
+            or 'onnx' / 'torchscript' (an artifact written by
+            `model_export.export_classifier`, from the directory in
+            `SW_CLASSIFIER_ARTIFACT`).
+    """
+    return os.environ.get("SW_CLASSIFIER_BACKEND", "transformers")
+
+
+def prediction_model_id() -> str:
+    """
+    Return the model id under which cetacean predictions are cached.
+
+    The outputs of an exported (and maybe quantized) classifier can differ
+    slightly from the original's, so each artifact gets its own cache entries.
+
+    Returns:
+        str: The hub model id, with the artifact's format and checksum appended
+            when an exported backend is used.
+    """
+    backend = classifier_backend()
+    if backend == "transformers":
+        return CETACEAN_MODEL_ID
+    import model_export as sw_export
+    manifest = sw_export.read_manifest(os.environ.get("SW_CLASSIFIER_ARTIFACT", ""))
+    return f"{CETACEAN_MODEL_ID}#{backend}-{manifest['sha256'][:12]}"
+
+
+def load_transformers_classifier(model_id:str, revision:str) -> Any:
+    '''load the cetacean classifier (remote code wrapper) from the model store if one is set, or the hub'''
+    from transformers import AutoModelForImageClassification
+    store = sw_mstore.get_store()
+    if store is not None:
+        return store.load(model_id, revision, lambda path: AutoModelForImageClassification.from_pretrained(
+            path, trust_remote_code=True, local_files_only=True))
+    return AutoModelForImageClassification.from_pretrained(
+        model_id, revision=revision, trust_remote_code=True)
+
+
+def _load_cetacean_classifier(model_id:str, revision:str) -> Any:
+    '''load the cetacean classifier with the configured backend (see `classifier_backend`)'''
+    backend = classifier_backend()
+    if backend == "transformers":
+        return load_transformers_classifier(model_id, revision)
+    import model_export as sw_export
+    return sw_export.load_exported(os.environ.get("SW_CLASSIFIER_ARTIFACT", None), model_id, revision, backend)
+
+
+def _load_image_pipeline(model_id:str, revision:str) -> Any:
+    '''load a standard image-classification pipeline from the model store if one is set, or the hub'''
+    from transformers import pipeline
+    store = sw_mstore.get_store()
+    if store is not None:
+        return store.load(model_id, revision, lambda path: pipeline(
+            task="image-classification", model=path, model_kwargs={'local_files_only': True}))
+    return pipeline(task="image-classification", model=model_id, revision=revision)
+
+
+def resolved_commit(model:Any, model_id:str, revision:str) -> str:
+    """
+    Find the commit a loaded model was loaded from
+
+    A revision such as 'main' is a branch: the model behind it changes when
+    the branch moves, so anything keyed on the model (e.g. cached
+    predictions) must use the commit instead. In order of preference:
+
+    1. the model's own `resolved_commit` attribute, if its loader set one;
+    2. the commit the model store pinned the revision to (`ModelStore.resolve`);
+    3. the `_commit_hash` that transformers records in the loaded config;
+    4. the revision itself, if it already is a commit hash;
+    5. the commit the revision points to now on the hub (`model_info`).
+
+    Args:
+        model (Any): The loaded model (or pipeline).
+        model_id (str): The model id on the hub.
+        revision (str): The revision asked for.
+
+    Returns:
+        str: The commit hash, or the revision itself if none of the above
+            works out (logged).
+    """
+    commit = getattr(model, "resolved_commit", None)
+    if isinstance(commit, str) and commit:
+        return commit
+    store = sw_mstore.get_store()
+    if store is not None:
+        try:
+            return store.resolve(model_id, revision)
+        except FileNotFoundError: # not loaded from the store (e.g. a stand-in)
+            pass
+    for holder in (model, getattr(model, "model", None)):
+        commit = getattr(getattr(holder, "config", None), "_commit_hash", None)
+        if isinstance(commit, str) and commit:
+            return commit
+    if re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().model_info(model_id, revision=revision).sha
+    except Exception as e:
+        m_logger.warning(f"could not resolve {model_id}@{revision} to a commit, keying on the revision: {e}")
+        return revision
+
+
+def _estimate_model_bytes(model:Any) -> int:
+    """
+    Estimate the memory held by the weights of a model
+
+    Works for torch modules and for transformers pipelines (which hold the
+    module in `.model`), and for models that report their size in
+    `model_bytes` (the exported classifier). Other objects give 0.
+
+    Args:
+        model (Any): The loaded model or pipeline.
+
+    Returns:
+        int: The number of bytes held by parameters and buffers.
+    """
+    if hasattr(model, "model_bytes"):
+        return model.model_bytes
+    module = getattr(model, "model", model)
+    n_bytes = 0
+    for attr in ("parameters", "buffers"):
+        fn = getattr(module, attr, None)
+        if fn is None:
+            continue
+        try:
+            for t in fn():
+                n_bytes += t.numel() * t.element_size()
+        except Exception as e:
+            m_logger.debug(f"could not size model via .{attr}(): {e}")
+    return n_bytes
+
+
+class _RegistryEntry:
+    """
+    A loaded model together with the bookkeeping the registry keeps for it
+
+    Attributes:
+        model (Any): The loaded model, or None while it is not loaded yet.
+        load_time (float): Wall time in seconds spent loading the model.
+        n_bytes (int): Estimated memory held by the model weights.
+        commit (str): The commit the model was loaded from (see `resolved_commit`).
+        hits (int): Number of requests served by the already loaded model.
+        misses (int): Number of requests that needed a load.
+        lock (threading.Lock): Serialises loading, so concurrent sessions
+            asking for the same model only load it once.
+    """
+    def __init__(self):
+        self.model = None
+        self.load_time = 0.0
+        self.n_bytes = 0
+        self.commit = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    A process-wide registry of loaded models, keyed by model id and revision
+
+    Streamlit reruns the app script for every interaction, but imported
+    modules (and therefore this registry) live for the whole process. Each
+    model is loaded once, on first use or via `warmup`, and then shared by
+    all sessions.
+
+    Attributes:
+        loaders (dict): Maps a model kind (e.g. "cetacean") to the function
+            `fn(model_id, revision)` used to load models of that kind.
+
+    Methods:
+        register_loader(kind, fn):
+            Registers (or replaces) the load function for a kind of model.
+        get(kind, model_id, revision):
+            Returns the loaded model, loading it if needed.
+        commit(kind, model_id, revision):
+            Returns the commit the model was loaded from, loading it if needed.
+        warmup(specs):
+            Loads a list of (kind, model_id, revision) up front.
+        evict(kind, model_id, revision):
+            Drops a model so it is reloaded on next use.
+        stats():
+            Returns load time, memory footprint and hit/miss counts per model.
+    """
+    def __init__(self):
+        self.loaders: Dict[str, Callable[[str, str], Any]] = {
+            "cetacean": _load_cetacean_classifier,
+            "image-classification": _load_image_pipeline,
+        }
+        self._entries: Dict[Tuple[str, str, str], _RegistryEntry] = {}
+        self._lock = threading.Lock()
+
+    def register_loader(self, kind:str, fn:Callable[[str, str], Any]) -> None:
+        """
+        Register the function used to load models of a given kind.
+
+        Args:
+            kind (str): The kind of model, e.g. "cetacean".
+            fn (Callable): A function `fn(model_id, revision)` returning the loaded model.
+        """
+        self.loaders[kind] = fn
+
+    def _entry(self, key:Tuple[str, str, str]) -> _RegistryEntry:
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = _RegistryEntry()
+            return self._entries[key]
+
+    def get(self, kind:str, model_id:str, revision:str = "main") -> Any:
+        """
+        Return a loaded model, loading it on first use.
+
+        Args:
+            kind (str): The kind of model, selects the load function.
+            model_id (str): The model id on the huggingface hub.
+            revision (str): The model revision (branch, tag or commit hash). Default is "main".
+
+        Returns:
+            Any: The loaded model.
+
+        Raises:
+            KeyError: If no loader is registered for `kind`.
+        """
+        if kind not in self.loaders:
+            raise KeyError(f"No loader registered for model kind '{kind}'.")
+
+        entry = self._entry((kind, model_id, revision))
+        if entry.model is not None:
+            entry.hits += 1
+            return entry.model
+
+        with entry.lock:
+            # another session may have finished loading while we waited
+            if entry.model is not None:
+                entry.hits += 1
+                return entry.model
+
+            entry.misses += 1
+            m_logger.info(f"loading model {model_id}@{revision} ({kind})")
+            start_time = time.perf_counter()
+            with sw_trace.span("model_load", model=model_id):
+                model = self.loaders[kind](model_id, revision)
+            entry.load_time = time.perf_counter() - start_time
+            entry.n_bytes = _estimate_model_bytes(model)
+            entry.commit = resolved_commit(model, model_id, revision)
+            entry.model = model
+            m_logger.info(f"loaded model {model_id}@{revision} (commit {entry.commit}) in {entry.load_time:.2f}s "
+                          f"({entry.n_bytes / 2**20:.1f} MiB)")
+        return entry.model
+
+    def commit(self, kind:str, model_id:str, revision:str = "main") -> str:
+        """
+        Return the commit a model was loaded from, loading it on first use.
+
+        Key anything derived from the model (e.g. cached predictions) on this
+        rather than on the revision, which may be a branch.
+
+        Args:
+            kind (str): The kind of model.
+            model_id (str): The model id on the huggingface hub.
+            revision (str): The model revision. Default is "main".
+
+        Returns:
+            str: The commit (see `resolved_commit`).
+        """
+        self.get(kind, model_id, revision)
+        return self._entry((kind, model_id, revision)).commit
+
+    def warmup(self, specs:List[Tuple[str, str, str]]) -> None:
+        """
+        Load a list of models up front, e.g. at app startup.
+
+        Args:
+            specs (List[Tuple[str, str, str]]): (kind, model_id, revision) for each model to load.
+        """
+        for kind, model_id, revision in specs:
+            self.get(kind, model_id, revision)
+
+    def evict(self, kind:str, model_id:str, revision:str = "main") -> None:
+        """
+        Drop a loaded model, so it gets reloaded on next use.
+
+        Args:
+            kind (str): The kind of model.
+            model_id (str): The model id on the huggingface hub.
+            revision (str): The model revision. Default is "main".
+        """
+        with self._lock:
+            self._entries.pop((kind, model_id, revision), None)
+
+    def stats(self) -> List[dict]:
+        """
+        Report what the registry holds.
+
+        Returns:
+            list: A list of dictionaries, one per model, with the keys
+                'kind', 'model_id', 'revision', 'commit', 'loaded', 'load_time_s',
+                'mem_mib', 'hits' and 'misses'.
+        """
+        with self._lock:
+            items = list(self._entries.items())
+        return [{
+            'kind': kind,
+            'model_id': model_id,
+            'revision': revision,
+            'commit': entry.commit,
+            'loaded': entry.model is not None,
+            'load_time_s': round(entry.load_time, 3),
+            'mem_mib': round(entry.n_bytes / 2**20, 1),
+            'hits': entry.hits,
+            'misses': entry.misses,
+        } for (kind, model_id, revision), entry in items]
+
+
+# the registry shared by everything in this process
+registry = ModelRegistry()
+_warmed_up = False
+
+
+def get_cetacean_classifier(revision:str = "main") -> Any:
+    """
+    Return the (shared) cetacean classifier, loading it on first use.
+
+    Args:
+        revision (str): The model revision to use. Default is "main".
+
+    Returns:
+        Any: The cetacean classifier model.
+    """
+    return registry.get("cetacean", CETACEAN_MODEL_ID, revision)
+
+
+def get_cetacean_commit(revision:str = "main") -> str:
+    """
+    Return the commit the cetacean classifier was loaded from, to key its predictions on.
+
+    Args:
+        revision (str): The model revision asked for. Default is "main".
+
+    Returns:
+        str: The commit hash.
+    """
+    return registry.commit("cetacean", CETACEAN_MODEL_ID, revision)
+
+
+def get_hotdog_classifier(revision:str = "main") -> Any:
+    """
+    Return the (shared) hotdog image-classification pipeline, loading it on first use.
+
+    Args:
+        revision (str): The model revision to use. Default is "main".
+
+    Returns:
+        Any: The hotdog classification pipeline.
+    """
+    return registry.get("image-classification", HOTDOG_MODEL_ID, revision)
+
+
+def get_hotdog_commit(revision:str = "main") -> str:
+    """
+    Return the commit the hotdog pipeline was loaded from, to key its predictions on.
+
+    Args:
+        revision (str): The model revision asked for. Default is "main".
+
+    Returns:
+        str: The commit hash.
+    """
+    return registry.commit("image-classification", HOTDOG_MODEL_ID, revision)
+
+
+def warmup_from_env(classifier_revision:str = "main") -> None:
+    """
+    Load the app's models up front if `SW_WARMUP_MODELS` is set to 1.
+
+    Only the first call in a process does anything, so this is safe to call
+    on every rerun of the app script.
+
+    Args:
+        classifier_revision (str): The revision of the cetacean classifier to load. Default is "main".
+    """
+    global _warmed_up
+    if _warmed_up or os.environ.get("SW_WARMUP_MODELS", "0") != "1":
+        return
+    _warmed_up = True
+    registry.warmup([
+        ("cetacean", CETACEAN_MODEL_ID, classifier_revision),
+        ("image-classification", HOTDOG_MODEL_ID, "main"),
+    ])
@@ -0,0 +1,387 @@
+from typing import Any, Callable, Dict, List, Tuple
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+'''
+A local, content-addressed store of pinned model snapshots
+
+With `SW_MODEL_STORE` set to a directory, the models are not downloaded from
+the hub when the app first needs them: they are loaded from snapshots that
+were fetched into the store beforehand (`dev/prefetch_models.py fetch`, e.g.
+when building the image). A revision such as 'main' is pinned to the commit
+it pointed to when fetched, so every replica loads the same weights, without
+network access, in a predictable time.
+
+Layout of the store:
+
+    blobs/<sha256>                             the files, named by the sha256 of their content
+    manifests/<org>--<name>/<commit>.json      the files of a snapshot, with their sha256 and size
+    snapshots/<org>--<name>/<commit>/<file>    the snapshot as a directory (symlinks to the blobs)
+    refs/<org>--<name>/<revision>              the commit a revision was pinned to
+
+Files are checked against the hub's checksums when fetched (sha256 for LFS
+files, the git blob id for the others), and against the manifest when loaded
+(`SW_MODEL_STORE_VERIFY`: 'full' hashes every file, 'size' only compares the
+sizes, 'off' skips the check). Each load records the time spent resolving the
+revision, reading and verifying the files, and deserialising the model.
+'''
+
+VERIFY_MODES = ("full", "size", "off")
+
+
+def _repo_dir(model_id:str) -> str:
+    '''the directory name of a model, as in the huggingface cache'''
+    return model_id.replace("/", "--")
+
+
+def _hash_file(path:str) -> Tuple[str, str, int]:
+    '''the sha256 and git blob id (sha1) of a file, and its size'''
+    size = os.path.getsize(path)
+    sha256 = hashlib.sha256()
+    git_sha1 = hashlib.sha1(f"blob {size}\0".encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            sha256.update(chunk)
+            git_sha1.update(chunk)
+    return sha256.hexdigest(), git_sha1.hexdigest(), size
+
+
+def _write_atomic(path:str, text:str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class ModelStore:
+    """
+    A local store of model snapshots, fetched from the hub and loaded offline
+
+    Args:
+        root (str): The store directory.
+        verify (str): How files are checked when loaded: 'full', 'size' or 'off'. Default is 'full'.
+
+    Methods:
+        fetch(model_id, revision, allow_patterns):
+            Downloads a snapshot into the store, and pins the revision to its commit.
+        resolve(model_id, revision):
+            Returns the commit a revision is pinned to (no network access).
+        verify(model_id, revision, full):
+            Checks the files of a snapshot against its manifest.
+        load(model_id, revision, load_fn):
+            Loads a model from its snapshot directory, timing each phase.
+        snapshots():
+            Lists the snapshots in the store.
+        gc():
+            Deletes the blobs no snapshot refers to.
+        load_reports():
+            Returns the timings of the loads made in this process.
+    """
+    def __init__(self, root:str, verify:str = "full"):
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"unknown verify mode {verify}, use one of {VERIFY_MODES}")
+        self.root = root
+        self.verify_mode = verify
+        self._loads = []
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, model_id:str, commit:str) -> str:
+        return os.path.join(self.root, "manifests", _repo_dir(model_id), f"{commit}.json")
+
+    def _snapshot_dir(self, model_id:str, commit:str) -> str:
+        return os.path.join(self.root, "snapshots", _repo_dir(model_id), commit)
+
+    def _ref_path(self, model_id:str, revision:str) -> str:
+        return os.path.join(self.root, "refs", _repo_dir(model_id), revision.replace("/", "--"))
+
+    def _blob_path(self, sha256:str) -> str:
+        return os.path.join(self.root, "blobs", sha256)
+
+    def fetch(self, model_id:str, revision:str = "main", allow_patterns:List[str] = None,
+              token:str = None) -> dict:
+        """
+        Download a snapshot of a model into the store, checking every file.
+
+        Args:
+            model_id (str): The model on the hub.
+            revision (str): A branch, tag or commit. A branch or tag is pinned to
+                the commit it points to now. Default is 'main'.
+            allow_patterns (List[str], optional): Only fetch the files matching
+                one of these glob patterns (default: all files).
+            token (str, optional): The hub token (default: `HF_TOKEN`, or the login).
+
+        Returns:
+            dict: The manifest, with the keys 'model_id', 'revision', 'commit',
+                'fetched' and 'files' (path -> {'sha256', 'size'}).
+
+        Raises:
+            ValueError: If a downloaded file does not match the hub's checksum.
+        """
+        from huggingface_hub import HfApi, hf_hub_download
+
+        info = HfApi(token=token).model_info(model_id, revision=revision, files_metadata=True)
+        commit = info.sha
+        files = {}
+        os.makedirs(os.path.join(self.root, "blobs"), exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=self.root, prefix=".fetch-") as tmp_dir:
+            for sibling in info.siblings:
+                if allow_patterns and not any(fnmatch.fnmatch(sibling.rfilename, p) for p in allow_patterns):
+                    continue
+                path = hf_hub_download(model_id, sibling.rfilename, revision=commit, token=token,
+                                       local_dir=tmp_dir)
+                sha256, git_sha1, size = _hash_file(path)
+                expected = sibling.lfs.sha256 if sibling.lfs is not None else None
+                if expected is not None and sha256 != expected:
+                    raise ValueError(f"{model_id}/{sibling.rfilename}@{commit}: sha256 {sha256} is not {expected}")
+                if expected is None and sibling.blob_id is not None and git_sha1 != sibling.blob_id:
+                    raise ValueError(f"{model_id}/{sibling.rfilename}@{commit}: "
+                                     f"git blob id {git_sha1} is not {sibling.blob_id}")
+                blob_path = self._blob_path(sha256)
+                if not os.path.exists(blob_path):
+                    os.replace(path, blob_path)
+                files[sibling.rfilename] = {'sha256': sha256, 'size': size}
+                m_logger.info(f"fetched {model_id}/{sibling.rfilename}@{commit[:8]} ({size / 2**20:.1f} MiB)")
+
+        manifest = {'model_id': model_id, 'revision': revision, 'commit': commit,
+                    'fetched': time.strftime("%Y-%m-%dT%H:%M:%S"), 'files': files}
+        _write_atomic(self._manifest_path(model_id, commit), json.dumps(manifest, indent=1))
+        self._materialise(model_id, commit, files)
+        if revision != commit:
+            _write_atomic(self._ref_path(model_id, revision), commit)
+        m_logger.info(f"stored {model_id}@{revision} as commit {commit} ({len(files)} files)")
+        return manifest
+
+    def _materialise(self, model_id:str, commit:str, files:Dict[str, dict]) -> None:
+        '''lay out a snapshot as a directory of links to the blobs (copies where links are not possible)'''
+        snapshot_dir = self._snapshot_dir(model_id, commit)
+        for rel_path, meta in files.items():
+            path = os.path.join(snapshot_dir, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            blob_path = self._blob_path(meta['sha256'])
+            try:
+                os.symlink(os.path.relpath(blob_path, os.path.dirname(path)), path)
+            except OSError:
+                shutil.copyfile(blob_path, path)
+
+    def resolve(self, model_id:str, revision:str = "main") -> str:
+        """
+        Return the commit a revision is pinned to in the store (no network access).
+
+        Args:
+            model_id (str): The model.
+            revision (str): A branch, tag or commit. Default is 'main'.
+
+        Returns:
+            str: The commit.
+
+        Raises:
+            FileNotFoundError: If the store has no snapshot for the revision.
+        """
+        if os.path.exists(self._manifest_path(model_id, revision)):
+            return revision
+        try:
+            with open(self._ref_path(model_id, revision)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f"{model_id}@{revision} is not in the model store {self.root}; fetch it first with "
+                f"`python dev/prefetch_models.py fetch --model {model_id}@{revision}`") from None
+
+    def manifest(self, model_id:str, revision:str = "main") -> dict:
+        """
+        Return the manifest of a snapshot.
+
+        Args:
+            model_id (str): The model.
+            revision (str): A branch, tag or commit. Default is 'main'.
+
+        Returns:
+            dict: The manifest (see `fetch`).
+        """
+        with open(self._manifest_path(model_id, self.resolve(model_id, revision))) as f:
+            return json.load(f)
+
+    def verify(self, model_id:str, revision:str = "main", full:bool = True) -> List[str]:
+        """
+        Check the files of a snapshot against its manifest.
+
+        Args:
+            model_id (str): The model.
+            revision (str): A branch, tag or commit. Default is 'main'.
+            full (bool): Hash every file (otherwise only compare the sizes). Default is True.
+
+        Returns:
+            List[str]: The problems found (empty if the snapshot is intact).
+        """
+        manifest = self.manifest(model_id, revision)
+        snapshot_dir = self._snapshot_dir(model_id, manifest['commit'])
+        problems = []
+        for rel_path, meta in manifest['files'].items():
+            path = os.path.join(snapshot_dir, rel_path)
+            if not os.path.exists(path):
+                problems.append(f"{rel_path}: missing")
+            elif os.path.getsize(path) != meta['size']:
+                problems.append(f"{rel_path}: size {os.path.getsize(path)} is not {meta['size']}")
+            elif full and _hash_file(path)[0] != meta['sha256']:
+                problems.append(f"{rel_path}: sha256 does not match")
+        return problems
+
+    def load(self, model_id:str, revision:str, load_fn:Callable[[str], Any]) -> Any:
+        """
+        Load a model from its snapshot, timing each phase.
+
+        Args:
+            model_id (str): The model.
+            revision (str): A branch, tag or commit.
+            load_fn (Callable): Loads the model from a local directory, e.g.
+                `lambda path: AutoModel.from_pretrained(path, local_files_only=True)`.
+
+        Returns:
+            Any: The loaded model, with the commit it was loaded from in its
+                `resolved_commit` attribute (if the model takes attributes).
+
+        Raises:
+            FileNotFoundError: If the snapshot is not in the store.
+            ValueError: If the files do not match the manifest.
+        """
+        start_time = time.perf_counter()
+        manifest = self.manifest(model_id, revision)
+        t_resolved = time.perf_counter()
+        problems = self.verify(model_id, revision, full=self.verify_mode == "full") \
+            if self.verify_mode != "off" else []
+        if problems:
+            raise ValueError(f"{model_id}@{revision} in the model store is damaged: {problems}")
+        t_verified = time.perf_counter()
+        model = load_fn(self._snapshot_dir(model_id, manifest['commit']))
+        t_loaded = time.perf_counter()
+        try:
+            # so that what is keyed on the model (cached predictions, evaluation
+            # results) uses the pinned commit, not the revision ('main') asked for
+            model.resolved_commit = manifest['commit']
+        except AttributeError:
+            m_logger.debug(f"cannot record the commit on {type(model).__name__}")
+
+        report = {'model_id': model_id, 'revision': revision, 'commit': manifest['commit'],
+                  'files': len(manifest['files']),
+                  'mib': round(sum(m['size'] for m in manifest['files'].values()) / 2**20, 1),
+                  'resolve_s': round(t_resolved - start_time, 4),
+                  'read_verify_s': round(t_verified - t_resolved, 4), 'verify': self.verify_mode,
+                  'deserialise_s': round(t_loaded - t_verified, 4), 'total_s': round(t_loaded - start_time, 4)}
+        with self._lock:
+            self._loads.append(report)
+        m_logger.info(f"loaded {model_id}@{revision} from the store (commit {manifest['commit'][:8]}): "
+                      f"resolve {report['resolve_s']}s, read+verify ({self.verify_mode}) "
+                      f"{report['read_verify_s']}s, deserialise {report['deserialise_s']}s")
+        return model
+
+    def snapshots(self) -> List[dict]:
+        """
+        List the snapshots in the store.
+
+        Returns:
+            List[dict]: One dict per snapshot, with the keys 'model_id', 'commit',
+                'revisions' (pinned to it), 'files', 'mib' and 'fetched'.
+        """
+        rows = []
+        manifests_dir = os.path.join(self.root, "manifests")
+        for repo in sorted(os.listdir(manifests_dir)) if os.path.isdir(manifests_dir) else []:
+            refs_dir = os.path.join(self.root, "refs", repo)
+            refs = {}
+            for ref in os.listdir(refs_dir) if os.path.isdir(refs_dir) else []:
+                with open(os.path.join(refs_dir, ref)) as f:
+                    refs.setdefault(f.read().strip(), []).append(ref)
+            for fname in sorted(os.listdir(os.path.join(manifests_dir, repo))):
+                with open(os.path.join(manifests_dir, repo, fname)) as f:
+                    manifest = json.load(f)
+                rows.append({'model_id': manifest['model_id'], 'commit': manifest['commit'],
+                             'revisions': ", ".join(refs.get(manifest['commit'], [])),
+                             'files': len(manifest['files']),
+                             'mib': round(sum(m['size'] for m in manifest['files'].values()) / 2**20, 1),
+                             'fetched': manifest['fetched']})
+        return rows
+
+    def gc(self) -> int:
+        """
+        Delete the blobs that no snapshot refers to (e.g. after removing a manifest).
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        used = set()
+        for row in self.snapshots():
+            used.update(m['sha256'] for m in self.manifest(row['model_id'], row['commit'])['files'].values())
+        freed = 0
+        blobs_dir = os.path.join(self.root, "blobs")
+        for name in os.listdir(blobs_dir) if os.path.isdir(blobs_dir) else []:
+            if name not in used:
+                freed += os.path.getsize(os.path.join(blobs_dir, name))
+                os.remove(os.path.join(blobs_dir, name))
+        return freed
+
+    def load_reports(self) -> List[dict]:
+        """
+        Return the timings of the loads made from the store by this process.
+
+        Returns:
+            List[dict]: One dict per load, with the keys 'model_id', 'revision',
+                'commit', 'files', 'mib', 'resolve_s', 'read_verify_s', 'verify',
+                'deserialise_s' and 'total_s'.
+        """
+        with self._lock:
+            return list(self._loads)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ModelStore:
+    """
+    Return the process-wide model store, if one is configured.
+
+    The store is enabled by setting `SW_MODEL_STORE` to its directory; the
+    models are then only loaded from it. `SW_MODEL_STORE_VERIFY` sets how
+    files are checked on load ('full', 'size' or 'off', default 'full'). With
+    `SW_MODEL_STORE_OFFLINE=1`, the huggingface hub client is put in offline
+    mode for the whole process (only for deployments that need no hub at all:
+    the observation dataset and the uploads use the hub too).
+
+    Returns:
+        ModelStore: The store, or None if no store is configured.
+    """
+    global _store
+    root = os.environ.get("SW_MODEL_STORE", None)
+    if not root:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = ModelStore(root, verify=os.environ.get("SW_MODEL_STORE_VERIFY", "full"))
+            if os.environ.get("SW_MODEL_STORE_OFFLINE", "0") == "1":
+                _disable_hub()
+            m_logger.info(f"loading models from the model store {root}")
+        return _store
+
+
+def _disable_hub() -> None:
+    '''put the huggingface hub client (and transformers) in offline mode'''
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+    # the hub client reads the setting when imported: update it if it already is
+    if "huggingface_hub" in sys.modules:
+        sys.modules["huggingface_hub"].constants.HF_HUB_OFFLINE = True
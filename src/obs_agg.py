@@ -0,0 +1,174 @@
+from typing import Callable, Dict, Tuple
+import logging
+
+import numpy as np
+import pandas as pd
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# the grid for a given zoom level is the web-mercator tile grid this many
+# levels deeper, i.e. each 256px map tile is split into 4x4 cells of 64px.
+CELL_SUBDIV = 2
+# above this zoom level, individual observations are shown instead of aggregates
+AGG_MAX_ZOOM = 7
+# the most individual points sent to the browser for one viewport
+MAX_POINTS = 5000
+
+
+def mercator_cells(lat:np.ndarray, lon:np.ndarray, level:int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the web-mercator tile indices of points at a given level.
+
+    Args:
+        lat (np.ndarray): Latitudes in degrees.
+        lon (np.ndarray): Longitudes in degrees.
+        level (int): The tile level (0 is one tile for the whole world).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The x and y indices of the cell holding each point.
+    """
+    n = 2 ** level
+    lat_r = np.radians(np.clip(lat, -85.0511, 85.0511))
+    x = np.floor((lon + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.arcsinh(np.tan(lat_r)) / np.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def aggregate_level(df:pd.DataFrame, zoom:int) -> pd.DataFrame:
+    """
+    Bin observations into the grid for one zoom level, with per-species counts.
+
+    Args:
+        df (pd.DataFrame): Observations, with columns 'lat', 'lon' and 'species'.
+        zoom (int): The map zoom level.
+
+    Returns:
+        pd.DataFrame: One row per non-empty cell, with columns 'lat', 'lon'
+            (the centroid of the observations in the cell), 'count', 'species'
+            (the most frequent species) and 'n_species'.
+    """
+    cx, cy = mercator_cells(df['lat'].to_numpy(), df['lon'].to_numpy(), zoom + CELL_SUBDIV)
+    binned = pd.DataFrame({'cx': cx, 'cy': cy, 'lat': df['lat'].to_numpy(),
+                           'lon': df['lon'].to_numpy(), 'species': df['species'].to_numpy()})
+
+    cells = binned.groupby(['cx', 'cy'], observed=True).agg(lat=('lat', 'mean'), lon=('lon', 'mean'),
+                                            count=('lat', 'size'), n_species=('species', 'nunique'))
+    # the dominant species per cell: sort the (cell, species) counts, keep the first
+    per_species = binned.groupby(['cx', 'cy', 'species'], observed=True).size().rename('n').reset_index()
+    dominant = (per_species.sort_values('n', ascending=False, kind='stable')
+                .drop_duplicates(['cx', 'cy']).set_index(['cx', 'cy'])['species'])
+    cells['species'] = dominant.reindex(cells.index).to_numpy()
+    return cells.reset_index(drop=True)
+
+
+def build_zoom_pyramid(df:pd.DataFrame, max_zoom:int = AGG_MAX_ZOOM) -> Dict[int, pd.DataFrame]:
+    """
+    Pre-bin observations for every zoom level up to `max_zoom`.
+
+    Args:
+        df (pd.DataFrame): Observations, with columns 'lat', 'lon' and 'species'.
+        max_zoom (int): The highest zoom level that shows aggregates. Default is AGG_MAX_ZOOM.
+
+    Returns:
+        Dict[int, pd.DataFrame]: Maps each zoom level to its aggregated cells (see `aggregate_level`).
+    """
+    df = df.dropna(subset=['lat', 'lon'])
+    df = df.assign(species=df['species'].astype(object).fillna('unknown'))
+    pyramid = {z: aggregate_level(df, z) for z in range(max_zoom + 1)}
+    m_logger.info(f"aggregated {len(df)} observations into "
+                  f"{[len(cells) for cells in pyramid.values()]} cells per zoom level")
+    return pyramid
+
+
+def bounds_to_bbox(bounds:dict, pad:float = 0.0) -> Tuple[float, float, float, float]:
+    """
+    Convert map bounds returned by leaflet to a (south, west, north, east) box.
+
+    Args:
+        bounds (dict): As returned by streamlit_folium, e.g.
+            {'_southWest': {'lat': .., 'lng': ..}, '_northEast': {'lat': .., 'lng': ..}}.
+        pad (float): Grow the bounds by this fraction of their size on each
+            side, so that panning a little does not show empty edges. Default is 0.
+
+    Returns:
+        Tuple[float, float, float, float]: The box, with longitudes wrapped to
+            [-180, 180) (so west > east if it crosses the antimeridian), or
+            None if the bounds are missing.
+    """
+    try:
+        sw, ne = bounds['_southWest'], bounds['_northEast']
+        south, west, north, east = sw['lat'], sw['lng'], ne['lat'], ne['lng']
+    except (TypeError, KeyError):
+        return None
+    if None in (south, west, north, east):
+        return None
+
+    d_lat, d_lon = (north - south) * pad, (east - west) * pad
+    south, north, west, east = south - d_lat, north + d_lat, west - d_lon, east + d_lon
+    if east - west >= 360:
+        return (south, -180.0, north, 180.0)
+    # leaflet longitudes are not wrapped, so bring them to [-180, 180)
+    return (south, (west + 180) % 360 - 180, north, (east + 180) % 360 - 180)
+
+
+def in_bounds(df:pd.DataFrame, bounds:dict, pad:float = 0.0) -> pd.DataFrame:
+    """
+    Select the rows of `df` within the map bounds returned by leaflet.
+
+    Args:
+        df (pd.DataFrame): Rows with columns 'lat' and 'lon'.
+        bounds (dict): The map bounds (see `bounds_to_bbox`). If None (or
+            incomplete), all rows are returned.
+        pad (float): Grow the bounds by this fraction of their size. Default is 0.
+
+    Returns:
+        pd.DataFrame: The rows inside the bounds.
+    """
+    bbox = bounds_to_bbox(bounds, pad)
+    if bbox is None:
+        return df
+    south, west, north, east = bbox
+
+    lat, lon = df['lat'].to_numpy(), df['lon'].to_numpy()
+    mask = (lat >= south) & (lat <= north)
+    if west <= east:
+        mask &= (lon >= west) & (lon <= east)
+    else: # the view crosses the antimeridian
+        mask &= (lon >= west) | (lon <= east)
+    return df[mask]
+
+
+def select_for_view(df:pd.DataFrame, pyramid:Dict[int, pd.DataFrame], zoom:int,
+                    bounds:dict, max_points:int = MAX_POINTS,
+                    points_fn:Callable[[tuple], pd.DataFrame] = None) -> Tuple[str, pd.DataFrame]:
+    """
+    Choose what to send to the browser for the current viewport.
+
+    Args:
+        df (pd.DataFrame): All observations, with columns 'lat', 'lon' and 'species'.
+        pyramid (Dict[int, pd.DataFrame]): As from `build_zoom_pyramid`.
+        zoom (int): The current map zoom level.
+        bounds (dict): The current map bounds (see `in_bounds`).
+        max_points (int): Individual points above this number are subsampled. Default is MAX_POINTS.
+        points_fn (Callable, optional): Returns the observations inside a
+            (south, west, north, east) box (or all, for None), e.g. with the
+            filter pushed down to the parquet reader. Default is to select from `df`.
+
+    Returns:
+        Tuple[str, pd.DataFrame]: 'aggregate' and the cells in view, or
+            'points' and the observations in view.
+    """
+    zoom = int(zoom)
+    if zoom in pyramid:
+        return 'aggregate', in_bounds(pyramid[zoom], bounds, pad=0.5)
+
+    if points_fn is not None:
+        points = points_fn(bounds_to_bbox(bounds, pad=0.1))
+    else:
+        points = in_bounds(df, bounds, pad=0.1)
+    if len(points) > max_points:
+        points = points.sample(max_points, random_state=0)
+    return 'points', points
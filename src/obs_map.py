@@ -1,15 +1,22 @@
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
+import json
 import logging
 
+import numpy as np
 import pandas as pd
-from datasets import load_dataset
 import streamlit as st
-import folium
-from streamlit_folium import st_folium
 
+import obs_agg as sw_agg
+import obs_store as sw_store
+import tracing as sw_trace
 import whale_viewer as sw_wv
 from fix_tabrender import js_show_zeroheight_iframe
 
+# folium (and branca, jinja2, streamlit_folium) take longer to import than the
+# rest of the app: they are imported by the functions that draw a map
+if TYPE_CHECKING:
+    import folium
+
 m_logger = logging.getLogger(__name__)
 # we can set the log level locally for funcs in this module
 #g_m_logger.setLevel(logging.DEBUG)
@@ -62,7 +69,122 @@ _colors = [
 
 whale2color = {k: v for k, v in zip(sw_wv.WHALE_CLASSES, _colors)}
 
-def create_map(tile_name:str, location:Tuple[float], zoom_start: int = 7) -> folium.Map:
+# how observations are drawn: one folium.Marker per row, all rows in one
+# GeoJSON layer (rendered on a canvas in the browser, scales to ~1e5 points),
+# or aggregated per grid cell when zoomed out (payload independent of the
+# number of observations)
+RENDER_MODES = ['geojson', 'aggregate', 'markers']
+
+
+def obs_to_geojson(df:pd.DataFrame, int_props:Tuple[str] = ()) -> str:
+    """
+    Serialise observations to a GeoJSON FeatureCollection, without a per-row loop
+
+    The json text for each feature is assembled with vectorised string
+    operations on the dataframe columns. Only the (few) distinct species are
+    handled in python, to look up their colour and escape their names.
+
+    Args:
+        df (pd.DataFrame): Observations, with columns 'lat', 'lon' and 'species'.
+        int_props (Tuple[str]): Names of integer columns to add to the
+            feature properties (e.g. 'count' for aggregated cells). Default is none.
+
+    Returns:
+        str: The FeatureCollection, as a json string.
+    """
+    df = df.dropna(subset=['lat', 'lon'])
+    if len(df) == 0:
+        return '{"type":"FeatureCollection","features":[]}'
+
+    species = df['species']
+    if not isinstance(species.dtype, pd.CategoricalDtype):
+        species = species.astype('category')
+    if species.isna().any():
+        species = species.cat.add_categories(['unknown']).fillna('unknown')
+    # the species properties, without the closing brace so more can be appended
+    props = [json.dumps({'species': str(c), 'color': whale2color.get(c, 'red')})[:-1]
+             for c in species.cat.categories]
+    props_col = pd.Series(props, dtype=object).to_numpy()[species.cat.codes.to_numpy()]
+    for col in int_props:
+        props_col = props_col + f',"{col}":' + df[col].astype(np.int64).astype(str).to_numpy(dtype=object)
+    props_col = props_col + '}'
+
+    coords = df['lon'].round(6).astype(str) + ',' + df['lat'].round(6).astype(str)
+    features = ('{"type":"Feature","geometry":{"type":"Point","coordinates":[' + coords
+                + ']},"properties":' + props_col + '}')
+    return '{"type":"FeatureCollection","features":[' + ','.join(features) + ']}'
+
+
+def add_obs_geojson(map_:'folium.Map', df:pd.DataFrame) -> 'folium.Map':
+    """
+    Add all observations to the map as a single GeoJSON layer.
+
+    Args:
+        map_ (folium.Map): The map to add the layer to.
+        df (pd.DataFrame): Observations, with columns 'lat', 'lon' and 'species'.
+
+    Returns:
+        folium.Map: The same map, for chaining.
+    """
+    import map_layers as sw_layers
+    sw_layers.ObsGeoJsonLayer(obs_to_geojson(df)).add_to(map_)
+    return map_
+
+
+def add_obs_aggregates(map_:'folium.Map', cells:pd.DataFrame) -> 'folium.Map':
+    """
+    Add aggregated observations (one circle per grid cell) to the map.
+
+    Args:
+        map_ (folium.Map): The map (or feature group) to add the layer to.
+        cells (pd.DataFrame): Cells as from `obs_agg.aggregate_level`.
+
+    Returns:
+        folium.Map: The same map, for chaining.
+    """
+    import map_layers as sw_layers
+    sw_layers.ObsGeoJsonLayer(obs_to_geojson(cells, int_props=('count', 'n_species'))).add_to(map_)
+    return map_
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _zoom_pyramid(_df:pd.DataFrame, data_key:str) -> dict:
+    '''per-zoom aggregates, cached for the dataset identified by `data_key`'''
+    return sw_agg.build_zoom_pyramid(_df)
+
+
+def add_obs_markers(map_:'folium.Map', df:pd.DataFrame) -> 'folium.Map':
+    """
+    Add one folium.Marker per observation to the map (slow for large data).
+
+    Args:
+        map_ (folium.Map): The map to add the markers to.
+        df (pd.DataFrame): Observations, with columns 'lat', 'lon' and 'species'.
+
+    Returns:
+        folium.Map: The same map, for chaining.
+    """
+    import folium
+
+    # check the level once, so the loop does no string work unless debugging
+    # (depends on m_logger logging level, *not* the main st app's logger)
+    debug = m_logger.isEnabledFor(logging.DEBUG)
+    for _, row in df.iterrows():
+        c = whale2color.get(row['species'], 'red')
+        if debug:
+            m_logger.debug("[D] color for %s is %s", row['species'], c)
+
+        kw = {"prefix": "fa", "color": 'gray', "icon_color": c, "icon": "binoculars" }
+        folium.Marker(
+            location=[row['lat'], row['lon']],
+            popup=f"{row['species']} ",
+            tooltip=row['species'],
+            icon=folium.Icon(**kw)
+        ).add_to(map_)
+        #st.info(f"Added marker for {row['name']} {row['lat']} {row['lon']}")
+    return map_
+
+def create_map(tile_name:str, location:Tuple[float], zoom_start: int = 7) -> 'folium.Map':
     """
     Create a folium map with the specified tile layer
 
@@ -77,6 +199,8 @@ def create_map(tile_name:str, location:Tuple[float], zoom_start: int = 7) -> fol
     Returns:
         folium.Map: A folium Map object with the specified settings.
     """
+    import folium
+
     # https://xyzservices.readthedocs.io/en/stable/gallery.html 
     # get teh attribtuions from here once we pick the 2-3-4 options 
     # make esri ocean the default
@@ -117,7 +241,8 @@ def create_map(tile_name:str, location:Tuple[float], zoom_start: int = 7) -> fol
 
 def present_obs_map(dataset_id:str = "Saving-Willy/Happywhale-kaggle",
                     data_files:str = "data/train-00000-of-00001.parquet", 
-                    dbg_show_extra:bool = False) -> dict:
+                    dbg_show_extra:bool = False,
+                    render_mode:str = "geojson") -> dict:
     """
     Render map plus tile selector, with markers for whale observations
     
@@ -129,57 +254,88 @@ def present_obs_map(dataset_id:str = "Saving-Willy/Happywhale-kaggle",
     colors.
 
     Args:
-        dataset_id (str): The ID of the dataset to load from Hugging Face. Default is "Saving-Willy/Happywhale-kaggle".
+        dataset_id (str): The ID of the dataset to load from Hugging Face, or a local
+            parquet file or directory. Default is "Saving-Willy/Happywhale-kaggle".
         data_files (str): The path to the data file to load. Default is "data/train-00000-of-00001.parquet".
         dbg_show_extra (bool): If True, add a few extra sample markers for visualization. Default is False.
+        render_mode (str): 'geojson' draws all observations as one GeoJSON layer,
+            'aggregate' draws per-cell counts when zoomed out and the observations
+            in view when zoomed in, 'markers' adds a folium.Marker per observation.
+            Default is 'geojson'.
 
     Returns:
         dict: Selected data from the Folium/leaflet.js interactions in the browser.
 
     """
+    import folium
+    from streamlit_folium import st_folium
 
-    # load/download data from huggingface dataset
-    metadata = load_dataset(dataset_id, data_files=data_files)
-    
-    # make a pandas df that is compliant with folium/streamlit maps
-    _df = pd.DataFrame({
-        'lat': metadata["train"]["latitude"],
-        'lon': metadata["train"]["longitude"],
-        'species': metadata["train"]["predicted_class"],}
-    )
+    # filters, applied by the parquet reader (only matching rows are read)
+    filt_cols = st.columns(2)
+    species = filt_cols[0].multiselect("Species", sw_wv.WHALE_CLASSES, placeholder="All species")
+    date_range = None
+    if sw_store.DATE_COLUMN in sw_store.store.schema_names(dataset_id, data_files):
+        date_range = filt_cols[1].date_input("Date range", value=())
+        if len(date_range) != 2: # still selecting
+            date_range = None
+    filters = {'species': species or None, 'date_range': date_range}
+
+    # load/download data from huggingface dataset (or a local parquet file).
+    # The store only re-reads the (lat, lon, species) columns when the source
+    # file changes; the df is compliant with folium/streamlit maps.
+    with sw_trace.span("dataset_load"):
+        _df = sw_store.store.query(dataset_id, data_files, **filters)
+    data_key = f"{sw_store.store.version(dataset_id, data_files)}|{species}|{date_range}"
     if dbg_show_extra:
-        # add a few samples to visualise colours 
+        # add a few samples to visualise colours (on a copy, the df is shared)
+        _df = _df.astype({'species': object})
+        data_key = f"{data_key}-extra"
         _df.loc[len(_df)] = {'lat': 0, 'lon': 0, 'species': 'rough_toothed_dolphin'}
         _df.loc[len(_df)] = {'lat': -3, 'lon': 0, 'species': 'pygmy_killer_whale'}
         _df.loc[len(_df)] = {'lat': 45.7, 'lon': -2.6, 'species': 'humpback_whale'}
 
     ocean_loc = 0, 10
     selected_tile = st.selectbox("Choose a tile set", tile_sets, index=None, placeholder="Choose a tile set...", disabled=False)
-    map_ = create_map(selected_tile, ocean_loc, zoom_start=2)
-
-    folium.Marker(
-        location=ocean_loc,
-        popup="Atlantis",
-        tooltip="Atlantis",
-        icon=folium.Icon(color='blue', icon='info-sign')
-    ).add_to(map_)
-    
-    for _, row in _df.iterrows():
-        c = whale2color.get(row['species'], 'red')
-        msg = f"[D] color for {row['species']} is {c}"
-        m_logger.debug(msg) # depends on m_logger logging level (*not* the main st app's logger)
-        #m_logger.info(msg)
-        
-        kw = {"prefix": "fa", "color": 'gray', "icon_color": c, "icon": "binoculars" } 
+    with sw_trace.span("map_build"):
+        map_ = create_map(selected_tile, ocean_loc, zoom_start=2)
+
         folium.Marker(
-            location=[row['lat'], row['lon']],
-            popup=f"{row['species']} ",
-            tooltip=row['species'],
-            icon=folium.Icon(**kw)
+            location=ocean_loc,
+            popup="Atlantis",
+            tooltip="Atlantis",
+            icon=folium.Icon(color='blue', icon='info-sign')
         ).add_to(map_)
-        #st.info(f"Added marker for {row['name']} {row['lat']} {row['lon']}")
+    
+        if render_mode == 'aggregate':
+            # the map view (zoom, bounds) from the last interaction decides what
+            # is sent: per-cell aggregates when zoomed out, points in view otherwise.
+            # Only the feature group changes between reruns, the map is kept.
+            view = st.session_state.get("obs_map_view") or {}
+            zoom = view.get('zoom') or 2
+            def _points_in(bbox):
+                return sw_store.store.query(dataset_id, data_files, bbox=bbox, **filters)
+            kind, sel = sw_agg.select_for_view(_df, _zoom_pyramid(_df, data_key), zoom, view.get('bounds'),
+                                               points_fn=None if dbg_show_extra else _points_in)
+            fg = folium.FeatureGroup(name="observations")
+            if kind == 'aggregate':
+                add_obs_aggregates(fg, sel)
+            else:
+                add_obs_geojson(fg, sel)
+            st.caption(f"zoom {zoom}: showing {len(sel)} {'cells' if kind == 'aggregate' else 'observations'}")
+        else:
+            if render_mode == 'markers':
+                add_obs_markers(map_, _df)
+            else:
+                add_obs_geojson(map_, _df)
 
-    st_data = st_folium(map_, width=725)
+    with sw_trace.span("map_render"):
+        if render_mode == 'aggregate':
+            center = view.get('center')
+            st_data = st_folium(map_, width=725, key="obs_map_view", feature_group_to_add=fg,
+                                zoom=zoom, center=(center['lat'], center['lng']) if center else ocean_loc,
+                                returned_objects=['zoom', 'bounds', 'center'])
+        else:
+            st_data = st_folium(map_, width=725)
 
     # workaround for correctly showing js components in tabs
     js_show_zeroheight_iframe(
@@ -0,0 +1,312 @@
+from typing import Dict, Sequence, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future
+import datetime
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# the columns the map needs, and the names used in the map dataframes
+MAP_COLUMNS = {'latitude': 'lat', 'longitude': 'lon', 'predicted_class': 'species'}
+# observations record the date as an iso string ('YYYY-MM-DD'), so a range
+# filter on it is a plain string comparison
+DATE_COLUMN = 'date_option'
+
+
+class _Source:
+    '''a resolved source file, its version, and when that was last checked'''
+    def __init__(self, path:str, version:str, t_checked:float):
+        self.path = path
+        self.version = version
+        self.t_checked = t_checked
+        self.dataset = pads.dataset(path, format=pads.ParquetFileFormat(
+            read_options={'dictionary_columns': ['predicted_class']}))
+
+
+def _and(a:pads.Expression, b:pads.Expression) -> pads.Expression:
+    return b if a is None else a & b
+
+
+def bbox_filter(bbox:Tuple[float, float, float, float]) -> pads.Expression:
+    """
+    Build a filter expression for observations inside a bounding box.
+
+    Args:
+        bbox (Tuple[float, float, float, float]): (south, west, north, east) in
+            degrees. If west > east, the box crosses the antimeridian.
+
+    Returns:
+        pads.Expression: The filter, on the 'latitude' and 'longitude' columns.
+    """
+    south, west, north, east = bbox
+    lat, lon = pads.field('latitude'), pads.field('longitude')
+    expr = (lat >= south) & (lat <= north)
+    if west <= east:
+        return expr & (lon >= west) & (lon <= east)
+    return expr & ((lon >= west) | (lon <= east))
+
+
+class ObservationStore:
+    """
+    A process-wide cache of the observation dataset, reloaded only when the source changes
+
+    The source is either a parquet file in a dataset repo on the huggingface
+    hub, or (as a stand-in for the hub) a local parquet file or directory.
+    Its version is the file's etag on the hub, or the mtime and size of a
+    local file. The version is checked at most once per `check_interval_s`;
+    in between, and when the hub cannot be reached, the cached data is used.
+    The check (and a download) runs in the thread of one query, outside the
+    store's lock: queries in other sessions use the cached data meanwhile.
+
+    Reads go through `pyarrow.dataset`: only the requested columns are read,
+    and filters (species, date range, bounding box) are pushed down to the
+    parquet reader, which skips row groups whose statistics rule them out.
+    Results are kept in a small LRU, keyed on the source version, columns
+    and filters.
+
+    Attributes:
+        check_interval_s (float): Minimum time between two checks of the source version.
+        max_results (int): The number of query results kept in memory.
+
+    Methods:
+        query(dataset_id, data_files, columns, species, date_range, bbox):
+            Returns the matching observations as a dataframe (shared, do not modify).
+        load(dataset_id, data_files, columns):
+            Returns all observations (`query` without filters).
+        version(dataset_id, data_files):
+            Returns the version of the source that was last read.
+        schema_names(dataset_id, data_files):
+            Returns the column names available in the source.
+        stats():
+            Returns the number of reads, cache hits and version checks.
+    """
+    def __init__(self, check_interval_s:float = 60.0, max_results:int = 16):
+        self.check_interval_s = check_interval_s
+        self.max_results = max_results
+        self._sources: Dict[Tuple[str, str], _Source] = {}
+        self._results = OrderedDict()
+        self._checking: Dict[Tuple[str, str], Future] = {} # sources being checked -> their result
+        self._lock = threading.Lock()
+        self._n = {'reads': 0, 'hits': 0, 'checks': 0, 'check_errors': 0}
+
+    @staticmethod
+    def _local_path(dataset_id:str, data_files:str) -> str:
+        '''the local file for the source, or None if it is a hub dataset'''
+        if os.path.isfile(dataset_id):
+            return dataset_id
+        if os.path.isdir(dataset_id):
+            return os.path.join(dataset_id, data_files)
+        return None
+
+    def _remote_version(self, dataset_id:str, data_files:str) -> Tuple[str, str]:
+        '''the etag and commit of the file on the hub (one HEAD request)'''
+        from huggingface_hub import get_hf_file_metadata, hf_hub_url
+        meta = get_hf_file_metadata(hf_hub_url(dataset_id, data_files, repo_type="dataset"))
+        return meta.etag, meta.commit_hash
+
+    def _check(self, dataset_id:str, data_files:str, source:_Source) -> _Source:
+        '''check the version of the source, and download it if it changed (no lock held)'''
+        now = time.time()
+        local_path = self._local_path(dataset_id, data_files)
+        commit = None
+        try:
+            if local_path is not None:
+                fstat = os.stat(local_path)
+                version = f"{fstat.st_mtime_ns}-{fstat.st_size}"
+            else:
+                version, commit = self._remote_version(dataset_id, data_files)
+        except Exception as e:
+            with self._lock:
+                self._n['check_errors'] += 1
+            if source is None:
+                raise
+            m_logger.warning(f"could not check version of {dataset_id}/{data_files}, using cached data: {e}")
+            source.t_checked = now
+            return source
+
+        if source is not None and source.version == version:
+            source.t_checked = now
+            return source
+
+        if local_path is None:
+            from huggingface_hub import hf_hub_download
+            local_path = hf_hub_download(dataset_id, data_files, repo_type="dataset", revision=commit)
+        m_logger.info(f"observations source {dataset_id}/{data_files} is at version {version}")
+        return _Source(local_path, version, now)
+
+    def _resolve(self, dataset_id:str, data_files:str) -> _Source:
+        '''
+        the current source file, checking its version if due
+
+        one thread checks (and downloads) a source at a time, without holding
+        the store lock; meanwhile the other threads use the cached source, or
+        wait for the first load if there is none yet.
+        '''
+        src_key = (dataset_id, data_files)
+        with self._lock:
+            source = self._sources.get(src_key)
+            if source is not None and time.time() - source.t_checked < self.check_interval_s:
+                return source
+            pending = self._checking.get(src_key)
+            if pending is not None and source is not None:
+                return source # being checked by another thread, serve the cached data meanwhile
+            if pending is None:
+                pending = self._checking[src_key] = Future()
+                self._n['checks'] += 1
+                checker = True
+            else:
+                checker = False
+        if not checker:
+            return pending.result()
+
+        try:
+            new_source = self._check(dataset_id, data_files, source)
+        except Exception as e:
+            with self._lock:
+                del self._checking[src_key]
+            pending.set_exception(e)
+            raise
+        with self._lock:
+            self._sources[src_key] = new_source
+            del self._checking[src_key]
+        pending.set_result(new_source)
+        return new_source
+
+    def query(self, dataset_id:str, data_files:str,
+              columns:Sequence[str] = tuple(MAP_COLUMNS),
+              species:Sequence[str] = None,
+              date_range:Tuple[datetime.date, datetime.date] = None,
+              bbox:Tuple[float, float, float, float] = None,
+              date_column:str = DATE_COLUMN) -> pd.DataFrame:
+        """
+        Return the observations matching the filters, reading only what is needed.
+
+        Args:
+            dataset_id (str): The dataset id on the huggingface hub, or a local
+                parquet file or directory.
+            data_files (str): The parquet file within the dataset (or directory).
+            columns (Sequence[str]): The columns to read. Default is the latitude,
+                longitude and predicted class; columns are renamed as in MAP_COLUMNS.
+            species (Sequence[str], optional): Keep only these predicted classes.
+            date_range (Tuple[datetime.date, datetime.date], optional): Keep only
+                observations between these dates (inclusive).
+            bbox (Tuple[float, float, float, float], optional): Keep only
+                observations inside (south, west, north, east).
+            date_column (str): The column holding the iso date. Default is DATE_COLUMN.
+
+        Returns:
+            pd.DataFrame: The observations. This object is shared between
+                sessions, so copy it before modifying it.
+        """
+        source = self._resolve(dataset_id, data_files)
+        with self._lock:
+            key = (source.path, source.version, tuple(columns),
+                   tuple(sorted(species)) if species is not None else None,
+                   tuple(map(str, date_range)) if date_range else None,
+                   tuple(bbox) if bbox is not None else None)
+            if key in self._results:
+                self._results.move_to_end(key)
+                self._n['hits'] += 1
+                return self._results[key]
+
+        filt = None
+        if species is not None:
+            filt = _and(filt, pads.field('predicted_class').isin(list(species)))
+        if bbox is not None:
+            filt = _and(filt, bbox_filter(bbox))
+        if date_range:
+            if date_column in source.dataset.schema.names:
+                start, end = (str(d) for d in date_range)
+                date = pads.field(date_column)
+                filt = _and(filt, (date >= start) & (date <= end))
+            else:
+                m_logger.warning(f"no '{date_column}' column in {dataset_id}/{data_files}, date filter ignored")
+
+        start_time = time.perf_counter()
+        table = source.dataset.to_table(columns=list(columns), filter=filt)
+        df = _table_to_df(table)
+        m_logger.info(f"read {len(df)} observations ({', '.join(columns)}) from {dataset_id}/{data_files} "
+                      f"in {time.perf_counter() - start_time:.3f}s")
+
+        with self._lock:
+            self._n['reads'] += 1
+            self._results[key] = df
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return df
+
+    def load(self, dataset_id:str, data_files:str,
+             columns:Sequence[str] = tuple(MAP_COLUMNS)) -> pd.DataFrame:
+        """
+        Return all observations (see `query`).
+
+        Args:
+            dataset_id (str): As for `query`.
+            data_files (str): As for `query`.
+            columns (Sequence[str]): As for `query`.
+
+        Returns:
+            pd.DataFrame: The observations (shared, do not modify).
+        """
+        return self.query(dataset_id, data_files, columns)
+
+    def version(self, dataset_id:str, data_files:str) -> str:
+        """
+        Return the version of the source that was last read, or None.
+
+        Args:
+            dataset_id (str): As for `query`.
+            data_files (str): As for `query`.
+
+        Returns:
+            str: The etag (hub) or mtime-size (local file) of the source.
+        """
+        source = self._sources.get((dataset_id, data_files))
+        return source.version if source is not None else None
+
+    def schema_names(self, dataset_id:str, data_files:str) -> list:
+        """
+        Return the names of the columns in the source.
+
+        Args:
+            dataset_id (str): As for `query`.
+            data_files (str): As for `query`.
+
+        Returns:
+            list: The column names.
+        """
+        return self._resolve(dataset_id, data_files).dataset.schema.names
+
+    def stats(self) -> dict:
+        """
+        Report how often data was read, served from cache, and checked.
+
+        Returns:
+            dict: With the keys 'reads', 'hits', 'checks', 'check_errors',
+                'sources' and 'cached_results'.
+        """
+        with self._lock:
+            return {**self._n, 'sources': len(self._sources), 'cached_results': len(self._results)}
+
+
+def _table_to_df(table:pa.Table) -> pd.DataFrame:
+    '''arrow table to a map dataframe, sharing memory with arrow where possible'''
+    # one block per column, so pandas does not consolidate (copy) the float
+    # columns again after arrow has assembled them; dictionary-encoded
+    # strings become categoricals
+    df = table.to_pandas(split_blocks=True)
+    return df.rename(columns=MAP_COLUMNS, copy=False)
+
+
+# the store shared by all sessions in this process
+store = ObservationStore(check_interval_s=float(os.environ.get("SW_OBS_CHECK_INTERVAL_S", 60)))
@@ -0,0 +1,182 @@
+from typing import Any, Callable, Tuple
+from collections import OrderedDict
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import tracing as sw_trace
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+
+class PredictionCache:
+    """
+    A content-addressed cache of model predictions
+
+    Predictions are keyed on the md5 of the image bytes plus the model id and
+    revision, so the same photo submitted again (by any session) is not
+    re-classified. The revision should be a commit (see
+    `model_registry.resolved_commit`), not a branch such as 'main': the disk
+    tier outlives the model a branch pointed to. There are two tiers:
+
+    - an in-memory LRU, bounded by `max_entries`;
+    - optionally, an SQLite database on disk that survives restarts.
+
+    Values must be json-serialisable (both classifiers return lists/dicts of
+    strings and floats).
+
+    Attributes:
+        max_entries (int): The maximum number of predictions kept in memory.
+        db_path (str): Path to the SQLite database, or None for memory only.
+
+    Methods:
+        get(image_md5, model_id, revision):
+            Returns the cached prediction, or None.
+        put(image_md5, model_id, revision, value):
+            Stores a prediction in both tiers.
+        get_or_compute(image_md5, model_id, revision, fn):
+            Returns the cached prediction, or computes, stores and returns `fn()`.
+        stats():
+            Returns hit/miss counts and hit rates for each tier.
+    """
+    def __init__(self, max_entries:int = 1024, db_path:str = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self._n = {'mem_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self._db = None
+        if db_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            # shared between the threads that serve streamlit sessions
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions ("
+                             "image_md5 TEXT, model_id TEXT, revision TEXT, value TEXT, "
+                             "PRIMARY KEY (image_md5, model_id, revision))")
+            self._db.commit()
+
+    def get(self, image_md5:str, model_id:str, revision:str) -> Any:
+        """
+        Look up a prediction, first in memory then on disk.
+
+        Args:
+            image_md5 (str): The md5 hex digest of the image bytes.
+            model_id (str): The model id.
+            revision (str): The model revision.
+
+        Returns:
+            Any: The cached prediction, or None if not present.
+        """
+        key = (image_md5, model_id, revision)
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                self._n['mem_hits'] += 1
+                return json.loads(self._mem[key])
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM predictions WHERE image_md5=? AND model_id=? AND revision=?",
+                    key).fetchone()
+                if row is not None:
+                    self._n['disk_hits'] += 1
+                    self._remember(key, row[0])
+                    return json.loads(row[0])
+
+            self._n['misses'] += 1
+        return None
+
+    def _remember(self, key:Tuple[str, str, str], value_json:str) -> None:
+        '''add to the in-memory LRU tier (caller holds the lock)'''
+        self._mem[key] = value_json
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def put(self, image_md5:str, model_id:str, revision:str, value:Any) -> None:
+        """
+        Store a prediction in memory and, if configured, on disk.
+
+        Args:
+            image_md5 (str): The md5 hex digest of the image bytes.
+            model_id (str): The model id.
+            revision (str): The model revision.
+            value (Any): The prediction (json-serialisable).
+        """
+        key = (image_md5, model_id, revision)
+        value_json = json.dumps(value)
+        with self._lock:
+            self._remember(key, value_json)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                                 key + (value_json,))
+                self._db.commit()
+
+    def get_or_compute(self, image_md5:str, model_id:str, revision:str,
+                       fn:Callable[[], Any]) -> Any:
+        """
+        Return the cached prediction, or compute and cache it.
+
+        Args:
+            image_md5 (str): The md5 hex digest of the image bytes. If None,
+                the cache is bypassed.
+            model_id (str): The model id.
+            revision (str): The model revision.
+            fn (Callable): Computes the prediction on a miss.
+
+        Returns:
+            Any: The prediction.
+        """
+        if image_md5 is None:
+            with sw_trace.span("inference", model=model_id):
+                return fn()
+        value = self.get(image_md5, model_id, revision)
+        if value is None:
+            with sw_trace.span("inference", model=model_id):
+                value = fn()
+            self.put(image_md5, model_id, revision, value)
+        return value
+
+    def stats(self) -> dict:
+        """
+        Report the cache size and hit rates.
+
+        Returns:
+            dict: With the keys 'entries_mem', 'mem_hits', 'disk_hits',
+                'misses' and 'hit_rate' (over both tiers).
+        """
+        with self._lock:
+            n = dict(self._n)
+            n['entries_mem'] = len(self._mem)
+        total = n['mem_hits'] + n['disk_hits'] + n['misses']
+        n['hit_rate'] = round((n['mem_hits'] + n['disk_hits']) / total, 3) if total else None
+        return n
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> PredictionCache:
+    """
+    Return the process-wide prediction cache, creating it on first use.
+
+    The in-memory size is set by `SW_PREDICTION_CACHE_SIZE` (default 1024
+    entries); the on-disk tier is enabled by pointing
+    `SW_PREDICTION_CACHE_DB` to an SQLite file.
+
+    Returns:
+        PredictionCache: The cache shared by all sessions.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache(
+                max_entries=int(os.environ.get("SW_PREDICTION_CACHE_SIZE", 1024)),
+                db_path=os.environ.get("SW_PREDICTION_CACHE_DB", None))
+        return _cache
@@ -0,0 +1,280 @@
+from typing import Dict, Tuple
+from pathlib import Path
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+
+import whale_viewer as sw_wv
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# the reference images, found relative to this module (not the working directory)
+REF_IMAGE_DIR = Path(__file__).resolve().parent / "images" / "references"
+# with `server.enableStaticServing`, streamlit serves the `static` directory
+# next to the main script at `app/static/`; thumbnails are exported there
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+STATIC_URL = "app/static"
+# the thumbnails made at build time (`dev/build_ref_assets.py`) are in
+# STATIC_DIR/ref, listed in this file with the hash of their source image
+PREBUILT_INDEX = "index.json"
+
+# the sizes the reference images are shown at: name -> max width in pixels.
+# the gallery shows them 150px wide; thumbnails are made at 2x for hi-dpi screens
+SIZES = {'gallery': 300, 'viewer': 800}
+THUMB_FORMAT, THUMB_MIMETYPE, THUMB_EXT = "WEBP", "image/webp", "webp"
+
+
+class RefAsset:
+    """
+    A resized reference image, encoded and ready to send to the browser
+
+    Attributes:
+        data (bytes): The encoded image.
+        mimetype (str): The mimetype of `data`.
+        content_hash (str): A short hash of `data`, for cache-busting file names.
+        width (int): The width in pixels.
+        height (int): The height in pixels.
+    """
+    def __init__(self, data:bytes, mimetype:str, width:int, height:int):
+        self.data = data
+        self.mimetype = mimetype
+        self.content_hash = hashlib.sha1(data).hexdigest()[:12]
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return f"RefAsset({self.content_hash}, {self.width}x{self.height}, {len(self.data)} bytes)"
+
+
+def make_thumbnail(path:Path, max_width:int) -> RefAsset:
+    """
+    Resize an image to at most `max_width` pixels wide, and encode it.
+
+    Args:
+        path (Path): The source image.
+        max_width (int): The maximum width; smaller images are not enlarged.
+
+    Returns:
+        RefAsset: The encoded thumbnail.
+    """
+    from PIL import Image # only when a thumbnail is made, not with the app
+
+    with Image.open(path) as img:
+        img.load()
+        if img.width > max_width:
+            img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, THUMB_FORMAT, quality=85, method=2)
+    return RefAsset(buf.getvalue(), THUMB_MIMETYPE, img.width, img.height)
+
+
+def _file_sha1(path:Path) -> str:
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+
+class RefAssetCache:
+    """
+    Sized versions of the whale reference images, built once and kept in memory
+
+    The thumbnails are made at build time by `export_static` (run by
+    `dev/build_ref_assets.py`), into the static directory. At run time, a
+    thumbnail found there (and made from the current source image) is read
+    as is; a missing or stale one is made when first needed.
+
+    Attributes:
+        image_dir (Path): Where the original reference images are.
+        sizes (Dict[str, int]): The named sizes (max width in pixels).
+        static_dir (Path): The directory streamlit serves, holding the prebuilt thumbnails in `ref/`.
+
+    Methods:
+        get(whale_class, size):
+            Returns the RefAsset for a species at a named size.
+        build():
+            Makes the thumbnails of all species at all sizes (up front, instead of on first use).
+        export_static():
+            Writes the thumbnails of all species at all sizes to the static directory (the build step).
+        static_urls(size):
+            Exports the thumbnails for static serving, returns their urls.
+        stats():
+            Returns the number of assets, their total size and the build time.
+    """
+    def __init__(self, image_dir:Path = REF_IMAGE_DIR, sizes:Dict[str, int] = None,
+                 static_dir:Path = STATIC_DIR):
+        self.image_dir = Path(image_dir)
+        self.sizes = dict(sizes or SIZES)
+        self.static_dir = Path(static_dir)
+        self._assets: Dict[Tuple[str, str], RefAsset] = {}
+        self._lock = threading.Lock()
+        self._build_s = 0.0 # spent making thumbnails
+        self._n_prebuilt = 0 # read from the static directory instead
+        self._built = False
+        self._index = None # the prebuilt thumbnails: "species/size" -> file, size and source hash
+        self._source_sha1: Dict[str, str] = {}
+        self._urls: Dict[str, Dict[str, str]] = {}
+
+    def _source(self, whale_class:str) -> Path:
+        return self.image_dir / sw_wv.df_whale_img_ref.loc[whale_class, "WHALE_IMAGES"]
+
+    def _prebuilt(self, whale_class:str, size:str) -> dict:
+        '''the index entry of a prebuilt thumbnail, if there is one and it is up to date'''
+        if self._index is None:
+            try:
+                with open(self.static_dir / "ref" / PREBUILT_INDEX) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {} # not built: thumbnails are made on first use
+        entry = self._index.get(f"{whale_class}/{size}")
+        if entry is None or entry.get('max_width') != self.sizes[size]:
+            return None
+        if whale_class not in self._source_sha1:
+            try:
+                self._source_sha1[whale_class] = _file_sha1(self._source(whale_class))
+            except OSError:
+                return None
+        if entry.get('source_sha1') != self._source_sha1[whale_class] \
+                or not (self.static_dir / "ref" / entry['file']).exists():
+            return None
+        return entry
+
+    def get(self, whale_class:str, size:str = 'gallery') -> RefAsset:
+        """
+        Return the reference image of a species at a named size (built on first use).
+
+        Args:
+            whale_class (str): The species, one of `whale_viewer.WHALE_CLASSES`.
+            size (str): One of the names in `sizes`. Default is 'gallery'.
+
+        Returns:
+            RefAsset: The encoded image.
+        """
+        key = (whale_class, size)
+        asset = self._assets.get(key)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.get(key)
+                if asset is None:
+                    entry = self._prebuilt(whale_class, size)
+                    if entry is not None:
+                        data = (self.static_dir / "ref" / entry['file']).read_bytes()
+                        asset = RefAsset(data, THUMB_MIMETYPE, entry['width'], entry['height'])
+                        self._n_prebuilt += 1
+                    else:
+                        start_time = time.perf_counter()
+                        asset = make_thumbnail(self._source(whale_class), self.sizes[size])
+                        self._build_s += time.perf_counter() - start_time
+                    self._assets[key] = asset
+        return asset
+
+    def build(self) -> None:
+        """
+        Make the thumbnails of all species, at all sizes (once; later calls return at once).
+
+        Not needed for the app: `get` makes each thumbnail when first shown.
+        """
+        if self._built:
+            return
+        for whale_class in sw_wv.df_whale_img_ref.index:
+            for size in self.sizes:
+                self.get(whale_class, size)
+        self._built = True
+        m_logger.info(f"built {len(self._assets)} reference thumbnails in {self._build_s:.2f}s")
+
+    def _write(self, whale_class:str, size:str) -> str:
+        '''write a thumbnail to the static directory (if not already there), returns its file name'''
+        asset = self.get(whale_class, size)
+        fname = f"{whale_class}-{size}-{asset.content_hash}.{THUMB_EXT}"
+        path = self.static_dir / "ref" / fname
+        if not path.exists():
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(asset.data)
+            tmp_path.replace(path)
+        return fname
+
+    def export_static(self) -> int:
+        """
+        Write the thumbnails of all species at all sizes to the static directory, with their index.
+
+        This is the build step (`dev/build_ref_assets.py`): the app then
+        reads the thumbnails from there instead of making them. Thumbnails
+        already written from the same source image are kept.
+
+        Returns:
+            int: The number of thumbnails in the index.
+        """
+        out_dir = self.static_dir / "ref"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        index = {}
+        for whale_class in sw_wv.df_whale_img_ref.index:
+            source_sha1 = _file_sha1(self._source(whale_class))
+            for size, max_width in self.sizes.items():
+                fname = self._write(whale_class, size)
+                asset = self.get(whale_class, size)
+                index[f"{whale_class}/{size}"] = {'file': fname, 'width': asset.width, 'height': asset.height,
+                                                 'max_width': max_width, 'source_sha1': source_sha1}
+        tmp_path = out_dir / f"{PREBUILT_INDEX}.tmp"
+        tmp_path.write_text(json.dumps(index, indent=1))
+        tmp_path.replace(out_dir / PREBUILT_INDEX)
+        with self._lock:
+            self._index = index
+        m_logger.info(f"exported {len(index)} reference thumbnails to {out_dir}")
+        return len(index)
+
+    def static_urls(self, size:str = 'gallery') -> Dict[str, str]:
+        """
+        Return the urls of the thumbnails of one size in the static directory, writing any missing.
+
+        The file names include the content hash, so the browser can cache
+        them for good: a changed image gets a new url. Thumbnails made at
+        build time are used as they are (not even read); others are made
+        and written once per process.
+
+        Args:
+            size (str): One of the names in `sizes`. Default is 'gallery'.
+
+        Returns:
+            Dict[str, str]: Maps each species to the (page-relative) url of its
+                thumbnail, or None if static serving is off or the directory
+                is not writable.
+        """
+        if size in self._urls:
+            return self._urls[size]
+        import streamlit as st
+        if not st.get_option("server.enableStaticServing"):
+            return None
+
+        urls = {}
+        out_dir = self.static_dir / "ref"
+        try:
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for whale_class in sw_wv.df_whale_img_ref.index:
+                entry = self._prebuilt(whale_class, size)
+                fname = entry['file'] if entry is not None else self._write(whale_class, size)
+                urls[whale_class] = f"{STATIC_URL}/ref/{fname}"
+        except OSError as e:
+            m_logger.warning(f"could not export thumbnails to {out_dir}, not using static serving: {e}")
+            urls = None
+        with self._lock:
+            self._urls[size] = urls
+        return urls
+
+    def stats(self) -> dict:
+        """
+        Report the cached assets.
+
+        Returns:
+            dict: With the keys 'assets', 'bytes', 'prebuilt' (the number read
+                from the build step's output) and 'build_s' (the time spent
+                making the others, so far).
+        """
+        return {'assets': len(self._assets), 'bytes': sum(len(a.data) for a in self._assets.values()),
+                'prebuilt': self._n_prebuilt, 'build_s': round(self._build_s, 3)}
+
+
+# the assets shared by all sessions in this process
+assets = RefAssetCache()
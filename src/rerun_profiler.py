@@ -0,0 +1,322 @@
+from typing import Dict
+import contextlib
+import contextvars
+import datetime
+import json
+import linecache
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+'''
+A profiling mode for script reruns
+
+Every widget interaction reruns the whole script. With `SW_PROFILE_DIR` set,
+each rerun is split into the top-level sections marked in `main` (the
+sidebar input, each tab, ...), and for each section we record the wall and
+CPU time, and the memory allocated (net and peak, with tracemalloc). With
+`SW_PROFILE_TOP` > 0, the top allocation sites of each section are found by
+comparing tracemalloc snapshots (this makes reruns noticeably slower). One
+JSON report is written per rerun; `summarize` and `compare` aggregate them.
+
+tracemalloc counts the allocations of the whole process, so profile with a
+single session for per-section numbers that are not mixed with other reruns.
+'''
+
+
+class RerunProfile:
+    """
+    The sections of one rerun, as they are run
+
+    Attributes:
+        session_id (str): The streamlit session.
+        rerun (int): The number of the rerun in the session (from 1).
+        started_at (str): The start time (ISO format).
+        sections (List[dict]): The finished sections.
+    """
+    def __init__(self, session_id:str, rerun:int, trace_allocs:bool = True, n_top:int = 0):
+        self.session_id = session_id
+        self.rerun = rerun
+        self.started_at = datetime.datetime.now().isoformat(timespec="milliseconds")
+        self.sections = []
+        self._trace_allocs = trace_allocs
+        self._n_top = n_top if trace_allocs else 0
+        self._t_start = time.perf_counter()
+        self._open = None
+
+    def mark(self, name:str) -> None:
+        """
+        End the current section (if any) and start the next one.
+
+        Args:
+            name (str): The name of the new section.
+        """
+        self._close_section()
+        section = {'name': name, 't0': time.perf_counter(), 'cpu0': time.thread_time()}
+        if self._trace_allocs:
+            section['mem0'] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        if self._n_top:
+            section['snapshot'] = _snapshot()
+        self._open = section
+
+    def _close_section(self) -> None:
+        section, self._open = self._open, None
+        if section is None:
+            return
+        row = {'name': section['name'],
+               'wall_s': round(time.perf_counter() - section['t0'], 6),
+               'cpu_s': round(time.thread_time() - section['cpu0'], 6)}
+        if self._trace_allocs:
+            current, peak = tracemalloc.get_traced_memory()
+            row['alloc_net_bytes'] = current - section['mem0']
+            row['alloc_peak_bytes'] = max(0, peak - section['mem0'])
+        if self._n_top:
+            diff = _snapshot().compare_to(section['snapshot'], 'lineno')
+            row['top_allocs'] = [_format_stat(stat) for stat in diff[:self._n_top] if stat.size_diff > 0]
+        self.sections.append(row)
+
+    def close(self) -> dict:
+        """
+        End the last section, and return the report.
+
+        Returns:
+            dict: With the keys 'session_id', 'rerun', 'started_at', 'total_s' and 'sections'.
+        """
+        self._close_section()
+        return {'session_id': self.session_id, 'rerun': self.rerun, 'started_at': self.started_at,
+                'total_s': round(time.perf_counter() - self._t_start, 6), 'sections': self.sections}
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    '''a tracemalloc snapshot, leaving out what tracemalloc itself allocates'''
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def _format_stat(stat:tracemalloc.StatisticDiff) -> str:
+    '''an allocation site as "file:line +size (+count blocks): source line"'''
+    frame = stat.traceback[0]
+    source = linecache.getline(frame.filename, frame.lineno).strip()
+    return (f"{os.path.basename(frame.filename)}:{frame.lineno} +{stat.size_diff / 1024:.1f} KiB "
+            f"(+{stat.count_diff} blocks): {source}")
+
+
+# the profile of the rerun running in this thread
+_current_profile = contextvars.ContextVar("sw_rerun_profile", default=None)
+
+
+class RerunProfiler:
+    """
+    Profiles reruns, and writes one JSON report per rerun
+
+    Attributes:
+        report_dir (str): Where the reports are written.
+        trace_allocs (bool): Whether allocations are measured (with tracemalloc).
+        n_top (int): The number of top allocation sites reported per section (0 for none).
+
+    Methods:
+        rerun(session_id):
+            A context manager profiling one rerun.
+        last_report(session_id):
+            Returns the report of the last finished rerun of a session.
+    """
+    def __init__(self, report_dir:str, trace_allocs:bool = True, n_top:int = 0):
+        self.report_dir = report_dir
+        self.trace_allocs = trace_allocs
+        self.n_top = n_top
+        self._reruns: Dict[str, int] = {}
+        self._last: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        os.makedirs(report_dir, exist_ok=True)
+        if trace_allocs and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def rerun(self, session_id:str = None):
+        """
+        Profile the rerun run inside the `with` block (sections are started with `mark`).
+
+        Args:
+            session_id (str, optional): The streamlit session. Default is the current one.
+        """
+        if session_id is None:
+            from streamlit.runtime.scriptrunner import get_script_run_ctx
+            ctx = get_script_run_ctx()
+            session_id = ctx.session_id if ctx is not None else "bare"
+        with self._lock:
+            n = self._reruns[session_id] = self._reruns.get(session_id, 0) + 1
+        profile = RerunProfile(session_id, n, self.trace_allocs, self.n_top)
+        token = _current_profile.set(profile)
+        try:
+            profile.mark("preamble")
+            yield profile
+        finally:
+            _current_profile.reset(token)
+            report = profile.close()
+            with self._lock:
+                self._last[session_id] = report
+            path = os.path.join(self.report_dir, f"rerun-{time.time_ns()}-{session_id[:8]}-{n:04d}.json")
+            try:
+                with open(path, "w") as f:
+                    json.dump(report, f, indent=1)
+            except OSError as e:
+                m_logger.warning(f"could not write rerun profile {path}: {e}")
+
+    def last_report(self, session_id:str) -> dict:
+        """
+        Return the report of the last finished rerun of a session.
+
+        Args:
+            session_id (str): The streamlit session.
+
+        Returns:
+            dict: The report (as written to disk), or None.
+        """
+        with self._lock:
+            return self._last.get(session_id)
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RerunProfiler:
+    """
+    Return the process-wide profiler, if profiling is enabled.
+
+    Profiling is enabled by setting `SW_PROFILE_DIR` to the report directory.
+    `SW_PROFILE_TRACEMALLOC` (1 or 0, default 1) turns the allocation
+    measurements on or off, and `SW_PROFILE_TOP` (default 0) sets the number
+    of top allocation sites reported per section.
+
+    Returns:
+        RerunProfiler: The profiler, or None if profiling is off.
+    """
+    global _profiler
+    report_dir = os.environ.get("SW_PROFILE_DIR", None)
+    if not report_dir:
+        return None
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = RerunProfiler(report_dir,
+                                      trace_allocs=os.environ.get("SW_PROFILE_TRACEMALLOC", "1") != "0",
+                                      n_top=int(os.environ.get("SW_PROFILE_TOP", 0)))
+            m_logger.info(f"profiling reruns, reports in {report_dir}")
+        return _profiler
+
+
+def rerun():
+    """
+    Profile the current rerun, if profiling is enabled (otherwise do nothing).
+
+    Returns:
+        contextlib.AbstractContextManager: A context manager around the rerun.
+    """
+    profiler = get_profiler()
+    return profiler.rerun() if profiler is not None else contextlib.nullcontext()
+
+
+def mark(name:str) -> None:
+    """
+    Start the next top-level section of the current rerun (a no-op when not profiling).
+
+    Args:
+        name (str): The section name, e.g. 'tab_map'.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.mark(name)
+
+
+def load_reports(report_dir:str) -> pd.DataFrame:
+    """
+    Load the rerun reports of a directory, one row per section.
+
+    Args:
+        report_dir (str): The directory of the reports.
+
+    Returns:
+        pd.DataFrame: With the columns 'session_id', 'rerun', 'started_at' and
+            'total_s' of the rerun, and the section's 'name', 'wall_s', 'cpu_s',
+            and (if measured) 'alloc_net_bytes' and 'alloc_peak_bytes'.
+    """
+    rows = []
+    for fname in sorted(os.listdir(report_dir)):
+        if not (fname.startswith("rerun-") and fname.endswith(".json")):
+            continue
+        with open(os.path.join(report_dir, fname)) as f:
+            report = json.load(f)
+        for section in report['sections']:
+            rows.append({'session_id': report['session_id'], 'rerun': report['rerun'],
+                         'started_at': report['started_at'], 'total_s': report['total_s'],
+                         **{k: v for k, v in section.items() if k != 'top_allocs'}})
+    return pd.DataFrame(rows)
+
+
+def summarize(report_dir:str) -> pd.DataFrame:
+    """
+    Aggregate the reports per section, the costliest first.
+
+    Args:
+        report_dir (str): The directory of the reports.
+
+    Returns:
+        pd.DataFrame: One row per section, with the number of reruns, the
+            mean, median and 95th percentile wall time (ms), the mean CPU
+            time (ms), the share of the total rerun time, and (if measured)
+            the mean net and peak allocations (KiB).
+    """
+    df = load_reports(report_dir)
+    if df.empty:
+        return df
+    g = df.groupby('name')
+    summary = pd.DataFrame({
+        'reruns': g.size(),
+        'wall_mean_ms': g['wall_s'].mean() * 1e3,
+        'wall_p50_ms': g['wall_s'].median() * 1e3,
+        'wall_p95_ms': g['wall_s'].quantile(0.95) * 1e3,
+        'cpu_mean_ms': g['cpu_s'].mean() * 1e3,
+        'share': g['wall_s'].sum() / df['wall_s'].sum(),
+    })
+    if 'alloc_peak_bytes' in df:
+        summary['alloc_net_mean_kib'] = g['alloc_net_bytes'].mean() / 1024
+        summary['alloc_peak_mean_kib'] = g['alloc_peak_bytes'].mean() / 1024
+    return summary.sort_values('wall_mean_ms', ascending=False).round(3)
+
+
+def compare(baseline_dir:str, report_dir:str, threshold:float = 1.2) -> pd.DataFrame:
+    """
+    Compare the median wall time and mean peak allocation of each section with a baseline.
+
+    Args:
+        baseline_dir (str): The reports of the baseline.
+        report_dir (str): The reports to check.
+        threshold (float): The ratio above which a section counts as a regression. Default is 1.2.
+
+    Returns:
+        pd.DataFrame: One row per section in both, with the baseline and new
+            values, their ratios, and a 'regression' flag (no rows if either
+            directory has no reports).
+    """
+    base, new = summarize(baseline_dir), summarize(report_dir)
+    if base.empty or new.empty:
+        m_logger.warning(f"nothing to compare: no reports in {baseline_dir if base.empty else report_dir}")
+        return pd.DataFrame({'regression': pd.Series(dtype=bool)})
+    cols = ['wall_p50_ms'] + (['alloc_peak_mean_kib'] if 'alloc_peak_mean_kib' in base and
+                              'alloc_peak_mean_kib' in new else [])
+    df = base[cols].join(new[cols], lsuffix='_base', rsuffix='_new', how='inner')
+    flags = []
+    for col in cols:
+        df[f"{col}_ratio"] = (df[f"{col}_new"] / df[f"{col}_base"].where(df[f"{col}_base"] > 0)).round(3)
+        flags.append(df[f"{col}_ratio"] > threshold)
+    df['regression'] = pd.concat(flags, axis=1).any(axis=1)
+    return df
@@ -0,0 +1,409 @@
+from typing import Any, Dict, List
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# session state entries holding image arrays, which can be spilled to disk
+# (they are keyed on the image hash in `image_md5`, so they can be restored)
+SPILL_KEYS = ('image', 'image_thumb')
+# the per-upload ingestion cache also refers to the arrays (see input_handling)
+INGESTED_KEY = 'ingested_image'
+INGESTED_ATTRS = {'image': 'image', 'thumbnail': 'image_thumb'}
+# what the measured bytes are reported under (the rest goes under 'other').
+# The form metadata and the predictions are accounted but never spilled: they
+# are small, read on every run, and could not be rebuilt from a hash.
+MEASURE_GROUPS = {'images': SPILL_KEYS,
+                  'full_data': ('full_data',),
+                  'predictions': ('whale_prediction1', 'classify_whale_done')}
+
+
+def nbytes(value:Any, _depth:int = 0) -> int:
+    """
+    Estimate the memory held by a session state value.
+
+    Arrays, dataframes, images and containers are measured by their
+    contents; other objects by `sys.getsizeof`.
+
+    Args:
+        value (Any): The value.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, SpilledArray):
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum()) if isinstance(value, pd.DataFrame) \
+            else int(value.memory_usage(deep=True))
+    if _depth < 4:
+        if isinstance(value, dict):
+            return sum(nbytes(k, _depth + 1) + nbytes(v, _depth + 1) for k, v in value.items())
+        if isinstance(value, (list, tuple, set)):
+            return sum(nbytes(v, _depth + 1) for v in value)
+        # a PIL image only if PIL was imported (by whoever made it): not imported here
+        pil_image = sys.modules.get("PIL.Image")
+        if pil_image is not None and isinstance(value, pil_image.Image):
+            return value.size[0] * value.size[1] * len(value.getbands())
+        if hasattr(value, "__dict__") and not isinstance(value, type):
+            return sum(nbytes(v, _depth + 1) for v in vars(value).values())
+    return sys.getsizeof(value)
+
+
+class SpilledArray:
+    """
+    A handle left in session state in place of an array that was written to disk
+
+    Attributes:
+        path (str): The .npy file holding the array.
+        shape (tuple): The shape of the array.
+        nbytes (int): The size of the array in memory.
+    """
+    def __init__(self, path:str, shape:tuple, nbytes:int):
+        self.path = path
+        self.shape = shape
+        self.nbytes = nbytes
+
+    def __repr__(self):
+        return f"SpilledArray({os.path.basename(self.path)}, {self.shape})"
+
+
+class _Session:
+    '''what the governor knows about one session'''
+    def __init__(self, state:Any):
+        self.state = state
+        self.t_active = time.time()
+        self.n_bytes = 0
+        self.group_bytes = {}
+        self.spilled = False
+        self.running = False
+
+
+class SessionMemoryGovernor:
+    """
+    Track the memory held in each session's state, and spill idle sessions' images to disk
+
+    Each script run calls `touch` with its session state at the start, and
+    `release` at the end. `touch` records the session as active and
+    restores its images if they had been spilled; `release` measures what
+    the session holds. Every `sweep_interval_s`, sessions idle for more
+    than `idle_s`, and then the least recently active ones (that are not
+    running) while the total is over `max_total_bytes`, have their image
+    arrays written to a disk cache (one file per image hash and key, shared
+    between sessions) and replaced by a `SpilledArray` handle. Closed
+    sessions are forgotten.
+
+    Attributes:
+        spill_dir (str): Where spilled arrays are written.
+        idle_s (float): Sessions inactive for longer than this are spilled.
+        max_total_bytes (int): Spill more sessions (oldest first) while the total is above this.
+        sweep_interval_s (float): Minimum time between two sweeps.
+        spill_max_age_s (float): Spilled files unused for this long are deleted.
+
+    Methods:
+        touch(session_id, state):
+            Record the start of a run of a session, restoring its spilled images.
+        release(session_id):
+            Record the end of a run, measuring the session state.
+        sweep(now):
+            Spill idle sessions, forget closed ones, prune old files.
+        stats():
+            Returns totals, as a dict.
+        session_stats():
+            Returns one row per session, as a list of dicts.
+    """
+    def __init__(self, spill_dir:str = None, idle_s:float = 600.0,
+                 max_total_bytes:int = 2 * 2**30, sweep_interval_s:float = 30.0,
+                 spill_max_age_s:float = 24 * 3600.0):
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), "sw_session_spill")
+        self.idle_s = idle_s
+        self.max_total_bytes = max_total_bytes
+        self.sweep_interval_s = sweep_interval_s
+        self.spill_max_age_s = spill_max_age_s
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._sessions: Dict[str, _Session] = {}
+        self._lock = threading.Lock()
+        self._t_sweep = 0.0
+        self._n = {'spills': 0, 'restores': 0, 'restore_misses': 0, 'bytes_spilled': 0}
+
+    def touch(self, session_id:str, state:Any) -> None:
+        """
+        Record the start of a script run, restore the session's images and measure its state.
+
+        Args:
+            session_id (str): The session id (from the script run context).
+            state (Any): The session state of the script run context (a
+                `SafeSessionState`), kept to reach the session when it is idle.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(state)
+            session.state = state
+            session.t_active = time.time()
+            session.running = True
+            if session.spilled:
+                self._restore(session)
+            self._update(session)
+            due = time.time() - self._t_sweep >= self.sweep_interval_s
+        if due:
+            self.sweep()
+
+    def release(self, session_id:str) -> None:
+        """
+        Record the end of a script run, and measure what the session now holds.
+
+        Args:
+            session_id (str): The session id, as given to `touch`.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session.running = False
+            session.t_active = time.time()
+            self._update(session)
+
+    @staticmethod
+    def _measure(state:Any) -> Dict[str, int]:
+        '''the bytes held by the session state, by `MEASURE_GROUPS` (and 'other')'''
+        groups = {group: 0 for group in (*MEASURE_GROUPS, 'other')}
+        try:
+            items = state.filtered_state.items()
+        except Exception as e: # a session being torn down, for example
+            m_logger.debug(f"could not read session state: {e}")
+            return groups
+        for key, value in items:
+            if key == INGESTED_KEY: # refers to the same arrays as SPILL_KEYS
+                continue
+            group = next((g for g, keys in MEASURE_GROUPS.items() if key in keys), 'other')
+            try:
+                groups[group] += nbytes(value)
+            except Exception as e:
+                m_logger.debug(f"could not measure session state '{key}': {e}")
+        return groups
+
+    def _update(self, session:_Session) -> None:
+        '''measure the session state (caller holds the lock)'''
+        session.group_bytes = self._measure(session.state)
+        session.n_bytes = sum(session.group_bytes.values())
+
+    def _spill_path(self, image_md5:str, key:str) -> str:
+        return os.path.join(self.spill_dir, f"{image_md5}-{key}.npy")
+
+    def _spill_array(self, image_md5:str, key:str, arr:np.ndarray) -> SpilledArray:
+        path = self._spill_path(image_md5, key)
+        if not os.path.exists(path): # another session may have spilled the same image
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp_path, path)
+        self._n['bytes_spilled'] += arr.nbytes
+        return SpilledArray(path, arr.shape, arr.nbytes)
+
+    def _spill(self, session_id:str, session:_Session) -> None:
+        '''write the session's image arrays to disk, leaving handles (caller holds the lock)'''
+        state = session.state
+        filtered = state.filtered_state
+        image_md5 = filtered.get('image_md5', None)
+        if image_md5 is None:
+            return
+        spilled = {}
+        for key in SPILL_KEYS:
+            value = filtered.get(key, None)
+            if isinstance(value, np.ndarray):
+                spilled[key] = self._spill_array(image_md5, key, value)
+                state[key] = spilled[key]
+        ingested = filtered.get(INGESTED_KEY, None)
+        if ingested is not None:
+            for attr, key in INGESTED_ATTRS.items():
+                value = getattr(ingested[1], attr, None)
+                if isinstance(value, np.ndarray):
+                    handle = spilled.get(key) or self._spill_array(image_md5, key, value)
+                    setattr(ingested[1], attr, handle)
+        if spilled:
+            session.spilled = True
+            self._n['spills'] += 1
+            m_logger.info(f"spilled images of idle session {session_id[:8]} "
+                          f"({sum(h.nbytes for h in spilled.values()) / 2**20:.1f} MiB)")
+        self._update(session)
+
+    def _restore(self, session:_Session) -> None:
+        '''load the session's spilled arrays back (caller holds the lock)'''
+        state = session.state
+        filtered = state.filtered_state
+        loaded = {}
+        try:
+            for key in SPILL_KEYS:
+                value = filtered.get(key, None)
+                if isinstance(value, SpilledArray):
+                    loaded[value.path] = np.load(value.path)
+                    os.utime(value.path) # keep recently used files from being pruned
+                    state[key] = loaded[value.path]
+            ingested = filtered.get(INGESTED_KEY, None)
+            if ingested is not None:
+                for attr in INGESTED_ATTRS:
+                    value = getattr(ingested[1], attr, None)
+                    if isinstance(value, SpilledArray):
+                        if value.path not in loaded:
+                            loaded[value.path] = np.load(value.path)
+                        setattr(ingested[1], attr, loaded[value.path])
+            self._n['restores'] += 1
+        except OSError as e:
+            # the file was pruned: drop the image, the upload is ingested again
+            m_logger.warning(f"could not restore spilled image, it will be reloaded: {e}")
+            self._n['restore_misses'] += 1
+            for key in SPILL_KEYS:
+                if isinstance(filtered.get(key, None), (SpilledArray, np.ndarray)):
+                    state[key] = None
+            if INGESTED_KEY in filtered:
+                state[INGESTED_KEY] = None
+        session.spilled = False
+
+    def sweep(self, now:float = None) -> None:
+        """
+        Spill idle sessions, and the oldest ones while over budget; forget closed sessions.
+
+        Args:
+            now (float, optional): The current time. Default is `time.time()`.
+        """
+        now = now or time.time()
+        try:
+            from streamlit.runtime import Runtime
+            runtime = Runtime.instance() if Runtime.exists() else None
+        except ImportError:
+            runtime = None
+
+        with self._lock:
+            self._t_sweep = now
+            for session_id in list(self._sessions):
+                if runtime is not None and not runtime.is_active_session(session_id):
+                    del self._sessions[session_id]
+
+            by_age = sorted(self._sessions.items(), key=lambda item: item[1].t_active)
+            total = sum(s.n_bytes for s in self._sessions.values())
+            for session_id, session in by_age:
+                if session.spilled:
+                    continue
+                idle = now - session.t_active
+                # a running script may be using its images; a run that never
+                # released (it raised) is treated as idle after `idle_s`
+                if idle >= self.idle_s or (total > self.max_total_bytes and not session.running):
+                    before = session.n_bytes
+                    try:
+                        self._spill(session_id, session)
+                    except Exception as e:
+                        m_logger.warning(f"could not spill session {session_id[:8]}: {e}")
+                    total -= before - session.n_bytes
+        self._prune(now)
+
+    def _prune(self, now:float) -> None:
+        '''delete spilled files not used for `spill_max_age_s`'''
+        for fname in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, fname)
+            try:
+                if now - os.stat(path).st_mtime > self.spill_max_age_s:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Report the memory held by all sessions, and the spill activity.
+
+        Returns:
+            dict: With the keys 'sessions', 'spilled_sessions', 'total_bytes',
+                '<group>_bytes' for each of `MEASURE_GROUPS` and 'other',
+                'max_total_bytes', 'disk_bytes', 'spills', 'restores',
+                'restore_misses' and 'bytes_spilled'.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            by_group = {f"{group}_bytes": sum(s.group_bytes.get(group, 0) for s in sessions)
+                        for group in (*MEASURE_GROUPS, 'other')}
+            disk_bytes = 0
+            for fname in os.listdir(self.spill_dir):
+                try:
+                    disk_bytes += os.path.getsize(os.path.join(self.spill_dir, fname))
+                except OSError:
+                    pass
+            return {'sessions': len(sessions), 'spilled_sessions': sum(s.spilled for s in sessions),
+                    'total_bytes': sum(s.n_bytes for s in sessions), **by_group,
+                    'max_total_bytes': self.max_total_bytes, 'disk_bytes': disk_bytes, **self._n}
+
+    def session_stats(self) -> List[dict]:
+        """
+        Report the memory held by each session.
+
+        Returns:
+            List[dict]: One row per session, most recently active first, with
+                the keys 'session', 'bytes', '<group>_bytes' (as in `stats`),
+                'idle_s', 'running' and 'spilled'.
+        """
+        now = time.time()
+        with self._lock:
+            rows = [{'session': session_id[:8], 'bytes': s.n_bytes,
+                     **{f"{group}_bytes": s.group_bytes.get(group, 0) for group in (*MEASURE_GROUPS, 'other')},
+                     'idle_s': round(now - s.t_active, 1), 'running': s.running, 'spilled': s.spilled}
+                    for session_id, s in self._sessions.items()]
+        return sorted(rows, key=lambda r: r['idle_s'])
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor() -> SessionMemoryGovernor:
+    """
+    Return the process-wide governor, creating it on first use.
+
+    Configured by `SW_SESSION_SPILL_DIR`, `SW_SESSION_IDLE_S` (default 600)
+    and `SW_SESSION_MAX_MB` (the budget for all sessions, default 2048).
+
+    Returns:
+        SessionMemoryGovernor: The governor shared by all sessions.
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None:
+            _governor = SessionMemoryGovernor(
+                spill_dir=os.environ.get("SW_SESSION_SPILL_DIR", None),
+                idle_s=float(os.environ.get("SW_SESSION_IDLE_S", 600)),
+                max_total_bytes=int(float(os.environ.get("SW_SESSION_MAX_MB", 2048)) * 2**20))
+        return _governor
+
+
+def touch_current_session() -> None:
+    """
+    Call `touch` for the session running this script (no-op outside streamlit).
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    get_governor().touch(ctx.session_id, ctx.session_state)
+
+
+def release_current_session() -> None:
+    """
+    Call `release` for the session running this script (no-op outside streamlit).
+    """
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return
+    get_governor().release(ctx.session_id)
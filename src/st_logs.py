@@ -1,11 +1,26 @@
-from typing import List
+from typing import Dict, Iterator, List, Sequence
 import logging
 from datetime import datetime
+import os
 import re
+import threading
+import time
 from collections import deque
+import gzip
+import heapq
+import json
+import shutil
+import socket
 
+import numpy as np
+import pandas as pd
 import streamlit as st
 
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
 # some discussions with code snippets from:
 # https://discuss.streamlit.io/t/capture-and-display-logger-in-ui/69136
 
@@ -21,6 +36,208 @@ _sep = r' - '
 log_pattern = re.compile(_log_n_re + _log_date_re + _sep + _log_mod_re + _sep + 
     _log_func_re + _sep + _log_level_re + _sep + _log_msg_re)
 
+# level number -> name, for vectorised lookup of the standard levels
+_LEVEL_NAMES = np.array([logging.getLevelName(i) for i in range(51)], dtype=object)
+
+
+def _level_names(levels:np.ndarray) -> np.ndarray:
+    names = _LEVEL_NAMES[np.clip(levels, 0, 50)]
+    custom = (levels < 0) | (levels > 50)
+    if custom.any():
+        names[custom] = [logging.getLevelName(int(lv)) for lv in levels[custom]]
+    return names
+
+
+def _record_message(record:logging.LogRecord, formatter:logging.Formatter = None) -> str:
+    '''the message of a record, followed by its traceback if it has one'''
+    message = record.getMessage()
+    if record.exc_info:
+        message += "\n" + (formatter or logging.Formatter()).formatException(record.exc_info)
+    return message
+
+
+class LogRingBuffer:
+    """
+    A preallocated ring buffer of structured log records
+
+    Each record is stored as fields in fixed-size numpy arrays: the creation
+    time, sequence number, level number, and ids of the module and function
+    names (interned in a table), plus the message. Nothing is formatted or
+    parsed on the way in or out. Filters on level and module are vectorised
+    comparisons on the integer columns, and a time range one on the
+    timestamps.
+
+    Iterating over the buffer yields the records formatted as log lines
+    (oldest first), as the previous `deque` of strings did, so
+    `parse_log_buffer` works with either.
+
+    Attributes:
+        maxlen (int): The number of records kept; older ones are overwritten.
+
+    Methods:
+        append(record):
+            Store a logging.LogRecord.
+        query(min_level, levels, modules, since, until, limit, newest_first):
+            Returns the matching records as a dataframe.
+        records(...):
+            As `query`, as a list of dicts (the format of `parse_log_buffer`).
+        modules():
+            Returns the module names seen.
+        clear():
+            Drop all records.
+    """
+    def __init__(self, maxlen:int = 20000):
+        self.maxlen = maxlen
+        self._t = np.zeros(maxlen, dtype=np.float64)
+        self._n = np.zeros(maxlen, dtype=np.int64)
+        self._level = np.zeros(maxlen, dtype=np.int16)
+        self._module = np.zeros(maxlen, dtype=np.int32)
+        self._func = np.zeros(maxlen, dtype=np.int32)
+        self._msg = np.empty(maxlen, dtype=object)
+        self._names: List[str] = []
+        self._name_ids: Dict[str, int] = {}
+        self._count = 0 # records appended since the last clear
+        self._seq = 0 # records ever appended (the `n` of a record)
+        self._lock = threading.Lock()
+
+    def _intern(self, name:str) -> int:
+        ix = self._name_ids.get(name)
+        if ix is None:
+            ix = self._name_ids[name] = len(self._names)
+            self._names.append(name)
+        return ix
+
+    def append(self, record:logging.LogRecord, message:str = None) -> None:
+        """
+        Store a log record.
+
+        Args:
+            record (logging.LogRecord): The record.
+            message (str, optional): The message text. Default is `record.getMessage()`.
+        """
+        if message is None:
+            message = record.getMessage()
+        with self._lock:
+            i = self._count % self.maxlen
+            self._count += 1
+            self._seq += 1
+            self._t[i] = record.created
+            self._n[i] = self._seq
+            self._level[i] = record.levelno
+            self._module[i] = self._intern(record.name)
+            self._func[i] = self._intern(record.funcName)
+            self._msg[i] = message
+
+    def __len__(self) -> int:
+        return min(self._count, self.maxlen)
+
+    def _order(self) -> np.ndarray:
+        '''the slot indices in the order the records were appended (oldest first)'''
+        n = len(self)
+        if self._count <= self.maxlen:
+            return np.arange(n)
+        start = self._count % self.maxlen
+        return np.concatenate([np.arange(start, self.maxlen), np.arange(0, start)])
+
+    def modules(self) -> List[str]:
+        """
+        Return the names of the modules that have logged to this buffer.
+
+        Returns:
+            List[str]: The module names, sorted.
+        """
+        with self._lock:
+            ids = np.unique(self._module[self._order()])
+            return sorted(self._names[i] for i in ids)
+
+    def _select(self, min_level:int = None, levels:Sequence[str] = None,
+                modules:Sequence[str] = None, since:datetime = None, until:datetime = None,
+                limit:int = None, newest_first:bool = True) -> np.ndarray:
+        '''slot indices of the matching records (caller holds the lock)'''
+        order = self._order()
+        mask = np.ones(len(order), dtype=bool)
+        # `created` is set before the lock is taken, so records of different threads
+        # need not be in time order: a range is a mask, not a binary search
+        if since is not None:
+            mask &= self._t[order] >= since.timestamp()
+        if until is not None:
+            mask &= self._t[order] <= until.timestamp()
+        if min_level is not None:
+            mask &= self._level[order] >= min_level
+        if levels is not None:
+            mask &= np.isin(self._level[order], [logging.getLevelName(lv) for lv in levels])
+        if modules is not None:
+            ids = [self._name_ids[m] for m in modules if m in self._name_ids]
+            mask &= np.isin(self._module[order], ids)
+        order = order[mask]
+        if newest_first:
+            order = order[::-1]
+        if limit is not None:
+            order = order[:limit]
+        return order
+
+    def query(self, min_level:int = None, levels:Sequence[str] = None,
+              modules:Sequence[str] = None, since:datetime = None, until:datetime = None,
+              limit:int = None, newest_first:bool = True) -> pd.DataFrame:
+        """
+        Return the records matching the filters.
+
+        Args:
+            min_level (int, optional): Keep records at this level or above (e.g. logging.WARNING).
+            levels (Sequence[str], optional): Keep records with these level names.
+            modules (Sequence[str], optional): Keep records from these modules (logger names).
+            since (datetime, optional): Keep records created at or after this time.
+            until (datetime, optional): Keep records created at or before this time.
+            limit (int, optional): Return at most this many records.
+            newest_first (bool): Order of the records. Default is True.
+
+        Returns:
+            pd.DataFrame: With the columns 'timestamp', 'n', 'level', 'module',
+                'func' and 'message'.
+        """
+        with self._lock:
+            ix = self._select(min_level, levels, modules, since, until, limit, newest_first)
+            names = np.asarray(self._names + [""], dtype=object)
+            df = pd.DataFrame({
+                # local time, as in the formatted log lines
+                'timestamp': pd.to_datetime(self._t[ix] + time.localtime().tm_gmtoff, unit='s'),
+                'n': self._n[ix],
+                'level': _level_names(self._level[ix]),
+                'module': names[self._module[ix]],
+                'func': names[self._func[ix]],
+                'message': self._msg[ix],
+            })
+        return df
+
+    def records(self, **filters) -> List[dict]:
+        """
+        As `query`, as a list of dicts (the format returned by `parse_log_buffer`).
+
+        Args:
+            **filters: As for `query`.
+
+        Returns:
+            List[dict]: One dict per record.
+        """
+        return self.query(**filters).to_dict('records')
+
+    def __iter__(self) -> Iterator[str]:
+        '''the records as log lines, oldest first (as formatted by `setup_logging`)'''
+        with self._lock:
+            ix = self._order()
+            rows = [(self._n[i], self._t[i], self._names[self._module[i]], self._names[self._func[i]],
+                     logging.getLevelName(int(self._level[i])), self._msg[i]) for i in ix]
+        for n, t, module, func, level, msg in rows:
+            ts = datetime.fromtimestamp(t)
+            yield (f"[{n}]{ts:%Y-%m-%d %H:%M:%S},{ts.microsecond // 1000:03d} - "
+                   f"{module} - {func} - {level} - {msg}")
+
+    def clear(self) -> None:
+        """Drop all records."""
+        with self._lock:
+            self._count = 0
+            self._msg[:] = None
+
 
 class StreamlitLogHandler(logging.Handler):
     """
@@ -34,23 +251,26 @@ class StreamlitLogHandler(logging.Handler):
         debug (bool): A flag to indicate whether to display debug messages.
         ansi_escape (re.Pattern): A compiled regular expression to remove ANSI escape sequences from log messages.
         log_area (streamlit.DeltaGenerator): An empty Streamlit container for log output.
-        buffer (collections.deque): A deque buffer to store log messages with a maximum length.
+        buffer (LogRingBuffer): A ring buffer storing the log records, with a maximum length.
+        queue (QueueLogHandler): The queue feeding this handler from the root logger, or None
+            if it is attached directly.
+        sink (LogSegmentSink): The handler keeping the same records on disk, or None.
         _n (int): A counter to keep track of the number of log messages seen.
 
     Methods:
-        __init__(container, maxlen=15, debug=False):
+        __init__(container, maxlen=20000, debug=False):
             Initializes the StreamlitLogHandler with a Streamlit container, buffer length, and debug flag.
         n_elems(verb=False):
             Returns a string with the total number of elements seen and the number of elements in the buffer.
             If verb is True, returns a verbose string; otherwise, returns a concise string.
         emit(record):
-            Processes a log record, formats it, appends it to the buffer, and displays it in the Streamlit container.
-            Strips ANSI escape sequences from the log message if present.
+            Stores a log record in the buffer (unformatted). In debug mode, also formats it and
+            displays it in the Streamlit container, with ANSI escape sequences stripped.
         clear_logs():
             Clears the log messages from the Streamlit container and the buffer.
     """
     # Initialize a custom log handler with a Streamlit container for displaying logs
-    def __init__(self, container, maxlen:int=15, debug:bool=False):
+    def __init__(self, container, maxlen:int=20000, debug:bool=False):
         #TODO: find the type for streamlit generic containers
         super().__init__()
         # Store the Streamlit container for log output
@@ -59,7 +279,9 @@ class StreamlitLogHandler(logging.Handler):
         self.ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])') # Regex to remove ANSI codes
         self.log_area = self.container.empty() # Prepare an empty conatiner for log output
 
-        self.buffer = deque(maxlen=maxlen)
+        self.buffer = LogRingBuffer(maxlen=maxlen)
+        self.queue = None
+        self.sink = None
         self._n = 0
         
     def n_elems(self, verb:bool=False) -> str:
@@ -85,10 +307,15 @@ class StreamlitLogHandler(logging.Handler):
         
         '''
         self._n += 1
-        msg = f"[{self._n}]" + self.format(record)
-        self.buffer.append(msg)
-        clean_msg = self.ansi_escape.sub('', msg)  # Strip ANSI codes
+        try:
+            # store the fields, not a formatted line (formatting is deferred to display)
+            self.buffer.append(record, _record_message(record, self.formatter))
+        except Exception:
+            self.handleError(record)
+            return
         if self.debug:
+            msg = f"[{self._n}]" + self.format(record)
+            clean_msg = self.ansi_escape.sub('', msg)  # Strip ANSI codes
             self.log_area.markdown(clean_msg)
                 
     def clear_logs(self) -> None:
@@ -100,19 +327,610 @@ class StreamlitLogHandler(logging.Handler):
         self.log_area.empty()  # Clear previous logs
         self.buffer.clear()
 
+class QueueLogHandler(logging.Handler):
+    """
+    A non-blocking log handler: records are queued, and handled on a background thread
+
+    The logging call only appends the record to a bounded deque (an atomic
+    operation, so no lock is taken on the caller's thread) and returns. No
+    string work happens there: the message is formatted lazily, when the
+    writer thread passes the record on to the `targets` handlers. Level checks
+    happen before the record is built (by the loggers) and before it is
+    queued (by this handler's level and filters).
+
+    When the queue is full, new records are dropped and counted, rather than
+    blocking the caller or growing without bound.
+
+    Note that, as the message is formatted later, mutable arguments changed
+    right after the logging call may be shown with their new value. In debug
+    mode, the Streamlit handler displays records from the writer thread, where streamlit
+    elements cannot be updated; use the direct mode to see them in the app.
+
+    Attributes:
+        targets (List[logging.Handler]): The handlers the records are passed on to.
+        capacity (int): The maximum number of records waiting in the queue.
+        poll_interval (float): How long the writer sleeps when the queue is empty, in seconds.
+
+    Methods:
+        emit(record):
+            Queues the record, or drops it if the queue is full.
+        flush(timeout=1.0):
+            Waits until the queued records have been handled.
+        stats():
+            Returns the record counts and the time spent per logging call.
+        close():
+            Handles the remaining records and stops the writer thread.
+    """
+    def __init__(self, targets:logging.Handler | Sequence[logging.Handler], capacity:int=10000,
+                 poll_interval:float=0.05):
+        super().__init__()
+        self.targets = [targets] if isinstance(targets, logging.Handler) else list(targets)
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self._queue = deque()
+        self._enqueued = 0
+        self._dropped = 0
+        self._processed = 0
+        self._max_depth = 0
+        # time spent in emit (on the caller's thread) and in the targets (on the writer), in ns
+        self._emit_ns = 0
+        self._emit_samples = deque(maxlen=4096)
+        self._process_ns = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sw-log-writer", daemon=True)
+        self._thread.start()
+
+    def handle(self, record:logging.LogRecord) -> bool:
+        # as logging.Handler.handle, without taking the handler lock
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record:logging.LogRecord) -> None:
+        '''queue the record (or count it as dropped, if the queue is full)
+
+        Args:
+            record (logging.LogRecord): The log record, passed on as is.
+        '''
+        start_time = time.perf_counter_ns()
+        depth = len(self._queue)
+        if depth >= self.capacity:
+            self._dropped += 1
+        else:
+            self._queue.append(record)
+            self._enqueued += 1
+            if depth >= self._max_depth:
+                self._max_depth = depth + 1
+        elapsed = time.perf_counter_ns() - start_time
+        self._emit_ns += elapsed
+        self._emit_samples.append(elapsed)
+
+    def _drain(self) -> None:
+        while self._queue:
+            record = self._queue.popleft()
+            start_time = time.perf_counter_ns()
+            for target in self.targets:
+                try:
+                    target.handle(record)
+                except Exception:
+                    self.handleError(record)
+            self._process_ns += time.perf_counter_ns() - start_time
+            self._processed += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self._queue:
+                self._drain()
+            else:
+                self._stop.wait(self.poll_interval)
+        self._drain()
+
+    def flush(self, timeout:float=1.0) -> bool:
+        """
+        Wait until the records queued so far have been handled.
+
+        Args:
+            timeout (float): The maximum time to wait, in seconds. Default is 1.0.
+
+        Returns:
+            bool: True if the queue was emptied in time.
+        """
+        n_queued = self._enqueued
+        deadline = time.monotonic() + timeout
+        while self._processed < n_queued and self._thread.is_alive():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.001)
+        return True
+
+    def stats(self) -> dict:
+        """
+        Report the queue counts, and the overhead of logging through the queue.
+
+        Returns:
+            dict: With the keys 'enqueued', 'processed', 'dropped', 'depth', 'max_depth'
+                and 'capacity', the mean and 99th percentile time of a logging call
+                on the caller's thread ('emit_mean_us', 'emit_p99_us', over the
+                recent calls), and the mean time the writer spends per record
+                ('process_mean_us').
+        """
+        n_calls = self._enqueued + self._dropped
+        samples = np.array(list(self._emit_samples), dtype=np.int64)
+        return {'enqueued': self._enqueued, 'processed': self._processed, 'dropped': self._dropped,
+                'depth': len(self._queue), 'max_depth': self._max_depth, 'capacity': self.capacity,
+                'emit_mean_us': round(self._emit_ns / n_calls / 1e3, 3) if n_calls else None,
+                'emit_p99_us': round(float(np.percentile(samples, 99)) / 1e3, 3) if len(samples) else None,
+                'process_mean_us': round(self._process_ns / self._processed / 1e3, 3) if self._processed else None}
+
+    def close(self) -> None:
+        """Handle the records still queued, and stop the writer thread."""
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        super().close()
+
+
+# on-disk log history: <log_dir>/<replica>/seg-<ms since epoch>.jsonl (the segment being
+# written), compressed to .jsonl.gz when full, and listed in <log_dir>/<replica>/index.jsonl
+SEGMENT_PREFIX = "seg-"
+INDEX_FILE = "index.jsonl"
+# the time range of a segment not yet indexed is estimated from its file name and
+# modification time; file system clocks can be coarse, so it is widened by this much
+_UNINDEXED_MARGIN_S = 2.0
+
+
+def default_replica_id() -> str:
+    """
+    Return the name this process writes its log segments under.
+
+    Returns:
+        str: `SW_LOG_REPLICA` if set (e.g. the pod name, to keep one directory
+            across restarts), or the host name and process id.
+    """
+    return os.environ.get("SW_LOG_REPLICA") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LogSegmentSink(logging.Handler):
+    """
+    A log handler that keeps the records on disk, in size-rotated compressed segments
+
+    Each record is written as one line of JSON (time, level, module, function
+    and message) to the current segment file. When it reaches
+    `max_segment_bytes`, the segment is gzip-compressed, and its time range,
+    record count and highest level are appended to the replica's index, so
+    readers can skip segments without opening them. Each process writes to
+    its own replica directory; segments older than `retention_s` are deleted
+    (from all replicas) whenever a segment is rotated.
+
+    Segments left uncompressed by a process that stopped are compressed when a
+    sink with the same replica name starts.
+
+    Attributes:
+        log_dir (str): The directory shared by all replicas.
+        replica (str): The name of this process's subdirectory.
+        max_segment_bytes (int): The size at which a segment is rotated.
+        retention_s (float): How long segments are kept, in seconds.
+
+    Methods:
+        emit(record):
+            Appends the record to the current segment, and rotates it if full.
+        rotate():
+            Compresses and indexes the current segment, and deletes expired ones.
+        stats():
+            Returns the number of records and segments written by this process.
+        close():
+            Rotates the current segment, so no uncompressed segment is left.
+    """
+    def __init__(self, log_dir:str, replica:str = None, max_segment_bytes:int = 4 * 2**20,
+                 retention_s:float = 7 * 86400):
+        super().__init__()
+        self.log_dir = log_dir
+        self.replica = replica or default_replica_id()
+        self.replica_dir = os.path.join(log_dir, self.replica)
+        self.max_segment_bytes = max_segment_bytes
+        self.retention_s = retention_s
+        os.makedirs(self.replica_dir, exist_ok=True)
+
+        self._file = None
+        self._path = None
+        self._bytes = 0
+        self._seg = None # the index entry of the current segment
+        self._n_records = 0
+        self._n_segments = 0
+        for fname in sorted(os.listdir(self.replica_dir)):
+            if fname.startswith(SEGMENT_PREFIX) and fname.endswith(".jsonl"):
+                m_logger.info(f"compressing segment {fname} left by a previous run")
+                self._close_segment(os.path.join(self.replica_dir, fname))
+        self._prune()
+
+    def _open_segment(self) -> None:
+        t_ms = int(time.time() * 1000)
+        while os.path.exists(os.path.join(self.replica_dir, f"{SEGMENT_PREFIX}{t_ms:013d}.jsonl.gz")):
+            t_ms += 1
+        self._path = os.path.join(self.replica_dir, f"{SEGMENT_PREFIX}{t_ms:013d}.jsonl")
+        os.makedirs(self.replica_dir, exist_ok=True)
+        self._file = open(self._path, "a", encoding="utf-8")
+        self._bytes = 0
+        self._seg = {'t_first': None, 't_last': None, 'n': 0, 'max_level': 0}
+
+    def emit(self, record:logging.LogRecord) -> None:
+        '''append the record to the current segment (one line of JSON)
+
+        Args:
+            record (logging.LogRecord): The log record to store.
+        '''
+        try:
+            line = json.dumps({'t': record.created, 'level': record.levelno, 'module': record.name,
+                               'func': record.funcName, 'msg': _record_message(record, self.formatter)},
+                              ensure_ascii=False) + "\n"
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._file.flush() # so other replicas (and restarts) see it
+            self._bytes += len(line)
+            self._n_records += 1
+            seg = self._seg
+            seg['n'] += 1
+            seg['t_first'] = record.created if seg['t_first'] is None else min(seg['t_first'], record.created)
+            seg['t_last'] = record.created if seg['t_last'] is None else max(seg['t_last'], record.created)
+            seg['max_level'] = max(seg['max_level'], record.levelno)
+        except Exception:
+            self.handleError(record)
+            return
+        if self._bytes >= self.max_segment_bytes:
+            self.rotate()
+
+    def _close_segment(self, path:str, seg:dict = None) -> None:
+        '''compress a segment, and add it to the index'''
+        if seg is None: # a leftover segment: read its time range
+            seg = {'t_first': None, 't_last': None, 'n': 0, 'max_level': 0}
+            for rec in _read_segment(path):
+                seg['n'] += 1
+                seg['t_first'] = rec['t'] if seg['t_first'] is None else min(seg['t_first'], rec['t'])
+                seg['t_last'] = rec['t'] if seg['t_last'] is None else max(seg['t_last'], rec['t'])
+                seg['max_level'] = max(seg['max_level'], rec['level'])
+        if seg['n'] == 0:
+            os.remove(path)
+            return
+        gz_path = path + ".gz"
+        with open(path, "rb") as f_in, gzip.open(gz_path + ".tmp", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(gz_path + ".tmp", gz_path)
+        with open(os.path.join(self.replica_dir, INDEX_FILE), "a") as f:
+            f.write(json.dumps({'file': os.path.basename(gz_path), **seg,
+                                'bytes': os.path.getsize(gz_path)}) + "\n")
+        os.remove(path)
+        self._n_segments += 1
+
+    def rotate(self) -> None:
+        """Compress and index the current segment, and delete segments past the retention time."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            self._close_segment(self._path, self._seg)
+            self._prune()
+        except OSError as e:
+            m_logger.warning(f"could not rotate log segment {self._path}: {e}")
+
+    def _prune(self) -> None:
+        '''delete the segments (of all replicas) last written before the retention time'''
+        cutoff = time.time() - self.retention_s
+        for replica in os.listdir(self.log_dir):
+            replica_dir = os.path.join(self.log_dir, replica)
+            if not os.path.isdir(replica_dir):
+                continue
+            n_left = 0
+            try:
+                fnames = os.listdir(replica_dir)
+            except OSError: # removed by another replica meanwhile
+                continue
+            for fname in fnames:
+                if not fname.startswith(SEGMENT_PREFIX):
+                    continue
+                path = os.path.join(replica_dir, fname)
+                try:
+                    if path != self._path and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                    else:
+                        n_left += 1
+                except OSError: # removed by another replica meanwhile
+                    pass
+            if replica == self.replica:
+                # drop the deleted segments from our index
+                index = _read_index(replica_dir)
+                kept = [entry for entry in index if os.path.exists(os.path.join(replica_dir, entry['file']))]
+                if len(kept) < len(index):
+                    tmp_path = os.path.join(replica_dir, INDEX_FILE + ".tmp")
+                    with open(tmp_path, "w") as f:
+                        f.writelines(json.dumps(entry) + "\n" for entry in kept)
+                    os.replace(tmp_path, os.path.join(replica_dir, INDEX_FILE))
+            elif n_left == 0:
+                # a replica gone for good (a live one may not have written a segment yet)
+                try:
+                    if os.path.getmtime(replica_dir) < cutoff:
+                        shutil.rmtree(replica_dir, ignore_errors=True)
+                except OSError: # removed by another replica meanwhile
+                    pass
+
+    def stats(self) -> dict:
+        """
+        Report what this process has written.
+
+        Returns:
+            dict: With the keys 'replica', 'records', 'segments' (rotated by this
+                process) and 'current_segment_bytes'.
+        """
+        return {'replica': self.replica, 'records': self._n_records, 'segments': self._n_segments,
+                'current_segment_bytes': self._bytes if self._file is not None else 0}
+
+    def close(self) -> None:
+        """Compress the current segment, and close the handler."""
+        self.acquire()
+        try:
+            self.rotate()
+        finally:
+            self.release()
+        super().close()
+
+
+def _read_index(replica_dir:str) -> List[dict]:
+    '''the index entries of a replica (the last entry wins, for a segment listed twice)'''
+    entries = {}
+    try:
+        with open(os.path.join(replica_dir, INDEX_FILE)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError: # a line being written
+                    continue
+                entries[entry['file']] = entry
+    except FileNotFoundError:
+        pass
+    return list(entries.values())
+
+
+def _read_lines(path:str) -> Iterator[str]:
+    '''the lines of a segment file, compressed or not'''
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as f:
+            yield from f
+    except (FileNotFoundError, EOFError): # pruned meanwhile, or a truncated file
+        return
+
+
+def _read_segment(path:str) -> Iterator[dict]:
+    '''the records of a segment file; a partly written last line is skipped'''
+    for line in _read_lines(path):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+class LogArchive:
+    """
+    Reads the log segments written by `LogSegmentSink`, across segments and replicas
+
+    Searches stream through one segment at a time, newest first, keeping only
+    the best `offset + limit` matches, so memory use does not grow with the
+    history. Segments whose time range (from the index) cannot contain a
+    match, or that can no longer make it into the result, are not opened.
+
+    Attributes:
+        log_dir (str): The directory shared by all replicas.
+
+    Methods:
+        replicas():
+            Returns the names of the replicas with log segments.
+        segments(replicas=None, since=None, until=None):
+            Returns the segments that overlap a time range.
+        search(text=None, ..., limit=100, offset=0):
+            Returns a page of matching records, newest first.
+        tail(n=100, **filters):
+            Returns the newest records.
+        stats():
+            Returns the number and size of the segments on disk.
+    """
+    def __init__(self, log_dir:str):
+        self.log_dir = log_dir
+
+    def replicas(self) -> List[str]:
+        """
+        Return the names of the replicas with log segments.
+
+        Returns:
+            List[str]: The replica (directory) names, sorted.
+        """
+        if not os.path.isdir(self.log_dir):
+            return []
+        return sorted(d for d in os.listdir(self.log_dir) if os.path.isdir(os.path.join(self.log_dir, d)))
+
+    def segments(self, replicas:Sequence[str] = None, since:datetime = None,
+                 until:datetime = None) -> List[dict]:
+        """
+        Return the segments that may hold records in a time range.
+
+        Args:
+            replicas (Sequence[str], optional): Only these replicas. Default is all.
+            since (datetime, optional): Start of the time range.
+            until (datetime, optional): End of the time range.
+
+        Returns:
+            List[dict]: One dict per segment, with the keys 'replica', 'path',
+                't_first', 't_last', 'n' and 'max_level' ('n' and 'max_level'
+                are None for segments still being written), newest first.
+        """
+        t_since = since.timestamp() if since is not None else float("-inf")
+        t_until = until.timestamp() if until is not None else float("inf")
+        segs = []
+        for replica in replicas or self.replicas():
+            replica_dir = os.path.join(self.log_dir, replica)
+            indexed = set()
+            for entry in _read_index(replica_dir):
+                indexed.add(entry['file'])
+                segs.append({'replica': replica, 'path': os.path.join(replica_dir, entry['file']),
+                             't_first': entry['t_first'], 't_last': entry['t_last'],
+                             'n': entry['n'], 'max_level': entry['max_level']})
+            # segments being written (or compressed, but not indexed yet): the time
+            # range is estimated from the file name and modification time
+            try:
+                fnames = os.listdir(replica_dir)
+            except FileNotFoundError:
+                continue
+            for fname in fnames:
+                if not fname.startswith(SEGMENT_PREFIX) or fname in indexed or fname + ".gz" in indexed:
+                    continue
+                if fname.endswith(".jsonl") and fname + ".gz" in fnames:
+                    continue
+                if not fname.endswith((".jsonl", ".jsonl.gz")):
+                    continue
+                path = os.path.join(replica_dir, fname)
+                try:
+                    t_last = os.path.getmtime(path) + _UNINDEXED_MARGIN_S
+                except OSError:
+                    continue
+                t_first = int(fname[len(SEGMENT_PREFIX):].split(".")[0]) / 1000 - _UNINDEXED_MARGIN_S
+                segs.append({'replica': replica, 'path': path, 't_first': t_first, 't_last': t_last,
+                             'n': None, 'max_level': None})
+        segs = [seg for seg in segs if seg['t_last'] >= t_since and seg['t_first'] <= t_until]
+        return sorted(segs, key=lambda seg: seg['t_last'], reverse=True)
+
+    def search(self, text:str = None, min_level:int = None, levels:Sequence[str] = None,
+               modules:Sequence[str] = None, since:datetime = None, until:datetime = None,
+               replicas:Sequence[str] = None, limit:int = 100, offset:int = 0) -> pd.DataFrame:
+        """
+        Return a page of the records matching the filters, newest first.
+
+        Args:
+            text (str, optional): Keep records whose message contains this (case-insensitive).
+            min_level (int, optional): Keep records at this level or above (e.g. logging.WARNING).
+            levels (Sequence[str], optional): Keep records with these level names.
+            modules (Sequence[str], optional): Keep records from these modules (logger names).
+            since (datetime, optional): Keep records created at or after this time.
+            until (datetime, optional): Keep records created at or before this time.
+            replicas (Sequence[str], optional): Keep records from these replicas.
+            limit (int): The page size. Default is 100.
+            offset (int): The number of (newer) records to skip. Default is 0.
+
+        Returns:
+            pd.DataFrame: With the columns 'timestamp', 'replica', 'level', 'module',
+                'func' and 'message'.
+        """
+        t_since = since.timestamp() if since is not None else float("-inf")
+        t_until = until.timestamp() if until is not None else float("inf")
+        level_nos = {logging.getLevelName(lv) for lv in levels} if levels is not None else None
+        modules = set(modules) if modules is not None else None
+        needle = text.lower() if text else None
+        # a match on the message is also a match on the raw line, unless json escaped it
+        raw_needle = needle if needle and not any(c in needle for c in '"\\') and needle.isprintable() else None
+
+        n_keep = offset + limit
+        best = [] # min-heap of (t, tie-breaker, replica, record): the newest n_keep matches
+        tie = 0
+        for seg in self.segments(replicas, since, until):
+            if len(best) == n_keep and seg['t_last'] < best[0][0]:
+                break # this and all later segments are older than what we have
+            if min_level is not None and seg['max_level'] is not None and seg['max_level'] < min_level:
+                continue
+            for line in _read_lines(seg['path']):
+                if raw_needle is not None and raw_needle not in line.lower():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError: # a line being written
+                    continue
+                t = rec['t']
+                if t < t_since or t > t_until:
+                    continue
+                if min_level is not None and rec['level'] < min_level:
+                    continue
+                if level_nos is not None and rec['level'] not in level_nos:
+                    continue
+                if modules is not None and rec['module'] not in modules:
+                    continue
+                if needle is not None and needle not in rec['msg'].lower():
+                    continue
+                tie += 1
+                item = (t, tie, seg['replica'], rec)
+                if len(best) < n_keep:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+        page = sorted(best, reverse=True)[offset:]
+        return pd.DataFrame({
+            # local time, as in the Log tab's in-memory records
+            'timestamp': pd.to_datetime(np.array([t for t, _, _, _ in page], dtype=float)
+                                        + time.localtime().tm_gmtoff, unit='s'),
+            'replica': [replica for _, _, replica, _ in page],
+            'level': _level_names(np.array([rec['level'] for _, _, _, rec in page], dtype=int)),
+            'module': [rec['module'] for _, _, _, rec in page],
+            'func': [rec['func'] for _, _, _, rec in page],
+            'message': [rec['msg'] for _, _, _, rec in page],
+        })
+
+    def tail(self, n:int = 100, **filters) -> pd.DataFrame:
+        """
+        Return the newest records (of all replicas).
+
+        Args:
+            n (int): The number of records. Default is 100.
+            **filters: As for `search`.
+
+        Returns:
+            pd.DataFrame: As for `search`.
+        """
+        return self.search(limit=n, **filters)
+
+    def stats(self) -> dict:
+        """
+        Report the segments on disk.
+
+        Returns:
+            dict: With the keys 'replicas', 'segments', 'bytes', 'oldest' and 'newest'.
+        """
+        segs = self.segments()
+        size = 0
+        for seg in segs:
+            try:
+                size += os.path.getsize(seg['path'])
+            except OSError:
+                pass
+        return {'replicas': len(self.replicas()), 'segments': len(segs), 'bytes': size,
+                'oldest': datetime.fromtimestamp(min(seg['t_first'] for seg in segs)) if segs else None,
+                'newest': datetime.fromtimestamp(max(seg['t_last'] for seg in segs)) if segs else None}
+
+
 # Set up logging to capture all info level logs from the root logger
 @st.cache_resource
-def setup_logging(level:int=logging.INFO, buffer_len:int=15) -> StreamlitLogHandler:
+def setup_logging(level:int=logging.INFO, buffer_len:int=None, queued:bool=None,
+                  log_dir:str=None) -> StreamlitLogHandler:
     """
     Set up logging for the application using Streamlit's container for log display.
 
     Args:
         level (int): The logging level (e.g., logging.INFO, logging.DEBUG). Default is logging.INFO.
-        buffer_len (int): The maximum number of log messages to display in the Streamlit container. Default is 15.
+        buffer_len (int): The number of log records kept. Default is `SW_LOG_BUFFER_LEN`, or 20000.
+        queued (bool): If True, the root logger gets a QueueLogHandler feeding the
+            StreamlitLogHandler from a background thread; otherwise the StreamlitLogHandler
+            is attached directly. Default is `SW_LOG_QUEUE` (1 or 0), or True.
+        log_dir (str): If set, the records are also kept on disk there, by a
+            LogSegmentSink. Default is `SW_LOG_DIR`, or None (not kept).
 
     Returns:
-        StreamlitLogHandler: The handler that has been added to the root logger.
+        StreamlitLogHandler: The handler that stores the records (its `queue`
+            is the QueueLogHandler, in queued mode, and its `sink` the
+            LogSegmentSink, if any).
     """
+    if buffer_len is None:
+        buffer_len = int(os.environ.get("SW_LOG_BUFFER_LEN", 20000))
+    if queued is None:
+        queued = os.environ.get("SW_LOG_QUEUE", "1") != "0"
+    if log_dir is None:
+        log_dir = os.environ.get("SW_LOG_DIR", None)
     root_logger = logging.getLogger() # Get the root logger
     log_container = st.container() # Create a container within which we display logs
     handler = StreamlitLogHandler(log_container, maxlen=buffer_len)
@@ -120,28 +938,49 @@ def setup_logging(level:int=logging.INFO, buffer_len:int=15) -> StreamlitLogHand
 
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(funcName)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
-    root_logger.addHandler(handler)
+    targets = [handler]
+    if log_dir:
+        handler.sink = LogSegmentSink(
+            log_dir, max_segment_bytes=int(float(os.environ.get("SW_LOG_SEGMENT_MB", 4)) * 2**20),
+            retention_s=float(os.environ.get("SW_LOG_RETENTION_DAYS", 7)) * 86400)
+        handler.sink.setLevel(level)
+        handler.sink.setFormatter(formatter)
+        targets.append(handler.sink)
+    if queued:
+        # the level is checked before queueing, so dropped-level records never reach the queue
+        handler.queue = QueueLogHandler(targets, capacity=int(os.environ.get("SW_LOG_QUEUE_SIZE", 10000)))
+        handler.queue.setLevel(level)
+        root_logger.addHandler(handler.queue)
+    else:
+        for target in targets:
+            root_logger.addHandler(target)
 
     #if 'handler' not in st.session_state:
     #    st.session_state['handler'] = handler
     return handler
 
-def parse_log_buffer(log_contents: deque) -> List[dict]:
+def parse_log_buffer(log_contents: deque | LogRingBuffer) -> List[dict]:
     """
     Convert log buffer to a list of dictionaries for use with a streamlit datatable.
 
+    A `LogRingBuffer` already holds the fields, so its records are returned
+    without any parsing; log lines (strings) are parsed with `log_pattern`.
+
     Args:
-        log_contents (deque): A deque containing log lines as strings.
+        log_contents (deque | LogRingBuffer): A deque containing log lines as strings,
+            or the ring buffer of a `StreamlitLogHandler`.
 
     Returns:
         list: A list of dictionaries, each representing a parsed log entry with the following keys:
             - 'timestamp' (datetime): The timestamp of the log entry.
-            - 'n' (str): The log entry number.
+            - 'n' (str): The log entry number (an int, from a LogRingBuffer).
             - 'level' (str): The log level (e.g., INFO, ERROR).
             - 'module' (str): The name of the module.
             - 'func' (str): The name of the function.
             - 'message' (str): The log message.
     """
+    if isinstance(log_contents, LogRingBuffer):
+        return log_contents.records(newest_first=False)
 
     j = 0
     records = []
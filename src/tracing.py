@@ -0,0 +1,332 @@
+from typing import Callable, Dict, Iterator, List, Tuple
+from collections import deque
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+'''
+Lightweight latency tracing for the observation workflow
+
+Code is timed with spans:
+
+    with sw_trace.span("image_decode"):
+        ...
+
+The duration of each span goes into an in-memory histogram (one per span name
+and labels), from which the Log tab shows counts and percentiles, and which
+can be exported in the Prometheus text format. Spans opened inside another
+span (on the same thread) are recorded as its children, so the last few
+traces (e.g. one per script rerun) can be shown as a tree.
+'''
+
+# histogram bucket upper bounds, in seconds (as the Prometheus client defaults, extended to 60s)
+BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# the span currently open in this thread (or asyncio task)
+_current_span = contextvars.ContextVar("sw_current_span", default=None)
+
+
+class Histogram:
+    """
+    Counts of durations in fixed buckets, with their sum and maximum
+
+    Attributes:
+        buckets (Tuple[float]): The bucket upper bounds, in seconds (+Inf is implied).
+        counts (List[int]): The number of values in each bucket (not cumulative),
+            the last one for values above the largest bound.
+        count (int): The number of values.
+        sum (float): Their sum, in seconds.
+        max (float): The largest value, in seconds.
+        errors (int): The number of spans that ended with an exception.
+    """
+    def __init__(self, buckets:Tuple[float] = BUCKETS_S):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, value:float, error:bool = False) -> None:
+        """
+        Add a duration.
+
+        Args:
+            value (float): The duration, in seconds.
+            error (bool): Whether the span ended with an exception. Default is False.
+        """
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.errors += bool(error)
+
+    def quantile(self, q:float) -> float:
+        """
+        Estimate a quantile, interpolating linearly within its bucket (as Prometheus does).
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, in seconds (at most the largest value seen), or
+                None if the histogram is empty.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Span:
+    """
+    A timed section of code
+
+    Attributes:
+        name (str): What is timed, e.g. 'image_decode'.
+        labels (Dict[str, str]): Extra dimensions, e.g. {'model': 'hotdog'}.
+        start (float): The start time (`time.perf_counter()`).
+        duration (float): The duration in seconds (None while open).
+        error (str): The exception type, if the span ended with one.
+        children (List[Span]): The spans opened inside this one, on the same thread.
+    """
+    __slots__ = ("name", "labels", "start", "duration", "error", "children")
+
+    def __init__(self, name:str, labels:Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.children = []
+
+    def __repr__(self):
+        return f"Span({self.name}, {self.labels}, {self.duration})"
+
+
+class Tracer:
+    """
+    Records spans into histograms, and keeps the most recent traces
+
+    Attributes:
+        buckets (Tuple[float]): The histogram bucket bounds, in seconds.
+        max_traces (int): The number of recent traces (top-level spans) kept.
+
+    Methods:
+        span(name, **labels):
+            A context manager timing the code inside it.
+        traced(name, **labels):
+            A decorator timing each call of a function.
+        observe(name, seconds, **labels):
+            Records a duration measured elsewhere.
+        stats():
+            Returns the count and percentiles of each span.
+        recent_traces(n):
+            Returns the latest traces, as rows of a tree.
+        export_prometheus():
+            Returns the histograms in the Prometheus text format.
+        write_prometheus(path):
+            Writes the export to a file (e.g. for a node exporter's textfile collector).
+        reset():
+            Forgets all recorded spans.
+    """
+    def __init__(self, buckets:Tuple[float] = BUCKETS_S, max_traces:int = 50):
+        self.buckets = tuple(buckets)
+        self.max_traces = max_traces
+        self._hists: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._traces = deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def observe(self, name:str, seconds:float, error:bool = False, **labels) -> None:
+        """
+        Record the duration of a span.
+
+        Args:
+            name (str): The span name.
+            seconds (float): The duration.
+            error (bool): Whether it ended with an exception. Default is False.
+            **labels: Extra dimensions (each combination gets its own histogram).
+        """
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist = self._hists.get(key)
+            if hist is None:
+                hist = self._hists[key] = Histogram(self.buckets)
+            hist.observe(seconds, error)
+
+    @contextlib.contextmanager
+    def span(self, name:str, **labels) -> Iterator[Span]:
+        """
+        Time the code inside the `with` block.
+
+        Args:
+            name (str): The span name.
+            **labels: Extra dimensions, e.g. `model="hotdog"`.
+
+        Yields:
+            Span: The open span.
+        """
+        span = Span(name, labels)
+        parent = _current_span.get()
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            # (streamlit's rerun and stop are BaseExceptions, and not errors)
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.start
+            _current_span.reset(token)
+            self.observe(name, span.duration, error=span.error is not None, **labels)
+            if parent is not None:
+                parent.children.append(span)
+            else:
+                self._traces.append(span)
+
+    def traced(self, name:str = None, **labels) -> Callable:
+        """
+        Decorate a function so that each call is timed as a span.
+
+        Args:
+            name (str, optional): The span name. Default is the function name.
+            **labels: Extra dimensions.
+
+        Returns:
+            Callable: The decorator.
+        """
+        def decorator(fn:Callable) -> Callable:
+            span_name = name or fn.__name__
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, **labels):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self) -> List[dict]:
+        """
+        Report each span's histogram.
+
+        Returns:
+            List[dict]: One dict per span name and labels, with the keys 'span',
+                'labels', 'count', 'errors', 'mean_ms', 'p50_ms', 'p95_ms',
+                'p99_ms' and 'max_ms' (the percentiles are estimated from the buckets).
+        """
+        def ms(seconds):
+            return round(seconds * 1e3, 2) if seconds is not None else None
+        rows = []
+        with self._lock:
+            for (name, labels), hist in sorted(self._hists.items()):
+                rows.append({'span': name, 'labels': ", ".join(f"{k}={v}" for k, v in labels),
+                             'count': hist.count, 'errors': hist.errors,
+                             'mean_ms': ms(hist.sum / hist.count), 'p50_ms': ms(hist.quantile(0.5)),
+                             'p95_ms': ms(hist.quantile(0.95)), 'p99_ms': ms(hist.quantile(0.99)),
+                             'max_ms': ms(hist.max)})
+        return rows
+
+    def recent_traces(self, n:int = 5) -> List[dict]:
+        """
+        Return the latest traces, flattened to rows (depth first).
+
+        Args:
+            n (int): The number of traces. Default is 5.
+
+        Returns:
+            List[dict]: One dict per span, with the keys 'trace' (0 for the
+                latest), 'span' (indented by depth), 'start_ms' (from the start
+                of the trace), 'duration_ms' and 'error'.
+        """
+        rows = []
+        traces = list(self._traces)[-n:][::-1]
+        for i, root in enumerate(traces):
+            stack = [(root, 0)]
+            while stack:
+                span, depth = stack.pop()
+                label = "".join(f" [{v}]" for v in span.labels.values())
+                rows.append({'trace': i, 'span': "· " * depth + span.name + label,
+                             'start_ms': round((span.start - root.start) * 1e3, 2),
+                             'duration_ms': round(span.duration * 1e3, 2), 'error': span.error})
+                stack.extend((child, depth + 1) for child in reversed(span.children))
+        return rows
+
+    def export_prometheus(self, prefix:str = "sw") -> str:
+        """
+        Export the histograms in the Prometheus text exposition format.
+
+        Args:
+            prefix (str): The metric name prefix. Default is 'sw'.
+
+        Returns:
+            str: The metrics `<prefix>_span_duration_seconds` (a histogram, with
+                a `span` label and the span's own labels) and
+                `<prefix>_span_errors_total`.
+        """
+        def fmt_labels(name, labels, **extra):
+            pairs = [("span", name), *labels, *extra.items()]
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        metric = f"{prefix}_span_duration_seconds"
+        lines = [f"# HELP {metric} Duration of traced spans.", f"# TYPE {metric} histogram"]
+        errors = [f"# HELP {prefix}_span_errors_total Traced spans that ended with an exception.",
+                  f"# TYPE {prefix}_span_errors_total counter"]
+        with self._lock:
+            for (name, labels), hist in sorted(self._hists.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), hist.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{metric}_bucket{fmt_labels(name, labels, le=le)} {cumulative}")
+                lines.append(f"{metric}_sum{fmt_labels(name, labels)} {hist.sum!r}")
+                lines.append(f"{metric}_count{fmt_labels(name, labels)} {hist.count}")
+                errors.append(f"{prefix}_span_errors_total{fmt_labels(name, labels)} {hist.errors}")
+        return "\n".join(lines + errors) + "\n"
+
+    def write_prometheus(self, path:str) -> None:
+        """
+        Write the Prometheus export to a file (replaced atomically).
+
+        Args:
+            path (str): The file, e.g. in the directory of a node exporter's
+                textfile collector (which reads `*.prom` files).
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.export_prometheus())
+        os.replace(tmp_path, path)
+
+    def reset(self) -> None:
+        """Forget all recorded spans and traces."""
+        with self._lock:
+            self._hists.clear()
+            self._traces.clear()
+
+
+def _escape(value:str) -> str:
+    '''escape a label value for the Prometheus text format'''
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# the tracer shared by all sessions in this process
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
@@ -0,0 +1,485 @@
+from typing import Any, Dict, List
+from collections import OrderedDict
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+import tracing as sw_trace
+
+m_logger = logging.getLogger(__name__)
+# we can set the log level locally for funcs in this module
+#g_m_logger.setLevel(logging.DEBUG)
+m_logger.setLevel(logging.INFO)
+
+# the dataset repo that observations are pushed to
+OBS_REPO_ID = "Saving-Willy/temp_dataset"
+# the subdirectory of the spool where records that cannot be uploaded are moved
+FAILED_DIR = "failed"
+
+
+class LocalHubApi:
+    """
+    A local stand-in for `huggingface_hub.HfApi`, for development and testing
+
+    Implements just `create_commit`, writing the files of each commit under
+    `root/<repo_type>s/<repo_id>/` and appending a line to `commits.jsonl`.
+    With `fail_rate` > 0, that fraction of commits raises, to exercise retries.
+
+    Args:
+        root (str): The directory standing in for the hub.
+        fail_rate (float): Fraction of commits that fail. Default is 0.
+        latency_s (float): Time each commit takes, to mimic the round trip. Default is 0.
+    """
+    def __init__(self, root:str, fail_rate:float = 0.0, latency_s:float = 0.0):
+        self.root = root
+        self.fail_rate = fail_rate
+        self.latency_s = latency_s
+        self.n_commits = 0
+        self._lock = threading.Lock()
+
+    def create_commit(self, repo_id:str, operations:list, commit_message:str,
+                      repo_type:str = "dataset", **kwargs) -> Any:
+        time.sleep(self.latency_s)
+        if random.random() < self.fail_rate:
+            raise ConnectionError("LocalHubApi: simulated failure")
+
+        repo_dir = os.path.join(self.root, f"{repo_type}s", repo_id)
+        with self._lock:
+            for op in operations:
+                dest = os.path.join(repo_dir, op.path_in_repo)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                content = op.path_or_fileobj
+                if isinstance(content, str):
+                    with open(content, "rb") as f:
+                        content = f.read()
+                with open(dest, "wb") as f:
+                    f.write(content)
+            self.n_commits += 1
+            oid = uuid.uuid4().hex
+            with open(os.path.join(repo_dir, "commits.jsonl"), "a") as f:
+                f.write(json.dumps({'oid': oid, 'message': commit_message,
+                                    'files': [op.path_in_repo for op in operations]}) + "\n")
+        return _LocalCommitInfo(oid, f"file://{repo_dir}#{oid}", commit_message)
+
+
+class _LocalCommitInfo:
+    '''the fields of `huggingface_hub.CommitInfo` that we use'''
+    def __init__(self, oid:str, commit_url:str, commit_message:str):
+        self.oid = oid
+        self.commit_url = commit_url
+        self.commit_message = commit_message
+
+    def __repr__(self):
+        return f"LocalCommitInfo(oid={self.oid}, commit_url={self.commit_url})"
+
+
+class BadRecord(ValueError):
+    '''a spooled record that can never be uploaded (unreadable, or missing fields)'''
+
+
+def _is_rejection(e:Exception) -> bool:
+    '''
+    whether the hub refused the content of a commit (400 / 422), rather than
+    failing to take it. Anything else (an expired token, a 5xx answer, a
+    connection error) is a problem of the hub or of the app, not of the items.
+    '''
+    status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in (400, 422)
+
+
+def _claim_spool_dir(root:str) -> str:
+    '''
+    the first `root/slot-<n>` that no other process holds, locked for the life
+    of this process. A restarted app gets the same slot back (and its spooled
+    items), while concurrent processes on the host each get their own.
+    '''
+    try:
+        import fcntl
+    except ImportError: # not on posix: one directory per process (no resume)
+        return os.path.join(root, f"pid-{os.getpid()}")
+    for n in range(1000):
+        slot_dir = os.path.join(root, f"slot-{n}")
+        os.makedirs(slot_dir, exist_ok=True)
+        lock_file = open(os.path.join(slot_dir, ".lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _slot_locks.append(lock_file) # released when the process exits
+        return slot_dir
+    raise RuntimeError(f"no free upload spool slot in {root}")
+
+_slot_locks = []
+
+
+class UploadQueue:
+    """
+    A durable queue of observations, pushed to the hub in batched commits
+
+    `enqueue` writes the observation to a spool directory on local disk and
+    returns at once. A background thread pushes the spooled files to the
+    dataset repo as one commit (with one file per observation) whenever
+    `batch_size` items are waiting or the oldest has waited `flush_interval_s`.
+    A failed commit is retried with exponential backoff, for as long as it
+    takes; items stay on disk until committed, so they also survive a
+    restart of the app (or an outage of the hub, or an expired token).
+
+    One bad item must not hold up the others: a record that cannot be read
+    is moved to the `failed/` subdirectory at once. After a commit the hub
+    rejects (400 / 422), the next one takes half as many items, so that the
+    item at fault ends up committed alone. An item rejected alone is then
+    skipped, and moved to `failed/` once another commit goes through (which
+    shows the hub takes commits, just not that item). Items in `failed/` are
+    put back in the queue at start and every `retry_failed_s`, or by
+    `retry_failed`.
+
+    The spool directory must not be shared between processes. By default
+    each process claims its own slot under `$TMP/sw_upload_spool`.
+
+    Attributes:
+        api (Any): The hub client (`HfApi`, or `LocalHubApi` for testing).
+        repo_id (str): The dataset repo to commit to.
+        spool_dir (str): Where queued observations are kept until committed.
+        batch_size (int): Commit as soon as this many items are waiting.
+        flush_interval_s (float): Commit items that have waited this long.
+        max_per_commit (int): The most items in one commit.
+        retry_failed_s (float): How often the items in `failed/` are put back in the
+            queue (None: only by `retry_failed`).
+
+    Methods:
+        enqueue(path_in_repo, content):
+            Spool an observation for upload, returns its id.
+        item_status(item_id):
+            Returns 'pending', 'committed', 'failed' or 'unknown'.
+        status():
+            Returns counts, last commit and last error.
+        retry_failed():
+            Put the items in `failed/` back in the queue.
+        flush():
+            Ask the worker to commit what is waiting now.
+        stop():
+            Stop the worker thread (spooled items are kept).
+    """
+    def __init__(self, api:Any, repo_id:str = OBS_REPO_ID, spool_dir:str = None,
+                 batch_size:int = 20, flush_interval_s:float = 30.0,
+                 max_per_commit:int = 100, backoff_s:float = 2.0, max_backoff_s:float = 300.0,
+                 retry_failed_s:float = 3600.0, max_committed_ids:int = 10000):
+        self.api = api
+        self.repo_id = repo_id
+        self.spool_dir = spool_dir or _claim_spool_dir(os.path.join(tempfile.gettempdir(), "sw_upload_spool"))
+        self.failed_dir = os.path.join(self.spool_dir, FAILED_DIR)
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.max_per_commit = max_per_commit
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.retry_failed_s = retry_failed_s
+        self.max_committed_ids = max_committed_ids
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+        self._cond = threading.Condition()
+        # item id -> commit oid, for `item_status` (the most recent only)
+        self._committed: "OrderedDict[str, str]" = OrderedDict()
+        self._n_committed = 0
+        self._commit_limit = max_per_commit # lowered after a rejected commit, to isolate a bad item
+        # items rejected alone (-> the error), skipped until another commit goes through
+        self._rejected: Dict[str, str] = {}
+        # the items in `failed/` are requeued at start (unless `retry_failed_s` is None)
+        self._t_retry_failed = 0.0 if retry_failed_s is not None else float("inf")
+        self._n_attempts_failed = 0
+        self._n_commits = 0
+        self._last_commit = None
+        self._last_error = None
+        self._retry_at = 0.0
+        self._flush_now = False
+        self._stop = False
+        self._worker = threading.Thread(target=self._run, name="sw-upload", daemon=True)
+        self._worker.start()
+        n_pending = len(self._pending())
+        if n_pending:
+            m_logger.info(f"upload queue resumed with {n_pending} spooled observations")
+
+    def _pending(self) -> List[str]:
+        '''spooled item ids, oldest first (the file names sort by enqueue time)'''
+        return sorted(f[:-len(".json")] for f in os.listdir(self.spool_dir) if f.endswith(".json"))
+
+    def _item_path(self, item_id:str) -> str:
+        return os.path.join(self.spool_dir, f"{item_id}.json")
+
+    def enqueue(self, path_in_repo:str, content:str) -> str:
+        """
+        Spool an observation for upload.
+
+        Args:
+            path_in_repo (str): Where the file goes in the dataset repo.
+            content (str): The file content (the observation, as json).
+
+        Returns:
+            str: An id for the item, to query with `item_status`.
+        """
+        item_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        record = json.dumps({'path_in_repo': path_in_repo, 'content': content,
+                             'enqueued_at': time.time()})
+        # write-then-rename, so the worker never sees a partial file
+        tmp_path = os.path.join(self.spool_dir, f".{item_id}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(record)
+        os.replace(tmp_path, self._item_path(item_id))
+        with self._cond:
+            self._cond.notify()
+        return item_id
+
+    def _due(self, pending:List[str]) -> bool:
+        '''whether the waiting items should be committed now'''
+        if not pending or time.time() < self._retry_at:
+            return False
+        if self._flush_now or len(pending) >= self.batch_size:
+            return True
+        if self._commit_limit < self.max_per_commit:
+            # still working through the items of a failed commit
+            return True
+        oldest_t = int(pending[0].split("-")[0]) / 1e9
+        return time.time() - oldest_t >= self.flush_interval_s
+
+    def _read(self, item_id:str) -> dict:
+        '''a spooled record, checked; raises BadRecord if it can never be uploaded'''
+        try:
+            with open(self._item_path(item_id)) as f:
+                record = json.load(f)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            raise BadRecord(f"unreadable: {e}") from e
+        if not isinstance(record, dict) or not isinstance(record.get('path_in_repo'), str) \
+                or not record['path_in_repo'] or not isinstance(record.get('content'), str):
+            raise BadRecord("expected 'path_in_repo' and 'content' strings")
+        return record
+
+    def _fail_item(self, item_id:str, reason:str) -> None:
+        '''move an item to the failed directory (kept, with the reason, for a later retry)'''
+        m_logger.error(f"observation upload {item_id} moved to {self.failed_dir}: {reason}")
+        try:
+            os.replace(self._item_path(item_id), os.path.join(self.failed_dir, f"{item_id}.json"))
+            with open(os.path.join(self.failed_dir, f"{item_id}.reason"), "w") as f:
+                f.write(reason)
+        except OSError as e:
+            m_logger.error(f"cannot move {item_id} to {self.failed_dir}: {e}")
+        self._rejected.pop(item_id, None)
+
+    def _next_batch(self) -> tuple:
+        '''the ids and records of the next commit; bad records are set aside on the way'''
+        batch, records = [], []
+        pending = self._pending()
+        # the items rejected alone are only tried again when nothing else is waiting
+        candidates = [i for i in pending if i not in self._rejected] or pending[:1]
+        for item_id in candidates:
+            if len(batch) >= self._commit_limit:
+                break
+            try:
+                records.append(self._read(item_id))
+            except BadRecord as e:
+                self._fail_item(item_id, str(e))
+                continue
+            batch.append(item_id)
+        return batch, records
+
+    def _run(self) -> None:
+        attempt = 0
+        while True:
+            if self.retry_failed_s is not None and time.time() >= self._t_retry_failed:
+                self._t_retry_failed = time.time() + self.retry_failed_s
+                self._requeue_failed()
+            with self._cond:
+                while not self._stop and not self._due(self._pending()) \
+                        and time.time() < self._t_retry_failed:
+                    # wake up for the next retry, if it is sooner than the next check
+                    to_retry = self._retry_at - time.time()
+                    self._cond.wait(timeout=min(1.0, to_retry) if to_retry > 0 else 1.0)
+                if self._stop:
+                    return
+                if not self._due(self._pending()):
+                    continue
+                self._flush_now = False
+            batch, records = self._next_batch()
+            if not batch:
+                continue
+            try:
+                oid = self._commit(records)
+            except Exception as e:
+                attempt += 1
+                rejected = _is_rejection(e)
+                delay = min(self.backoff_s * 2 ** (attempt - 1), self.max_backoff_s)
+                delay *= random.uniform(0.8, 1.2) # jitter, so replicas do not retry in step
+                m_logger.warning(f"upload of {len(batch)} observations failed (attempt {attempt}), "
+                                 f"retrying in {delay:.1f}s: {e}")
+                with self._cond:
+                    if rejected and len(batch) == 1:
+                        # set aside once another commit shows the hub takes commits
+                        self._rejected[batch[0]] = str(e)
+                    elif rejected:
+                        # a smaller commit next, to isolate the item the hub rejects
+                        self._commit_limit = max(1, len(batch) // 2)
+                    self._n_attempts_failed += 1
+                    self._last_error = f"{time.strftime('%H:%M:%S')} {e}"
+                    self._retry_at = time.time() + delay
+                continue
+
+            attempt = 0
+            for item_id in batch:
+                os.remove(self._item_path(item_id))
+            with self._cond:
+                for item_id in batch:
+                    self._committed[item_id] = oid
+                    self._rejected.pop(item_id, None)
+                while len(self._committed) > self.max_committed_ids:
+                    self._committed.popitem(last=False)
+                # the hub takes commits: the items it rejected alone are at fault
+                for item_id, error in list(self._rejected.items()):
+                    self._fail_item(item_id, f"rejected on its own while other commits succeed: {error}")
+                self._n_committed += len(batch)
+                # back to full commits once the items of a rejected commit are through
+                self._commit_limit = min(self.max_per_commit, self._commit_limit * 2)
+                if not self._pending():
+                    self._commit_limit = self.max_per_commit
+                self._n_commits += 1
+                self._last_commit = f"{time.strftime('%H:%M:%S')} {oid} ({len(batch)} files)"
+                self._retry_at = 0.0
+
+    def _commit(self, records:List[dict]) -> str:
+        '''push the spooled records as one commit, returns the commit oid'''
+        from huggingface_hub import CommitOperationAdd
+        operations = [CommitOperationAdd(path_in_repo=record['path_in_repo'],
+                                         path_or_fileobj=record['content'].encode())
+                      for record in records]
+        with sw_trace.span("hub_upload"):
+            rv = self.api.create_commit(repo_id=self.repo_id, repo_type="dataset",
+                                        operations=operations,
+                                        commit_message=f"Add {len(operations)} observations")
+        m_logger.info(f"uploaded {len(operations)} observations in one commit: {rv}")
+        return rv.oid
+
+    def item_status(self, item_id:str) -> str:
+        """
+        Return the state of an enqueued item.
+
+        Args:
+            item_id (str): As returned by `enqueue`.
+
+        Returns:
+            str: 'committed', 'pending', 'failed' (moved to `failed/`) or
+                'unknown' (e.g. committed long ago, or by an earlier process).
+        """
+        with self._cond:
+            if item_id in self._committed:
+                return 'committed'
+        if os.path.exists(self._item_path(item_id)):
+            return 'pending'
+        if os.path.exists(os.path.join(self.failed_dir, f"{item_id}.json")):
+            return 'failed'
+        return 'unknown'
+
+    def status(self) -> dict:
+        """
+        Report the state of the queue, without blocking on the upload.
+
+        Returns:
+            dict: With the keys 'pending', 'committed', 'commits', 'failed_items',
+                'failed_attempts', 'last_commit', 'last_error' and 'retry_in_s'.
+        """
+        with self._cond:
+            return {
+                'pending': len(self._pending()),
+                'committed': self._n_committed,
+                'commits': self._n_commits,
+                'failed_items': len([f for f in os.listdir(self.failed_dir) if f.endswith(".json")]),
+                'failed_attempts': self._n_attempts_failed,
+                'last_commit': self._last_commit,
+                'last_error': self._last_error,
+                'retry_in_s': round(max(0.0, self._retry_at - time.time()), 1),
+            }
+
+    def _requeue_failed(self) -> int:
+        '''move the items in the failed directory back to the spool, returns how many'''
+        n = 0
+        try:
+            fnames = sorted(os.listdir(self.failed_dir))
+        except OSError as e:
+            m_logger.error(f"cannot list {self.failed_dir}: {e}")
+            return 0
+        for fname in fnames:
+            try:
+                if fname.endswith(".json"):
+                    os.replace(os.path.join(self.failed_dir, fname), os.path.join(self.spool_dir, fname))
+                    n += 1
+                elif fname.endswith(".reason"):
+                    os.remove(os.path.join(self.failed_dir, fname))
+            except OSError as e:
+                m_logger.error(f"cannot requeue {fname}: {e}")
+        if n:
+            m_logger.info(f"requeued {n} observations from {self.failed_dir}")
+        return n
+
+    def retry_failed(self) -> int:
+        """
+        Put the items in the failed directory back in the queue now.
+
+        Returns:
+            int: The number of items requeued.
+        """
+        n = self._requeue_failed()
+        if n:
+            self.flush()
+        return n
+
+    def flush(self) -> None:
+        """Ask the worker to commit the waiting items now (ignoring any backoff)."""
+        with self._cond:
+            self._flush_now = True
+            self._retry_at = 0.0
+            self._cond.notify()
+
+    def stop(self) -> None:
+        """Stop the worker thread. Spooled items stay on disk for the next start."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._worker.join()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue() -> UploadQueue:
+    """
+    Return the process-wide upload queue, creating it on first use.
+
+    The hub client is `HfApi` with the token from `HF_TOKEN`, unless
+    `SW_HUB_LOCAL_DIR` is set, in which case commits go to that local
+    directory instead (see `LocalHubApi`). The spool directory is set by
+    `SW_UPLOAD_SPOOL_DIR` (by default, a slot of this process under the temp
+    directory); batching by `SW_UPLOAD_BATCH_SIZE` (default 20)
+    and `SW_UPLOAD_FLUSH_S` (default 30); how often failed items are
+    retried by `SW_UPLOAD_RETRY_FAILED_S` (default 3600).
+
+    Returns:
+        UploadQueue: The queue shared by all sessions.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            local_dir = os.environ.get("SW_HUB_LOCAL_DIR", None)
+            if local_dir:
+                api = LocalHubApi(local_dir)
+            else:
+                from huggingface_hub import HfApi
+                api = HfApi(token=os.environ.get("HF_TOKEN", None))
+            _queue = UploadQueue(
+                api, spool_dir=os.environ.get("SW_UPLOAD_SPOOL_DIR", None),
+                batch_size=int(os.environ.get("SW_UPLOAD_BATCH_SIZE", 20)),
+                flush_interval_s=float(os.environ.get("SW_UPLOAD_FLUSH_S", 30)),
+                retry_failed_s=float(os.environ.get("SW_UPLOAD_RETRY_FAILED_S", 3600)))
+        return _queue
@@ -1,8 +1,12 @@
 from itertools import cycle
+import html
+import math
+
+import pandas as pd
 import streamlit as st
 
+import ref_assets as sw_assets
 import whale_viewer as sw_wv
-import os
 
 def render_whale_gallery(n_cols:int = 4) -> None:
     """
@@ -62,20 +66,18 @@ def render_whale_gallery(n_cols:int = 4) -> None:
     
     cols = cycle(st.columns(n_cols)) 
     for ix in range(len(sw_wv.df_whale_img_ref)):
-        img_name = sw_wv.df_whale_img_ref.iloc[ix].loc["WHALE_IMAGES"]
-        whale_name = _format_whale_name(str(sw_wv.df_whale_img_ref.iloc[ix].name))
+        whale_class = str(sw_wv.df_whale_img_ref.iloc[ix].name)
+        whale_name = _format_whale_name(whale_class)
         url = sw_wv.df_whale_img_ref.iloc[ix].loc['WHALE_REFERENCES']
-        # Define image paths
-        current_dir = os.getcwd()
-        image_path = os.path.join(current_dir, "src/images/references/", img_name)
-        #image_path = f"images/references/{img_name}"
+        # the pre-sized thumbnail, from the in-memory asset cache
+        asset = sw_assets.assets.get(whale_class, 'gallery')
         #next(cols).image(image_path, width=150, caption=f"{whale_name}")
         thing = next(cols)
         with thing:
             with st.container(border=True):
                 # using the caption for name is most compact but no link.
                 #st.image(image_path, width=150, caption=f"{whale_name}")
-                st.image(image_path, width=150)
+                st.image(asset.data, width=150)
                 #st.markdown(f"[{whale_name}]({url})" ) # doesn't seem to allow styling, just do in raw html:w
                 html = f"<div style='text-align: center; font-size: 14px'><a href='{url}'>{whale_name}</a></div>"
                 st.markdown(html, unsafe_allow_html=True)
@@ -83,7 +85,100 @@ def render_whale_gallery(n_cols:int = 4) -> None:
 
         #next(cols).image(image_path, width=150, caption=f"{whale_name}")
 
-    
+
+
+def filter_catalogue(query:str = "") -> pd.DataFrame:
+    """
+    Select the species whose name (or reference url) contains the query.
+
+    Args:
+        query (str): The search text, case insensitive. Empty matches all.
+
+    Returns:
+        pd.DataFrame: The matching rows of `whale_viewer.df_whale_img_ref`.
+    """
+    df = sw_wv.df_whale_img_ref
+    query = (query or "").strip().lower()
+    if not query:
+        return df
+    names = df.index.to_series().str.replace("_", " ").str.lower()
+    mask = (names.str.contains(query, regex=False)
+            | df.index.str.lower().str.contains(query, regex=False)
+            | df['WHALE_REFERENCES'].str.lower().str.contains(query, regex=False))
+    return df[mask.to_numpy()]
+
+
+# one grid for the cards of a page; images are only fetched when scrolled into view
+_GRID_CSS = """
+<style>
+    .sw-grid { display: grid; grid-template-columns: repeat(auto-fill, minmax(180px, 1fr));
+               gap: 1em; justify-items: center; }
+    .sw-card { width: 180px; text-align: center; font-size: 14px; }
+    .sw-card img { width: 150px; height: auto; }
+</style>
+"""
+
+
+def _cards_html(df:pd.DataFrame, urls:dict) -> str:
+    '''the html for a page of cards, with lazily loaded images served statically'''
+    cards = []
+    for whale_class, row in df.iterrows():
+        asset = sw_assets.assets.get(whale_class, 'gallery')
+        height = round(150 * asset.height / asset.width)
+        name = html.escape(sw_wv.format_whale_name(whale_class))
+        url = html.escape(row['WHALE_REFERENCES'], quote=True)
+        cards.append(
+            f"<div class='sw-card'><img src='{urls[whale_class]}' loading='lazy' decoding='async' "
+            f"width='150' height='{height}' alt='{name}'>"
+            f"<div><a href='{url}'>{name}</a></div></div>")
+    return _GRID_CSS + "<div class='sw-grid'>" + "".join(cards) + "</div>"
+
+
+def render_whale_gallery_paged(n_cols:int = 4, page_size:int = 12, key:str = "swgallery") -> None:
+    """
+    Renders a searchable, paginated gallery of whale images + urls.
+
+    Only the cards of the current page are rendered. When streamlit serves
+    static files (`server.enableStaticServing`), a page is one html block
+    whose images are loaded lazily by the browser, from urls that include
+    a content hash (so they are cached). Otherwise, each card of the page
+    is an `st.image` of the cached thumbnail.
+
+    Parameters:
+        n_cols (int): Number of columns, when not using static serving. Default is 4.
+        page_size (int): Number of cards per page. Default is 12.
+        key (str): Prefix of the widget keys. Default is "swgallery".
+    """
+    query = st.text_input("Search species", key=f"{key}_query", placeholder="e.g. dolphin")
+    df = filter_catalogue(query)
+    n_pages = max(1, math.ceil(len(df) / page_size))
+    # a narrower search can leave the page number out of range
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = 1
+
+    c1, c2 = st.columns([1, 3])
+    page = c1.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key)
+    c2.caption(f"{len(df)} species, page {page} of {n_pages}")
+    df_page = df.iloc[(page - 1) * page_size:page * page_size]
+
+    urls = sw_assets.assets.static_urls('gallery')
+    if urls is not None:
+        st.markdown(_cards_html(df_page, urls), unsafe_allow_html=True)
+        return
+
+    cols = cycle(st.columns(n_cols))
+    for whale_class, row in df_page.iterrows():
+        asset = sw_assets.assets.get(whale_class, 'gallery')
+        with next(cols):
+            with st.container(border=True):
+                st.image(asset.data, width=150)
+                name = html.escape(sw_wv.format_whale_name(whale_class))
+                url = html.escape(row['WHALE_REFERENCES'], quote=True)
+                st.markdown(f"<div style='text-align: center; font-size: 14px'>"
+                            f"<a href='{url}'>{name}</a></div>", unsafe_allow_html=True)
+
+
 if __name__ == "__main__":
     ''' example usage, with some other elements to help illustrate how 
     streamlit keys can be used to target specific css properties 
@@ -1,8 +1,6 @@
 from typing import List
 
-from PIL import Image
 import pandas as pd
-import os
 
 WHALE_CLASSES = [
         "beluga",
@@ -135,6 +133,7 @@ def display_whale(whale_classes:List[str], i:int, viewcontainer=None):
     we want the result of the generator.. In any case, it works ok with either call signature.
     """
     import streamlit as st
+    import ref_assets as sw_assets # (imports this module, so not at the top)
     if viewcontainer is None:
         viewcontainer = st
 
@@ -150,9 +149,8 @@ def display_whale(whale_classes:List[str], i:int, viewcontainer=None):
     viewcontainer.markdown(
         "### :whale:  #" + str(i + 1) + ": " + format_whale_name(whale_classes[i])
     )
-    current_dir = os.getcwd()
-    image_path = os.path.join(current_dir, "src/images/references/")
-    image = Image.open(image_path + df_whale_img_ref.loc[whale_classes[i], "WHALE_IMAGES"])
+    # the pre-sized image, from the in-memory asset cache
+    asset = sw_assets.assets.get(whale_classes[i], 'viewer')
 
-    viewcontainer.image(image, caption=df_whale_img_ref.loc[whale_classes[i], "WHALE_REFERENCES"])
+    viewcontainer.image(asset.data, caption=df_whale_img_ref.loc[whale_classes[i], "WHALE_REFERENCES"])
     # link st.markdown(f"[{df.loc[whale_classes[i], 'WHALE_REFERENCES']}]({df.loc[whale_classes[i], 'WHALE_REFERENCES']})")
\ No newline at end of file
@@ -0,0 +1,168 @@
+import struct
+import zlib
+
+import pytest
+
+import exif_meta as sw_exif
+
+# TIFF field types: ascii, short, long, rational
+ASCII, SHORT, LONG, RATIONAL = 2, 3, 4, 5
+
+
+def _encode(ftype:int, value, bo:str) -> bytes:
+    if ftype == ASCII:
+        return value.encode("ascii") + b"\x00"
+    if ftype == SHORT:
+        return struct.pack(bo + "H" * len(value), *value)
+    if ftype == LONG:
+        return struct.pack(bo + "I" * len(value), *value)
+    # rationals: (numerator, denominator) pairs
+    return b"".join(struct.pack(bo + "II", *pair) for pair in value)
+
+
+def _count(ftype:int, value) -> int:
+    return len(value) + 1 if ftype == ASCII else len(value)
+
+
+def make_tiff(ifd0:dict, exif:dict = None, gps:dict = None, bo:str = "<") -> bytes:
+    """
+    A TIFF block with IFD0 and optional Exif and GPS sub-IFDs.
+
+    Each IFD is {tag: (type, value)}; values longer than 4 bytes are stored
+    right after their IFD, at an offset.
+    """
+    ifds = [dict(ifd0)]
+    if exif is not None:
+        ifds[0][sw_exif.TAG_EXIF_IFD] = (LONG, "exif")
+        ifds.append(exif)
+    if gps is not None:
+        ifds[0][sw_exif.TAG_GPS_IFD] = (LONG, "gps")
+        ifds.append(gps)
+
+    def block_size(ifd:dict) -> int:
+        raws = [_encode(t, v, bo) for t, v in ifd.values() if not isinstance(v, str) or t == ASCII]
+        return 2 + 12 * len(ifd) + 4 + sum(len(r) for r in raws if len(r) > 4)
+
+    offsets = [8]
+    for ifd in ifds[:-1]:
+        offsets.append(offsets[-1] + block_size(ifd))
+    pointers = dict(zip(["ifd0"] + (["exif"] if exif is not None else []) + (["gps"] if gps is not None else []),
+                        offsets))
+
+    out = (b"II" if bo == "<" else b"MM") + struct.pack(bo + "HI", 42, 8)
+    for ifd, offset in zip(ifds, offsets):
+        entries, data = b"", b""
+        data_pos = offset + 2 + 12 * len(ifd) + 4
+        for tag, (ftype, value) in sorted(ifd.items()):
+            if isinstance(value, str) and ftype != ASCII: # a sub-IFD pointer
+                value = (pointers[value],)
+            raw = _encode(ftype, value, bo)
+            if len(raw) <= 4:
+                field = raw.ljust(4, b"\x00")
+            else:
+                field = struct.pack(bo + "I", data_pos + len(data))
+                data += raw
+            entries += struct.pack(bo + "HHI", tag, ftype, _count(ftype, value)) + field
+        out += struct.pack(bo + "H", len(ifd)) + entries + b"\x00" * 4 + data
+    return out
+
+
+def make_jpeg(tiff:bytes) -> bytes:
+    '''a JPEG (headers only) with the TIFF block in an APP1 segment'''
+    app1 = b"Exif\x00\x00" + tiff
+    sof = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, 480, 640, 1) + b"\x01\x11\x00"
+    return b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + sof + b"\xff\xda\x00\x02\xff\xd9"
+
+
+def make_png(tiff:bytes) -> bytes:
+    chunk = struct.pack(">I", len(tiff)) + b"eXIf" + tiff + struct.pack(">I", zlib.crc32(b"eXIf" + tiff))
+    return b"\x89PNG\r\n\x1a\n" + chunk + struct.pack(">I", 0) + b"IEND" + b"\x00" * 4
+
+
+def make_webp(tiff:bytes) -> bytes:
+    chunk = b"EXIF" + struct.pack("<I", len(tiff)) + tiff + b"\x00" * (len(tiff) & 1)
+    return b"RIFF" + struct.pack("<I", 4 + len(chunk)) + b"WEBP" + chunk
+
+
+DMS_LAT = ((46, 1), (31, 1), (697, 100)) # 46° 31' 6.97"
+DMS_LON = ((6, 1), (37, 1), (3006, 100))
+GPS = {sw_exif.TAG_GPS_LATITUDE_REF: (ASCII, "N"), sw_exif.TAG_GPS_LATITUDE: (RATIONAL, DMS_LAT),
+       sw_exif.TAG_GPS_LONGITUDE_REF: (ASCII, "W"), sw_exif.TAG_GPS_LONGITUDE: (RATIONAL, DMS_LON)}
+EXIF = {sw_exif.TAG_DATETIME_ORIGINAL: (ASCII, "2024:10:24 15:59:45")}
+IFD0 = {sw_exif.TAG_DATETIME: (ASCII, "2024:01:01 00:00:00")}
+
+
+@pytest.mark.parametrize("bo", ["<", ">"])
+@pytest.mark.parametrize("container", [make_jpeg, make_png, make_webp])
+def test_reads_datetime_and_position(container, bo):
+    dt, lat, lon = sw_exif.read_exif(container(make_tiff(IFD0, EXIF, GPS, bo=bo)))
+    assert dt == "2024:10:24 15:59:45"
+    assert lat == pytest.approx(46 + 31 / 60 + 6.97 / 3600)
+    assert lon == pytest.approx(-(6 + 37 / 60 + 30.06 / 3600))
+
+
+def test_no_exif():
+    assert sw_exif.read_exif(b"\xff\xd8\xff\xda\x00\x02\xff\xd9") == (None, None, None)
+    assert sw_exif.read_exif(b"not an image") == (None, None, None)
+
+
+def test_falls_back_to_ifd0_datetime():
+    assert sw_exif.read_exif(make_jpeg(make_tiff(IFD0)))[0] == "2024:01:01 00:00:00"
+
+
+def test_unset_clock_is_no_datetime():
+    zeros = {sw_exif.TAG_DATETIME_ORIGINAL: (ASCII, "0000:00:00 00:00:00")}
+    ifd0 = {sw_exif.TAG_DATETIME: (ASCII, "0000:00:00 00:00:00")}
+    assert sw_exif.read_exif(make_jpeg(make_tiff(ifd0, zeros)))[0] is None
+    # an invalid original date-time falls back to a valid IFD0 one
+    assert sw_exif.read_exif(make_jpeg(make_tiff(IFD0, zeros)))[0] == "2024:01:01 00:00:00"
+
+
+def test_datetime_of_the_wrong_type_is_ignored():
+    ifd0 = {sw_exif.TAG_DATETIME: (SHORT, (2024, 1))}
+    assert sw_exif.read_exif(make_jpeg(make_tiff(ifd0))) == (None, None, None)
+
+
+def test_gps_ref_of_the_wrong_type_is_no_position():
+    gps = dict(GPS)
+    gps[sw_exif.TAG_GPS_LATITUDE_REF] = (SHORT, (78,)) # 'N' as a number
+    dt, lat, lon = sw_exif.read_exif(make_jpeg(make_tiff(IFD0, EXIF, gps)))
+    assert dt == "2024:10:24 15:59:45"
+    assert (lat, lon) == (None, None)
+
+
+def test_gps_coordinates_of_the_wrong_type_are_no_position():
+    gps = dict(GPS)
+    gps[sw_exif.TAG_GPS_LONGITUDE] = (ASCII, "6 37 30")
+    assert sw_exif.read_exif(make_jpeg(make_tiff(IFD0, EXIF, gps)))[1:] == (None, None)
+
+
+def test_gps_zero_denominator_or_out_of_range_is_no_position():
+    gps = dict(GPS)
+    gps[sw_exif.TAG_GPS_LATITUDE] = (RATIONAL, ((46, 0), (31, 1), (0, 1)))
+    assert sw_exif.read_exif(make_jpeg(make_tiff(IFD0, EXIF, gps)))[1:] == (None, None)
+    gps[sw_exif.TAG_GPS_LATITUDE] = (RATIONAL, ((95, 1), (0, 1), (0, 1)))
+    assert sw_exif.read_exif(make_jpeg(make_tiff(IFD0, EXIF, gps)))[1:] == (None, None)
+
+
+def test_missing_ref_defaults_to_north_east():
+    gps = {k: v for k, v in GPS.items()
+           if k not in (sw_exif.TAG_GPS_LATITUDE_REF, sw_exif.TAG_GPS_LONGITUDE_REF)}
+    _, lat, lon = sw_exif.read_exif(make_jpeg(make_tiff(IFD0, EXIF, gps)))
+    assert lat > 0 and lon > 0
+
+
+def test_truncated_block_raises_value_error():
+    tiff = make_tiff(IFD0, EXIF, GPS)
+    with pytest.raises(ValueError):
+        sw_exif.read_exif(make_jpeg(tiff[:40]))
+
+
+def test_bad_tiff_header_raises_value_error():
+    with pytest.raises(ValueError):
+        sw_exif.read_exif(make_jpeg(b"XX" + make_tiff(IFD0)[2:]))
+
+
+def test_jpeg_size():
+    assert sw_exif.jpeg_size(make_jpeg(make_tiff(IFD0))) == (640, 480)
+    assert sw_exif.jpeg_size(b"\x89PNG\r\n\x1a\n") is None
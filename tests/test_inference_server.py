@@ -0,0 +1,116 @@
+from concurrent.futures import TimeoutError
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import inference_server as sw_infer
+
+
+@pytest.fixture
+def make_server():
+    servers = []
+    def _make(batch_fn, **kwargs):
+        srv = sw_infer.BatchingInferenceServer(batch_fn, **kwargs)
+        servers.append(srv)
+        return srv
+    yield _make
+    for srv in servers:
+        srv.stop()
+
+
+def test_results_go_to_their_request(make_server):
+    srv = make_server(lambda images: [{'predictions': [i]} for i in images], max_wait_ms=50)
+    futures = [srv.submit(i) for i in range(5)]
+    assert [f.result(timeout=5) for f in futures] == [{'predictions': [i]} for i in range(5)]
+    assert srv.stats()['n_done'] == 5
+
+
+def test_missing_results_fail_the_whole_batch(make_server):
+    srv = make_server(lambda images: [{'predictions': []}] * (len(images) - 1), max_wait_ms=50)
+    futures = [srv.submit(i) for i in range(3)]
+    for f in futures:
+        with pytest.raises(RuntimeError, match="2 results for 3 images"):
+            f.result(timeout=5)
+    assert srv.stats()['n_failed'] == 3
+
+
+def test_predict_times_out(make_server):
+    release = threading.Event()
+    def stuck(images):
+        release.wait(5)
+        return [{}] * len(images)
+    srv = make_server(stuck)
+    with pytest.raises(TimeoutError):
+        srv.predict("image", timeout=0.1)
+    release.set()
+
+
+SPECIES = ['beluga', 'blue_whale', 'fin_whale', 'gray_whale', 'humpback_whale']
+
+
+class FakeModel:
+    '''a per-image classifier: species ranked by the distance of their index to the image'''
+    def __init__(self):
+        self.n_calls = 0
+
+    def __call__(self, image):
+        self.n_calls += 1
+        return {'predictions': sorted(SPECIES, key=lambda s: abs(SPECIES.index(s) - image))[:3]}
+
+
+def test_batch_fn_that_matches_the_model_is_kept():
+    model = FakeModel()
+    batch_fn = sw_infer.check_against_model(lambda images: [model(i) for i in images], model)
+    assert batch_fn([0, 4]) == [model(0), model(4)]
+    model.n_calls = 0
+    batch_fn([1, 2])
+    assert model.n_calls == 2 # by the batch function only, no more checking
+
+
+def test_batch_fn_that_differs_from_the_model_is_dropped(caplog):
+    model = FakeModel()
+    n_batched = []
+    def wrong(images):
+        n_batched.append(len(images))
+        return [{'predictions': list(reversed(model(i)['predictions']))} for i in images]
+    batch_fn = sw_infer.check_against_model(wrong, model)
+    assert batch_fn([0, 4]) == [model(0), model(4)]
+    assert "does not match the model" in caplog.text
+    assert batch_fn([2]) == [model(2)]
+    assert n_batched == [2]
+
+
+def test_rebuilt_batched_call_is_checked_against_the_wrapper():
+    torch = pytest.importorskip("torch")
+
+    class Net(torch.nn.Module):
+        '''returns (individual id logits, species logits), like the classifier's module'''
+        def forward(self, x):
+            species = -(torch.arange(len(SPECIES)).float() - x.mean(dim=(1, 2, 3))[:, None]).abs()
+            return torch.zeros(x.shape[0], 2), species
+
+    class Wrapper:
+        '''the structure of the remote-code wrapper: preprocess_image, model, config, __call__'''
+        def __init__(self, order):
+            self.model = Net().eval()
+            self.config = SimpleNamespace(id2species={str(i): s for i, s in enumerate(SPECIES)})
+            self.order = order
+
+        def preprocess_image(self, image):
+            return torch.full((1, 3, 4, 4), float(image))
+
+        def __call__(self, image):
+            logits = self.model(self.preprocess_image(image))[-1][0]
+            return {'predictions': [SPECIES[i] for i in torch.argsort(self.order * logits)[:3]]}
+
+    matching = Wrapper(order=-1) # ranks by descending logit, as the batched call does
+    batch_fn = sw_infer.make_batch_fn(matching)
+    assert batch_fn([0, 3]) == [matching(0), matching(3)]
+    assert batch_fn([1]) == [matching(1)]
+
+    # a wrapper whose __call__ is not what the batched call rebuilds
+    different = Wrapper(order=1)
+    batch_fn = sw_infer.make_batch_fn(different)
+    assert batch_fn([0, 3]) == [different(0), different(3)]
+    assert batch_fn([1]) == [different(1)]
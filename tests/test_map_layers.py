@@ -0,0 +1,37 @@
+import json
+import re
+
+import pytest
+
+folium = pytest.importorskip("folium")
+
+import map_layers as sw_layers
+
+
+def geojson_of(species:str) -> str:
+    props = json.dumps({'species': species, 'color': "red"})
+    return ('{"type":"FeatureCollection","features":[{"type":"Feature","geometry":'
+            '{"type":"Point","coordinates":[6.5,46.5]},"properties":' + props + '}]}')
+
+
+def test_layer_script_is_rendered():
+    map_ = folium.Map(location=[46.5, 6.5], zoom_start=5)
+    layer = sw_layers.ObsGeoJsonLayer(geojson_of("humpback_whale"), radius=6)
+    layer.add_to(map_)
+    html = map_.get_root().render()
+    assert f"var {layer.get_name()} = L.geoJSON(" in html
+    assert f".addTo({map_.get_name()});" in html
+    assert "var radius = 6;" in html
+    assert "humpback_whale" in html
+
+
+def test_script_end_in_properties_is_escaped():
+    species = "</script><script>alert(1)</script>"
+    map_ = folium.Map(location=[46.5, 6.5], zoom_start=5)
+    layer = sw_layers.ObsGeoJsonLayer(geojson_of(species))
+    layer.add_to(map_)
+    html = map_.get_root().render()
+    assert "alert(1)</script>" not in html
+    # the literal in the page is still the same json
+    m = re.search(r"L\.geoJSON\((\{.*?\}\]\})", html)
+    assert json.loads(m.group(1))['features'][0]['properties']['species'] == species
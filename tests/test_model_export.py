@@ -0,0 +1,45 @@
+import numpy as np
+
+import model_export as sw_export
+
+
+class FakeWrapper:
+    '''the classifier's per-image call: the species ranked by the mean of the image'''
+    species = ['beluga', 'blue_whale', 'fin_whale', 'gray_whale']
+
+    def __call__(self, image):
+        level = image.mean() / 255 * (len(self.species) - 1)
+        return {'predictions': sorted(self.species, key=lambda s: abs(self.species.index(s) - level))[:3]}
+
+
+class FakeExport:
+    def __init__(self, wrapper, wrong_from:float = None):
+        self.wrapper = wrapper
+        self.wrong_from = wrong_from
+
+    def predict_batch(self, images):
+        outs = [self.wrapper(img) for img in images]
+        if self.wrong_from is not None:
+            outs = [{'predictions': list(reversed(out['predictions']))} if img.mean() >= self.wrong_from else out
+                    for img, out in zip(images, outs)]
+        return outs
+
+
+def test_wrapper_agreement():
+    wrapper = FakeWrapper()
+    images = [np.full((4, 4, 3), v, dtype=np.uint8) for v in (0, 100, 200, 255)]
+    assert sw_export.wrapper_agreement(wrapper, FakeExport(wrapper), images) == \
+        {'top1': 1.0, 'top3': 1.0, 'n_images': 4}
+    # the same top-3 set, in another order, from the third image on
+    assert sw_export.wrapper_agreement(wrapper, FakeExport(wrapper, wrong_from=150), images) == \
+        {'top1': 0.5, 'top3': 1.0, 'n_images': 4}
+
+
+def test_preprocess_follows_the_manifest():
+    pre = {'size': [2, 3], 'interpolation': 'nearest', 'channels': [2, 1, 0],
+           'scale': [1 / 255] * 3, 'offset': [0.0, -1.0, 0.5]}
+    image = np.zeros((4, 6, 3), dtype=np.uint8)
+    image[..., 0] = 255
+    x = sw_export.preprocess(image, pre)
+    assert x.shape == (3, 2, 3)
+    np.testing.assert_allclose(x[:, 0, 0], [0.0, -1.0, 1.5])
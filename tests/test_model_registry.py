@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import pytest
+
+import model_registry as sw_models
+
+COMMIT = "0f9c15e2db4d64e7f622ade518854b488d8d35e6"
+
+
+@pytest.fixture(autouse=True)
+def no_store(monkeypatch):
+    monkeypatch.delenv("SW_MODEL_STORE", raising=False)
+
+
+@pytest.fixture
+def offline_hub(monkeypatch):
+    huggingface_hub = pytest.importorskip("huggingface_hub")
+    def model_info(self, *args, **kwargs):
+        raise ConnectionError("offline")
+    monkeypatch.setattr(huggingface_hub.HfApi, "model_info", model_info)
+
+
+def test_commit_from_the_loaded_config():
+    model = SimpleNamespace(config=SimpleNamespace(_commit_hash=COMMIT))
+    assert sw_models.resolved_commit(model, "org/model", "main") == COMMIT
+    # a pipeline holds the model (and its config) in .model
+    pipeline = SimpleNamespace(model=model)
+    assert sw_models.resolved_commit(pipeline, "org/model", "main") == COMMIT
+
+
+def test_commit_set_by_the_loader_comes_first():
+    model = SimpleNamespace(resolved_commit="abc", config=SimpleNamespace(_commit_hash=COMMIT))
+    assert sw_models.resolved_commit(model, "org/model", "main") == "abc"
+
+
+def test_commit_given_as_the_revision(offline_hub):
+    assert sw_models.resolved_commit(object(), "org/model", COMMIT) == COMMIT
+
+
+def test_unresolvable_revision_is_kept(offline_hub, caplog):
+    assert sw_models.resolved_commit(object(), "org/model", "main") == "main"
+    assert "could not resolve" in caplog.text
+
+
+def test_registry_reports_the_commit():
+    registry = sw_models.ModelRegistry()
+    registry.register_loader("fake", lambda model_id, revision: SimpleNamespace(
+        config=SimpleNamespace(_commit_hash=COMMIT)))
+    assert registry.commit("fake", "org/model", "main") == COMMIT
+    row, = registry.stats()
+    assert row['commit'] == COMMIT and row['misses'] == 1
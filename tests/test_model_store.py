@@ -0,0 +1,105 @@
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+huggingface_hub = pytest.importorskip("huggingface_hub")
+
+import model_store as sw_mstore
+
+COMMIT = "a" * 40
+FILES = {'config.json': b'{"model_type": "fake"}', 'model.safetensors': b"\x00\x01weights" * 100}
+LFS_FILES = {'model.safetensors'}
+
+
+def git_blob_id(content:bytes) -> str:
+    return hashlib.sha1(f"blob {len(content)}\0".encode() + content).hexdigest()
+
+
+@pytest.fixture
+def fake_hub(monkeypatch):
+    '''a hub holding FILES at COMMIT, with their checksums; `hub.files` can be changed to serve bad content'''
+    hub = SimpleNamespace(files=dict(FILES), n_downloads=0)
+
+    class FakeHfApi:
+        def __init__(self, token=None):
+            pass
+
+        def model_info(self, model_id, revision=None, files_metadata=False):
+            siblings = [SimpleNamespace(
+                rfilename=name,
+                lfs=SimpleNamespace(sha256=hashlib.sha256(content).hexdigest()) if name in LFS_FILES else None,
+                blob_id=git_blob_id(content)) for name, content in FILES.items()]
+            return SimpleNamespace(sha=COMMIT, siblings=siblings)
+
+    def fake_download(model_id, filename, revision=None, token=None, local_dir=None):
+        assert revision == COMMIT # the files are fetched at the pinned commit
+        hub.n_downloads += 1
+        path = os.path.join(local_dir, filename)
+        with open(path, "wb") as f:
+            f.write(hub.files[filename])
+        return path
+
+    monkeypatch.setattr(huggingface_hub, "HfApi", FakeHfApi)
+    monkeypatch.setattr(huggingface_hub, "hf_hub_download", fake_download)
+    return hub
+
+
+def test_fetch_resolve_and_load(tmp_path, fake_hub):
+    store = sw_mstore.ModelStore(str(tmp_path))
+    manifest = store.fetch("org/model", "main")
+    assert manifest['commit'] == COMMIT
+    assert set(manifest['files']) == set(FILES)
+    assert store.resolve("org/model", "main") == COMMIT
+    assert store.resolve("org/model", COMMIT) == COMMIT
+    assert store.verify("org/model", "main") == []
+
+    model = store.load("org/model", "main", lambda path: SimpleNamespace(path=path))
+    assert model.resolved_commit == COMMIT
+    with open(os.path.join(model.path, "config.json"), "rb") as f:
+        assert f.read() == FILES['config.json']
+    report, = store.load_reports()
+    assert report['commit'] == COMMIT and report['files'] == 2
+
+
+def test_resolve_unknown_revision(tmp_path, fake_hub):
+    store = sw_mstore.ModelStore(str(tmp_path))
+    with pytest.raises(FileNotFoundError, match="fetch it first"):
+        store.resolve("org/model", "main")
+
+
+@pytest.mark.parametrize("name", ["model.safetensors", "config.json"])
+def test_fetch_rejects_a_checksum_mismatch(tmp_path, fake_hub, name):
+    fake_hub.files[name] = FILES[name] + b"corrupted"
+    store = sw_mstore.ModelStore(str(tmp_path))
+    with pytest.raises(ValueError, match=name):
+        store.fetch("org/model", "main")
+    with pytest.raises(FileNotFoundError):
+        store.resolve("org/model", "main") # nothing is pinned
+
+
+def test_damaged_snapshot_is_not_loaded(tmp_path, fake_hub):
+    store = sw_mstore.ModelStore(str(tmp_path))
+    manifest = store.fetch("org/model", "main")
+    blob = os.path.join(str(tmp_path), "blobs", manifest['files']['model.safetensors']['sha256'])
+    # same size, different content: only a full check sees it
+    content = bytearray(FILES['model.safetensors'])
+    content[0] ^= 0xff
+    with open(blob, "wb") as f:
+        f.write(bytes(content))
+    assert store.verify("org/model", "main", full=False) == []
+    assert store.verify("org/model", "main") == ["model.safetensors: sha256 does not match"]
+    with pytest.raises(ValueError, match="damaged"):
+        store.load("org/model", "main", lambda path: SimpleNamespace())
+    os.remove(blob)
+    assert store.verify("org/model", "main", full=False) == ["model.safetensors: missing"]
+
+
+def test_gc_frees_unreferenced_blobs(tmp_path, fake_hub):
+    store = sw_mstore.ModelStore(str(tmp_path))
+    store.fetch("org/model", "main")
+    assert store.gc() == 0
+    os.remove(os.path.join(str(tmp_path), "manifests", "org--model", f"{COMMIT}.json"))
+    assert store.gc() == sum(len(c) for c in FILES.values())
+    assert os.listdir(os.path.join(str(tmp_path), "blobs")) == []
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import obs_store as sw_store
+
+
+@pytest.fixture
+def parquet_file(tmp_path):
+    path = tmp_path / "train.parquet"
+    pd.DataFrame({'latitude': [1.0, 2.0, 3.0], 'longitude': [10.0, 20.0, 30.0],
+                  'predicted_class': ['humpback_whale', 'blue_whale', 'humpback_whale'],
+                  'date_option': ['2024-01-01', '2024-02-01', '2024-03-01']}).to_parquet(path)
+    return path
+
+
+class SlowHubStore(sw_store.ObservationStore):
+    '''a store whose "hub" answers version checks only when `answer` is set'''
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path)
+        self.answer = threading.Event()
+        self.n_remote = 0
+
+    def _local_path(self, dataset_id, data_files):
+        return None
+
+    def _remote_version(self, dataset_id, data_files):
+        self.n_remote += 1
+        self.answer.wait(10)
+        return "etag-1", "commit-1"
+
+
+@pytest.fixture
+def hub_store(parquet_file, monkeypatch):
+    hub = pytest.importorskip("huggingface_hub")
+    monkeypatch.setattr(hub, "hf_hub_download", lambda *args, **kwargs: str(parquet_file))
+    return SlowHubStore(parquet_file, check_interval_s=0.0)
+
+
+def test_query_filters_and_caches(parquet_file):
+    store = sw_store.ObservationStore()
+    df = store.query(str(parquet_file), "", species=['humpback_whale'])
+    assert list(df.columns) == ['lat', 'lon', 'species']
+    assert df['lat'].tolist() == [1.0, 3.0]
+    assert store.query(str(parquet_file), "", species=['humpback_whale']) is df
+    assert store.stats()['hits'] == 1
+
+
+def test_slow_version_check_does_not_block_cached_queries(hub_store):
+    hub_store.answer.set()
+    first = hub_store.query("org/data", "train.parquet")
+    hub_store.answer.clear()
+
+    # a check is due (interval 0): one thread waits on the hub...
+    checker = threading.Thread(target=hub_store.query, args=("org/data", "train.parquet"))
+    checker.start()
+    while hub_store.n_remote < 2:
+        time.sleep(0.01)
+    # ...the others are served the cached data at once
+    start_time = time.perf_counter()
+    assert hub_store.query("org/data", "train.parquet") is first
+    assert hub_store.schema_names("org/data", "train.parquet")[:2] == ['latitude', 'longitude']
+    assert time.perf_counter() - start_time < 1.0
+    assert hub_store.n_remote == 2
+    hub_store.answer.set()
+    checker.join()
+
+
+def test_first_load_is_single_flight(hub_store):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(hub_store.query("org/data", "train.parquet")))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.2)
+    hub_store.answer.set()
+    for t in threads:
+        t.join()
+    assert hub_store.n_remote == 1
+    assert len(results) == 4 and all(len(df) == 3 for df in results)
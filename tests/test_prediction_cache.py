@@ -0,0 +1,58 @@
+import prediction_cache as sw_pcache
+
+
+def test_memory_tier_is_lru():
+    cache = sw_pcache.PredictionCache(max_entries=2)
+    cache.put("a", "m", "c1", {'predictions': ["beluga"]})
+    cache.put("b", "m", "c1", {'predictions': ["fin_whale"]})
+    assert cache.get("a", "m", "c1") == {'predictions': ["beluga"]} # now the most recent
+    cache.put("c", "m", "c1", {'predictions': ["gray_whale"]})
+    assert cache.get("b", "m", "c1") is None
+    assert cache.get("a", "m", "c1") is not None
+    assert cache.stats()['entries_mem'] == 2
+
+
+def test_keyed_on_model_and_commit():
+    cache = sw_pcache.PredictionCache()
+    cache.put("a", "m", "c1", [1])
+    assert cache.get("a", "m", "c2") is None
+    assert cache.get("a", "other", "c1") is None
+    assert cache.get("a", "m", "c1") == [1]
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    db_path = str(tmp_path / "cache" / "predictions.sqlite")
+    cache = sw_pcache.PredictionCache(max_entries=1, db_path=db_path)
+    cache.put("a", "m", "c1", {'predictions': ["beluga"]})
+    cache.put("b", "m", "c1", {'predictions': ["fin_whale"]}) # evicts "a" from memory
+    assert cache.get("a", "m", "c1") == {'predictions': ["beluga"]}
+    assert cache.stats()['disk_hits'] == 1
+
+    restarted = sw_pcache.PredictionCache(db_path=db_path)
+    assert restarted.get("b", "m", "c1") == {'predictions': ["fin_whale"]}
+    assert restarted.get("b", "m", "c2") is None
+    stats = restarted.stats()
+    assert (stats['mem_hits'], stats['disk_hits'], stats['misses']) == (0, 1, 1)
+    assert restarted.get("b", "m", "c1") is not None
+    assert restarted.stats()['mem_hits'] == 1
+
+
+def test_get_or_compute_computes_once():
+    cache = sw_pcache.PredictionCache()
+    calls = []
+    def fn():
+        calls.append(1)
+        return {'predictions': ["beluga"]}
+    assert cache.get_or_compute("a", "m", "c1", fn) == {'predictions': ["beluga"]}
+    assert cache.get_or_compute("a", "m", "c1", fn) == {'predictions': ["beluga"]}
+    assert len(calls) == 1
+    assert cache.stats()['hit_rate'] == 0.5
+
+
+def test_get_or_compute_without_hash_bypasses_the_cache():
+    cache = sw_pcache.PredictionCache()
+    calls = []
+    for _ in range(2):
+        cache.get_or_compute(None, "m", "c1", lambda: calls.append(1) or [1])
+    assert len(calls) == 2
+    assert cache.stats()['entries_mem'] == 0
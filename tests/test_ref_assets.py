@@ -0,0 +1,44 @@
+import shutil
+
+import pytest
+
+import ref_assets as sw_assets
+import whale_viewer as sw_wv
+
+
+@pytest.fixture
+def image_dir(tmp_path):
+    return shutil.copytree(sw_assets.REF_IMAGE_DIR, tmp_path / "references")
+
+
+def test_prebuilt_thumbnails_are_read_not_made(tmp_path, image_dir, monkeypatch):
+    built = sw_assets.RefAssetCache(image_dir=image_dir, static_dir=tmp_path / "static")
+    n = built.export_static()
+    assert n == len(sw_wv.df_whale_img_ref) * len(sw_assets.SIZES)
+    assert (tmp_path / "static" / "ref" / sw_assets.PREBUILT_INDEX).exists()
+
+    def no_thumbnails(*args):
+        raise AssertionError("made a thumbnail that was prebuilt")
+    monkeypatch.setattr(sw_assets, "make_thumbnail", no_thumbnails)
+    cache = sw_assets.RefAssetCache(image_dir=image_dir, static_dir=tmp_path / "static")
+    whale_class = sw_wv.df_whale_img_ref.index[0]
+    asset = cache.get(whale_class, 'gallery')
+    assert asset.data == built.get(whale_class, 'gallery').data
+    assert asset.width <= sw_assets.SIZES['gallery']
+    assert cache.stats()['prebuilt'] == 1 and cache.stats()['build_s'] == 0
+
+
+def test_stale_or_missing_thumbnails_are_made(tmp_path, image_dir):
+    sw_assets.RefAssetCache(image_dir=image_dir, static_dir=tmp_path / "static").export_static()
+    first, second = sw_wv.df_whale_img_ref.index[:2]
+    # the source of the first species changes (here: becomes the second's image)
+    shutil.copyfile(image_dir / sw_wv.df_whale_img_ref.loc[second, "WHALE_IMAGES"],
+                    image_dir / sw_wv.df_whale_img_ref.loc[first, "WHALE_IMAGES"])
+    cache = sw_assets.RefAssetCache(image_dir=image_dir, static_dir=tmp_path / "static")
+    assert cache.get(first, 'gallery').content_hash == cache.get(second, 'gallery').content_hash
+    assert cache.stats()['prebuilt'] == 1 # the second only
+
+    # without a build step, everything is made on first use
+    unbuilt = sw_assets.RefAssetCache(image_dir=image_dir, static_dir=tmp_path / "empty")
+    unbuilt.get(first, 'viewer')
+    assert unbuilt.stats()['prebuilt'] == 0 and unbuilt.stats()['build_s'] > 0
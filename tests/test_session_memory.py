@@ -0,0 +1,42 @@
+import numpy as np
+
+import session_memory as sw_mem
+
+
+class FakeState(dict):
+    '''stands in for streamlit's SafeSessionState'''
+    @property
+    def filtered_state(self):
+        return self
+
+
+def test_accounting_by_group(tmp_path):
+    gov = sw_mem.SessionMemoryGovernor(spill_dir=str(tmp_path), sweep_interval_s=1e9)
+    state = FakeState(image=np.zeros((100, 100, 3), np.uint8), image_md5="abc",
+                      full_data={'author_email': "a@b.c", 'latitude': 46.5},
+                      whale_prediction1="humpback_whale", other="x" * 10)
+    gov.touch("s1", state)
+    gov.release("s1")
+    stats = gov.stats()
+    assert stats['images_bytes'] == 30000
+    assert stats['full_data_bytes'] > 0
+    assert stats['predictions_bytes'] == len("humpback_whale")
+    assert stats['total_bytes'] == sum(stats[f"{g}_bytes"] for g in ('images', 'full_data', 'predictions', 'other'))
+    row, = gov.session_stats()
+    assert row['full_data_bytes'] == stats['full_data_bytes']
+
+
+def test_spill_keeps_metadata_and_predictions(tmp_path):
+    gov = sw_mem.SessionMemoryGovernor(spill_dir=str(tmp_path), idle_s=0.0, sweep_interval_s=1e9)
+    image = np.arange(300, dtype=np.uint8).reshape(10, 10, 3)
+    state = FakeState(image=image, image_md5="abc", full_data={'latitude': 46.5},
+                      whale_prediction1="humpback_whale")
+    gov.touch("s1", state)
+    gov.release("s1")
+    gov.sweep()
+    assert isinstance(state['image'], sw_mem.SpilledArray)
+    stats = gov.stats()
+    assert stats['images_bytes'] == 0 and stats['full_data_bytes'] > 0 and stats['predictions_bytes'] > 0
+    gov.touch("s1", state)
+    np.testing.assert_array_equal(state['image'], image)
+    assert state['full_data'] == {'latitude': 46.5}
@@ -0,0 +1,145 @@
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import st_logs as sw_logs
+
+
+def make_record(msg:str, t:float, level:int = logging.INFO, name:str = "mod_a") -> logging.LogRecord:
+    record = logging.LogRecord(name, level, __file__, 1, msg, None, None, func="fn")
+    record.created = t
+    return record
+
+
+def test_ring_buffer_wraps_around():
+    buf = sw_logs.LogRingBuffer(maxlen=4)
+    for i in range(10):
+        buf.append(make_record(f"msg {i}", 1000.0 + i))
+    assert len(buf) == 4
+    df = buf.query(newest_first=False)
+    assert list(df['message']) == ["msg 6", "msg 7", "msg 8", "msg 9"]
+    assert list(df['n']) == [7, 8, 9, 10]
+    assert [line.split(" - ")[-1] for line in buf] == ["msg 6", "msg 7", "msg 8", "msg 9"]
+    assert list(buf.query(limit=2)['message']) == ["msg 9", "msg 8"]
+
+
+def test_ring_buffer_filters():
+    buf = sw_logs.LogRingBuffer(maxlen=10)
+    buf.append(make_record("debug", 1000.0, logging.DEBUG, "mod_a"))
+    buf.append(make_record("info", 1001.0, logging.INFO, "mod_b"))
+    buf.append(make_record("warning", 1002.0, logging.WARNING, "mod_a"))
+    buf.append(make_record("error", 1003.0, logging.ERROR, "mod_b"))
+    assert buf.modules() == ["mod_a", "mod_b"]
+    assert list(buf.query(min_level=logging.WARNING)['message']) == ["error", "warning"]
+    assert list(buf.query(levels=["INFO", "DEBUG"])['message']) == ["info", "debug"]
+    assert list(buf.query(modules=["mod_b"])['message']) == ["error", "info"]
+    assert list(buf.query(modules=["unknown"])['message']) == []
+    assert list(buf.query(min_level=logging.INFO, modules=["mod_a"])['message']) == ["warning"]
+    buf.clear()
+    assert len(buf) == 0 and buf.records() == []
+
+
+def test_ring_buffer_time_range_out_of_order():
+    # records of different threads can be appended out of time order
+    buf = sw_logs.LogRingBuffer(maxlen=4)
+    for i, t in enumerate([1000.0, 1003.0, 1001.0, 1004.0, 1002.0, 1005.0]):
+        buf.append(make_record(f"msg {i}", t))
+    # kept: msg 2 (1001), msg 3 (1004), msg 4 (1002), msg 5 (1005)
+    since, until = datetime.fromtimestamp(1001.5), datetime.fromtimestamp(1004.0)
+    assert list(buf.query(since=since, until=until)['message']) == ["msg 4", "msg 3"]
+    assert list(buf.query(since=datetime.fromtimestamp(1004.0))['message']) == ["msg 5", "msg 3"]
+    assert list(buf.query(until=datetime.fromtimestamp(1002.0))['message']) == ["msg 4", "msg 2"]
+
+
+def test_segment_sink_rotates_and_indexes(tmp_path):
+    sink = sw_logs.LogSegmentSink(str(tmp_path), replica="r1", max_segment_bytes=300)
+    now = time.time()
+    for i in range(20):
+        sink.emit(make_record(f"message number {i}", now + i))
+    sink.close()
+    replica_dir = tmp_path / "r1"
+    index = sw_logs._read_index(str(replica_dir))
+    assert len(index) == sink.stats()['segments'] > 1
+    assert sum(entry['n'] for entry in index) == 20
+    assert not list(replica_dir.glob(f"{sw_logs.SEGMENT_PREFIX}*.jsonl")) # all compressed
+    for entry in index:
+        with gzip.open(replica_dir / entry['file'], "rt") as f:
+            ts = [json.loads(line)['t'] for line in f]
+        assert (min(ts), max(ts), len(ts)) == (entry['t_first'], entry['t_last'], entry['n'])
+
+
+def test_segment_sink_compresses_leftover(tmp_path):
+    replica_dir = tmp_path / "r1"
+    replica_dir.mkdir()
+    now = time.time()
+    with open(replica_dir / f"{sw_logs.SEGMENT_PREFIX}{int(now * 1000):013d}.jsonl", "w") as f:
+        for i in range(3):
+            f.write(json.dumps({'t': now + i, 'level': logging.INFO, 'module': "m", 'func': "f",
+                                'msg': f"left {i}"}) + "\n")
+        f.write('{"t": ') # a partly written line
+    sink = sw_logs.LogSegmentSink(str(tmp_path), replica="r1")
+    index = sw_logs._read_index(str(replica_dir))
+    assert [entry['n'] for entry in index] == [3]
+    assert not list(replica_dir.glob(f"{sw_logs.SEGMENT_PREFIX}*.jsonl"))
+    sink.close()
+
+
+def test_segment_sink_prunes_expired(tmp_path):
+    old = time.time() - 3600
+    for replica in ["r1", "gone"]:
+        sink = sw_logs.LogSegmentSink(str(tmp_path), replica=replica)
+        sink.emit(make_record("old", old))
+        sink.close()
+        for path in (tmp_path / replica).glob(f"{sw_logs.SEGMENT_PREFIX}*"):
+            os.utime(path, (old, old))
+
+    sink = sw_logs.LogSegmentSink(str(tmp_path), replica="r1", retention_s=60)
+    assert not list((tmp_path / "gone").glob(f"{sw_logs.SEGMENT_PREFIX}*"))
+    # the directory of a replica without segments goes once it is past the retention time too
+    os.utime(tmp_path / "gone", (old, old))
+    sink.emit(make_record("new", time.time()))
+    sink.rotate()
+    assert not (tmp_path / "gone").exists()
+    index = sw_logs._read_index(str(tmp_path / "r1"))
+    assert [entry['n'] for entry in index] == [1]
+    assert len(list((tmp_path / "r1").glob(f"{sw_logs.SEGMENT_PREFIX}*"))) == 1
+    sink.close()
+
+
+def test_archive_search(tmp_path):
+    now = float(int(time.time()) - 100) # whole seconds, exact through datetime
+    for replica, offset in [("r1", 0.0), ("r2", 0.5)]:
+        sink = sw_logs.LogSegmentSink(str(tmp_path), replica=replica, max_segment_bytes=300)
+        for i in range(10):
+            level = logging.WARNING if i % 3 == 0 else logging.INFO
+            sink.emit(make_record(f"{replica} event {i}", now + i + offset, level, f"mod_{i % 2}"))
+        sink.close()
+    archive = sw_logs.LogArchive(str(tmp_path))
+    assert archive.replicas() == ["r1", "r2"]
+    assert archive.stats()['replicas'] == 2
+
+    df = archive.tail(3)
+    assert list(df['message']) == ["r2 event 9", "r1 event 9", "r2 event 8"]
+    page = archive.search(limit=3, offset=3)
+    assert list(page['message']) == ["r1 event 8", "r2 event 7", "r1 event 7"]
+
+    assert list(archive.search(text="R1 EVENT 4")['message']) == ["r1 event 4"]
+    df = archive.search(min_level=logging.WARNING, replicas=["r2"])
+    assert list(df['message']) == ["r2 event 9", "r2 event 6", "r2 event 3", "r2 event 0"]
+    assert set(df['level']) == {"WARNING"}
+    df = archive.search(modules=["mod_1"], since=datetime.fromtimestamp(now + 5),
+                        until=datetime.fromtimestamp(now + 7.2))
+    assert list(df['message']) == ["r1 event 7", "r2 event 5", "r1 event 5"]
+
+
+def test_archive_reads_unindexed_segment(tmp_path):
+    sink = sw_logs.LogSegmentSink(str(tmp_path), replica="r1")
+    sink.emit(make_record("still being written", time.time()))
+    archive = sw_logs.LogArchive(str(tmp_path))
+    segs = archive.segments()
+    assert len(segs) == 1 and segs[0]['n'] is None
+    assert list(archive.search()['message']) == ["still being written"]
+    sink.close()
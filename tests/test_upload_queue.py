@@ -0,0 +1,217 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("huggingface_hub") # for CommitOperationAdd, even with the local hub
+
+import upload_queue as sw_upload
+
+
+def wait_until(predicate, timeout:float = 10.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def commits(hub_dir) -> list:
+    path = os.path.join(hub_dir, "datasets", sw_upload.OBS_REPO_ID, "commits.jsonl")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class HubHTTPError(Exception):
+    '''an error with a `response`, like `huggingface_hub.utils.HfHubHTTPError`'''
+    def __init__(self, status_code:int):
+        super().__init__(f"{status_code} error")
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+class FlakyHubApi(sw_upload.LocalHubApi):
+    '''fails the first `n_failures` commits (with `error`, a connection error by default)'''
+    def __init__(self, root, n_failures:int, error:Exception = None):
+        super().__init__(root)
+        self.n_failures = n_failures
+        self.error = error or ConnectionError("flaky")
+        self.n_calls = 0
+
+    def create_commit(self, repo_id, operations, commit_message, repo_type="dataset", **kwargs):
+        self.n_calls += 1
+        if self.n_calls <= self.n_failures:
+            raise self.error
+        return super().create_commit(repo_id, operations, commit_message, repo_type, **kwargs)
+
+
+class RejectingHubApi(sw_upload.LocalHubApi):
+    '''rejects every commit that contains `bad_path`'''
+    def __init__(self, root, bad_path:str):
+        super().__init__(root)
+        self.bad_path = bad_path
+
+    def create_commit(self, repo_id, operations, commit_message, repo_type="dataset", **kwargs):
+        if any(op.path_in_repo == self.bad_path for op in operations):
+            raise HubHTTPError(400)
+        return super().create_commit(repo_id, operations, commit_message, repo_type, **kwargs)
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+    def _make(api=None, **kwargs):
+        kwargs.setdefault('flush_interval_s', 3600)
+        kwargs.setdefault('backoff_s', 0.01)
+        kwargs.setdefault('max_backoff_s', 0.05)
+        q = sw_upload.UploadQueue(api or sw_upload.LocalHubApi(str(tmp_path / "hub")),
+                                  spool_dir=str(tmp_path / "spool"), **kwargs)
+        queues.append(q)
+        return q
+    yield _make
+    for q in queues:
+        q.stop()
+
+
+def test_batches_items_into_one_commit(tmp_path, make_queue):
+    q = make_queue(batch_size=3)
+    ids = [q.enqueue(f"metadata/a/{i}.json", json.dumps({'i': i})) for i in range(3)]
+    assert wait_until(lambda: q.status()['pending'] == 0)
+    assert [len(c['files']) for c in commits(tmp_path / "hub")] == [3]
+    assert [q.item_status(i) for i in ids] == ['committed'] * 3
+    with open(tmp_path / "hub" / "datasets" / sw_upload.OBS_REPO_ID / "metadata/a/1.json") as f:
+        assert json.load(f) == {'i': 1}
+
+
+def test_waits_for_the_batch_size_or_a_flush(tmp_path, make_queue):
+    q = make_queue(batch_size=10)
+    item_id = q.enqueue("metadata/a/0.json", "{}")
+    time.sleep(0.3)
+    assert q.item_status(item_id) == 'pending'
+    q.flush()
+    assert wait_until(lambda: q.item_status(item_id) == 'committed')
+
+
+def test_retries_failed_commits(tmp_path, make_queue):
+    api = FlakyHubApi(str(tmp_path / "hub"), n_failures=2)
+    q = make_queue(api, batch_size=2)
+    ids = [q.enqueue(f"metadata/a/{i}.json", "{}") for i in range(2)]
+    assert wait_until(lambda: all(q.item_status(i) == 'committed' for i in ids))
+    status = q.status()
+    assert status['failed_attempts'] == 2
+    assert status['failed_items'] == 0
+    assert status['committed'] == 2
+
+
+def test_items_survive_a_restart(tmp_path, make_queue):
+    api = FlakyHubApi(str(tmp_path / "hub"), n_failures=1000)
+    q = make_queue(api, batch_size=1)
+    item_id = q.enqueue("metadata/a/0.json", "{}")
+    assert wait_until(lambda: api.n_calls >= 1)
+    q.stop()
+    q2 = make_queue(batch_size=1)
+    q2.flush()
+    assert wait_until(lambda: q2.item_status(item_id) == 'committed')
+
+
+def test_malformed_record_is_set_aside(tmp_path, make_queue):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    (spool / "00000000000000000001-deadbeef.json").write_text("{not json")
+    (spool / "00000000000000000002-deadbeef.json").write_text(json.dumps({'content': "{}"}))
+    q = make_queue(batch_size=2)
+    ids = [q.enqueue(f"metadata/a/{i}.json", "{}") for i in range(2)]
+    q.flush() # the bad records may have started a commit of only the first item
+    assert wait_until(lambda: all(q.item_status(i) == 'committed' for i in ids))
+    assert q.item_status("00000000000000000001-deadbeef") == 'failed'
+    assert q.item_status("00000000000000000002-deadbeef") == 'failed'
+    assert q.status()['failed_items'] == 2
+    assert (spool / sw_upload.FAILED_DIR / "00000000000000000001-deadbeef.reason").exists()
+
+
+def test_rejected_item_does_not_block_the_others(tmp_path, make_queue):
+    api = RejectingHubApi(str(tmp_path / "hub"), bad_path="metadata/a/2.json")
+    q = make_queue(api, batch_size=6)
+    ids = [q.enqueue(f"metadata/a/{i}.json", "{}") for i in range(6)]
+    assert wait_until(lambda: q.status()['pending'] == 0)
+    assert [q.item_status(i) for i in ids] == ['committed'] * 2 + ['failed'] + ['committed'] * 3
+    # later items are committed in full batches again
+    more = [q.enqueue(f"metadata/b/{i}.json", "{}") for i in range(6)]
+    assert wait_until(lambda: all(q.item_status(i) == 'committed' for i in more))
+    assert len(commits(tmp_path / "hub")[-1]['files']) == 6
+
+
+def test_rejected_item_waits_for_another_commit(tmp_path, make_queue):
+    api = RejectingHubApi(str(tmp_path / "hub"), bad_path="metadata/a/0.json")
+    q = make_queue(api, batch_size=1)
+    item_id = q.enqueue("metadata/a/0.json", "{}")
+    # rejected alone, but nothing shows yet that the hub takes commits at all
+    assert wait_until(lambda: q.status()['failed_attempts'] >= 3)
+    assert q.item_status(item_id) == 'pending'
+    other_id = q.enqueue("metadata/a/1.json", "{}")
+    assert wait_until(lambda: q.item_status(other_id) == 'committed')
+    assert wait_until(lambda: q.item_status(item_id) == 'failed')
+
+
+@pytest.mark.parametrize("error", [HubHTTPError(401), HubHTTPError(403), HubHTTPError(503),
+                                   ConnectionError("down")])
+def test_hub_errors_set_nothing_aside(tmp_path, make_queue, error):
+    # an expired token or an outage: every commit fails, whatever it holds
+    api = FlakyHubApi(str(tmp_path / "hub"), n_failures=12, error=error)
+    q = make_queue(api, batch_size=4, max_per_commit=4)
+    ids = [q.enqueue(f"metadata/a/{i}.json", "{}") for i in range(4)]
+    assert wait_until(lambda: all(q.item_status(i) == 'committed' for i in ids))
+    assert q.status()['failed_items'] == 0
+    assert [len(c['files']) for c in commits(tmp_path / "hub")] == [4]
+
+
+def test_retry_failed_requeues(tmp_path, make_queue):
+    api = RejectingHubApi(str(tmp_path / "hub"), bad_path="metadata/a/0.json")
+    q = make_queue(api, batch_size=1)
+    item_id = q.enqueue("metadata/a/0.json", "{}")
+    q.enqueue("metadata/a/1.json", "{}")
+    assert wait_until(lambda: q.item_status(item_id) == 'failed')
+    api.bad_path = None
+    assert q.retry_failed() == 1
+    assert wait_until(lambda: q.item_status(item_id) == 'committed')
+    assert q.status()['failed_items'] == 0
+
+
+def test_failed_items_are_requeued_at_start(tmp_path, make_queue):
+    failed = tmp_path / "spool" / sw_upload.FAILED_DIR
+    failed.mkdir(parents=True)
+    record = {'path_in_repo': "metadata/a/0.json", 'content': "{}", 'enqueued_at': 0}
+    (failed / "00000000000000000001-deadbeef.json").write_text(json.dumps(record))
+    (failed / "00000000000000000001-deadbeef.reason").write_text("rejected")
+    q = make_queue(batch_size=1)
+    assert wait_until(lambda: q.item_status("00000000000000000001-deadbeef") == 'committed')
+    assert os.listdir(failed) == []
+
+
+def test_failed_items_are_requeued_periodically(tmp_path, make_queue):
+    api = RejectingHubApi(str(tmp_path / "hub"), bad_path="metadata/a/0.json")
+    q = make_queue(api, batch_size=1, retry_failed_s=0.5)
+    item_id = q.enqueue("metadata/a/0.json", "{}")
+    q.enqueue("metadata/a/1.json", "{}")
+    assert wait_until(lambda: q.item_status(item_id) == 'failed')
+    api.bad_path = None
+    assert wait_until(lambda: q.item_status(item_id) == 'committed')
+
+
+def test_committed_ids_are_bounded(tmp_path, make_queue):
+    q = make_queue(batch_size=1, max_committed_ids=3)
+    ids = [q.enqueue(f"metadata/a/{i}.json", "{}") for i in range(5)]
+    assert wait_until(lambda: q.status()['committed'] == 5)
+    assert [q.item_status(i) for i in ids] == ['unknown'] * 2 + ['committed'] * 3
+
+
+def test_processes_get_their_own_spool_slot(tmp_path):
+    pytest.importorskip("fcntl")
+    first = sw_upload._claim_spool_dir(str(tmp_path))
+    second = sw_upload._claim_spool_dir(str(tmp_path))
+    assert first != second
+    assert os.path.dirname(first) == os.path.dirname(second) == str(tmp_path)